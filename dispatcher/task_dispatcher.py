@@ -1,17 +1,30 @@
+import functools
+import multiprocessing
 import signal
 import subprocess
 import threading
+from typing import List
 
 import redis
 from loguru import logger
 
-from gw.dispatcher import ProcDispatcher
+from gw.backlog import DispatchBacklog
+from gw.dispatcher import (
+    Dispatcher,
+    ProcDispatcher,
+    QueueDispatcher,
+    make_dispatch_strategy,
+)
+from gw.imagecache import ImageCache, ImagePrefetcher, ftp_connect
 from gw.runner import RunnerPool, WorkerStarter
 from gw.settings import get_app_settings
+from gw.stats import ModelStats
 from gw.streams import Streams
 from gw.tasks import TaskPool
 from gw.utils import generate_a_random_hex_str
 
+import task_proc_runner
+
 
 # Use to fork runer process.
 class SubprocessStarter(WorkerStarter):
@@ -19,6 +32,38 @@ class SubprocessStarter(WorkerStarter):
         subprocess.Popen(["python", "task_proc_runner.py", name, model_id])
 
 
+# Fork runner process from a forkserver which already imported heavy modules,
+# new runner skips interpreter start and imports, only loads its model.
+class ForkServerStarter(WorkerStarter):
+    def __init__(self, preload: List[str]):
+        self._ctx = multiprocessing.get_context("forkserver")
+
+        # Modules can't import are skipped by forkserver.
+        self._ctx.set_forkserver_preload(["task_proc_runner"] + preload)
+
+    def start_runner(self, name, model_id):
+        # Reap runners exited.
+        multiprocessing.active_children()
+
+        # Daemon runners get SIGTERM when dispatcher exits, finish the inference
+        # in hand and stop, so dispatcher shutdown never waits for idle runners.
+        p = self._ctx.Process(
+            target=task_proc_runner.run,
+            args=(name, model_id),
+            name=f"runner-{name}",
+            daemon=True,
+        )
+        p.start()
+
+
+def make_starter(name: str, preload: List[str]) -> WorkerStarter:
+    if name == "subprocess":
+        return SubprocessStarter()
+    if name == "forkserver":
+        return ForkServerStarter(preload)
+    raise ValueError(f"unknown runner starter {name}")
+
+
 def make_signal_handler(evt: threading.Event):
     def handler(signum, frame):
         evt.set()
@@ -26,6 +71,13 @@ def make_signal_handler(evt: threading.Event):
     return handler
 
 
+def rebalance(dispatcher: Dispatcher):
+    try:
+        dispatcher.rebalance()
+    except Exception as e:
+        logger.error(f"rebalance runners failed, {e}")
+
+
 def main():
 
     settings = get_app_settings()
@@ -52,26 +104,75 @@ def main():
     )
 
     # Initlize runner pool.
-    # We'll use subprocess to start new runner.
-    starter = SubprocessStarter()
-    runnerpool = RunnerPool(connection_pool=rdb.connection_pool, starter=starter)
+    # New runner takes task only after its model loaded.
+    starter = make_starter(settings.runner_starter, settings.runner_preload_modules)
+    runnerpool = RunnerPool(
+        connection_pool=rdb.connection_pool, starter=starter, wait_ready=True
+    )
     logger.info(f"connect runner pool, use {type(starter)} as starter.")
 
+    # Index runners left by older dispatcher which has no runner registry.
+    runnerpool.rebuild_registry()
+
     # Initlize dispatcher.
-    dispatcher = ProcDispatcher(
-        rdb=rdb, runner_pool=runnerpool, max_runner=settings.runner_slot_num
+    if settings.dispatch_mode == "queue":
+        dispatcher = QueueDispatcher(
+            rdb=rdb, runner_pool=runnerpool, max_runner=settings.runner_slot_num
+        )
+    else:
+        stats = ModelStats(connection_pool=rdb.connection_pool)
+        strategy = make_dispatch_strategy(
+            settings.dispatch_strategy,
+            settings.runner_slot_num,
+            stats=stats,
+            prewarm=settings.dispatch_prewarm,
+            multi_model=settings.runner_multi_model,
+        )
+        dispatcher = ProcDispatcher(
+            rdb=rdb,
+            runner_pool=runnerpool,
+            max_runner=settings.runner_slot_num,
+            dispatch_strategy=strategy,
+            stats=stats,
+            backlog=DispatchBacklog(
+                retry_base_ms=settings.dispatch_retry_base_ms,
+                retry_max_ms=settings.dispatch_retry_max_ms,
+                connection_pool=rdb.connection_pool,
+            ),
+        )
+    logger.info(
+        f"init dispatcher, max runner number {dispatcher.runner_num}, "
+        + f"mode {settings.dispatch_mode}, strategy {settings.dispatch_strategy}"
     )
-    logger.info(f"init dispatcher, max runner number {dispatcher.runner_num}")
 
     # Make consumer name to receive message.
     # Recive task create messag from this stream.
     consumer = f"{generate_a_random_hex_str(length=8)}::dispatcher::consumer"
-    task_create_stream = Streams(rdb=rdb).task_create
+    task_create_stream = Streams(
+        rdb=rdb, claim_interval_ms=settings.stream_claim_interval_ms
+    ).task_create
     logger.info(
         f"use task create stream, stream name {task_create_stream.stream}, "
         + f"readgroup {task_create_stream.readgroup}, consumer {consumer}"
     )
 
+    # Prefetch images of new tasks into local cache, runners read them from there.
+    prefetcher = None
+    if settings.image_cache:
+        prefetcher = ImagePrefetcher(
+            ImageCache(settings.image_cache_root, settings.image_cache_max_mb << 20),
+            functools.partial(
+                ftp_connect,
+                settings.ftp_host,
+                settings.ftp_port,
+                settings.ftp_user,
+                settings.ftp_password,
+                settings.ftp_timeout_s,
+            ),
+            workers=settings.image_prefetch_workers,
+        )
+        logger.info(f"prefetch images into {settings.image_cache_root}")
+
     # Make stop flag and register signal handler.
     stop_evt = threading.Event()
     signal.signal(signal.SIGTERM, make_signal_handler(stop_evt))
@@ -80,36 +181,71 @@ def main():
     logger.info("start message loop.")
     while not stop_evt.is_set():
 
-        # Pull one message from stream, block 1000 ms,
+        # Pull a batch of messages from stream, block 1000 ms when stream is idle,
         # Which give use a chance to check if stop flag set.
-        messages = task_create_stream.pull(consumer, count=1, block=1 * 1000)
+        messages = task_create_stream.pull_batch(
+            consumer, count=settings.stream_pull_batch_size, block=1 * 1000
+        )
 
-        # Ignore if no message come.
+        # Ignore if no message come, but still retry deferred or queued work.
         if len(messages) == 0:
+            rebalance(dispatcher)
             continue
 
-        msg = messages[0]
-        tid = msg.data["task_id"].decode()
-        logger.info(f"receive message {msg.id}, task id {tid}")
+        # Clean up dead runner once before dispatch this batch.
+        try:
+            runnerpool.clean_dead_runners(settings.runner_start_timeout_s)
+        except Exception as e:
+            logger.error(f"clean dead runners failed, {e}")
 
-        # Ignore if task invalid, but consume this message.
-        task = taskpool.get(task_id=tid)
-        if task is None:
-            msg.ack()
-            continue
+        # Messages handled will be acked together after the batch.
+        acks = []
+        tasks = []
+        for msg in messages:
+            tid = msg.data["task_id"].decode()
+            logger.info(f"receive message {msg.id}, task id {tid}")
 
-        # Then dispatch inference task.
-        # Clean up dead runner before dispatch task.
+            # Ignore if task invalid, but consume this message.
+            task = taskpool.get(task_id=tid)
+            if task is None:
+                acks.append(msg.id)
+                continue
+            tasks.append((msg, task))
+
+        # Start fetching images before dispatch, runner may take a while to start.
+        if prefetcher is not None:
+            try:
+                paths = dict.fromkeys(
+                    url
+                    for _, task in tasks
+                    for obj in task.object_list
+                    for url in obj.image_url_list
+                )
+                prefetcher.prefetch(paths)
+            except Exception as e:
+                logger.error(f"prefetch images failed, {e}")
+
+        # Let strategy see the whole batch before dispatch.
         try:
-            runnerpool.clean_dead_runners()
-            dispatcher.dispatch(task)
-            logger.info(f"task dispatch, id {task.task_id}")
-            msg.ack()
+            dispatcher.prepare([task for _, task in tasks])
         except Exception as e:
-            logger.error(f"dispatch failed, {e}")
-            pass
+            logger.error(f"prepare dispatch failed, {e}")
+
+        # Then dispatch inference task.
+        for msg, task in tasks:
+            try:
+                dispatcher.dispatch(task)
+                logger.info(f"task dispatch, id {task.task_id}")
+                acks.append(msg.id)
+            except Exception as e:
+                logger.error(f"dispatch failed, {e}")
+
+        task_create_stream.ack_many(acks)
+        rebalance(dispatcher)
 
     logger.info("stop message loop, cleanup...")
+    if prefetcher is not None:
+        prefetcher.close()
     rdb.close()
 
 
@@ -2,14 +2,21 @@ import json
 import os
 import signal
 import threading
+import time
 from datetime import datetime
+from typing import Optional, Tuple
 
 import redis
 from loguru import logger
 
+from gw.modelcache import ModelCache
+from gw.models import InferenceObject
+from gw.redis_keys import RedisKeys
+from gw.resultcache import ResultCache
 from gw.runner import Command, Runner
 from gw.settings import get_app_settings
-from gw.streams import Streams
+from gw.stats import ModelStats
+from gw.streams import RedisStream, StreamMessage, Streams
 from gw.tasks import InferenceResult, InferenceState, TaskPool
 
 
@@ -46,7 +53,7 @@ def load_model(name: str):
         class FakeProc:
             def run_inference(self, image_files, extra_args=None):
                 return InferenceResult(
-                    type=model_id,
+                    type=name,
                     value="",
                     code="2002",
                     resImageUrl="",
@@ -62,7 +69,125 @@ def load_model(name: str):
     else:
         from gwproc.gwproc import GWProc
 
-        return GWProc(model_name=name)
+        settings = get_app_settings()
+        return GWProc(
+            model_name=name,
+            platform=settings.proc_platform,
+            device_id=settings.proc_device_id,
+            ftp={
+                "ip": settings.ftp_host,
+                "port": settings.ftp_port,
+                "user": settings.ftp_user,
+                "password": settings.ftp_password,
+                "pool_size": settings.ftp_pool_size,
+                "timeout": settings.ftp_timeout_s,
+                "request_timeout": settings.ftp_request_timeout_s,
+                "max_bytes": settings.ftp_max_bytes,
+                "keepalive": settings.ftp_keepalive_s,
+                "image_cache": {
+                    "root": settings.image_cache_root,
+                    "max_bytes": settings.image_cache_max_mb << 20,
+                } if settings.image_cache else None,
+            },
+            frames={
+                "root": settings.frame_store_root,
+                "max_bytes": (settings.frame_store_max_mb << 20) or None,
+                "linger_s": settings.frame_store_linger_s,
+            } if settings.frame_store else None,
+        )
+
+
+def to_inference_result(result) -> InferenceResult:
+    # Handlers return dict, JSON string from older ones, validate once here,
+    # results are read back from redis without validation.
+    if isinstance(result, InferenceResult):
+        return result
+    if isinstance(result, (str, bytes)):
+        return InferenceResult.model_validate_json(result)
+    return InferenceResult.model_validate(result)
+
+
+# Request fields never change result, images are keyed by content or path instead.
+_UNCACHED_ARGS = ("objectId", "typeList", "imageUrlList")
+
+
+def run_inference(
+    model, obj: InferenceObject, model_id: str, cache: Optional[ResultCache]
+) -> Tuple[InferenceResult, bool]:
+    # Return result, and if it comes from cache.
+    # Model not cacheable, like one deduplicating alerts against images seen before,
+    # or one can't fetch images alone, always runs inference.
+    extra_args = obj.model_dump(by_alias=True)
+    if cache is None or not getattr(model, "cacheable", False):
+        result = model.run_inference(obj.image_url_list, extra_args=extra_args)
+        return (to_inference_result(result), False)
+
+    # Path sent again hits without image fetch.
+    params = {k: v for k, v in extra_args.items() if k not in _UNCACHED_ARGS}
+    path_key = ResultCache.path_key(model_id, obj.image_url_list, params)
+    result = cache.get_by_path(path_key)
+    if result is not None:
+        logger.info(f"result cache hit by path, model {model_id}")
+        return (result, True)
+
+    fetched = model.fetch_images(obj.image_url_list)
+    if not fetched[0]:
+        return (to_inference_result(model.infer_images(fetched, extra_args=extra_args)), False)
+
+    # Same images under other paths hit without inference.
+    content_key = ResultCache.content_key(model_id, fetched[1], params)
+    result = cache.get(content_key, path_key)
+    if result is not None:
+        logger.info(f"result cache hit by content, model {model_id}")
+        return (result, True)
+
+    # Only succeeded inference is cached, failed one may pass next time.
+    result = to_inference_result(model.infer_images(fetched, extra_args=extra_args))
+    if result.code == "2000":
+        cache.put(content_key, result, path_key)
+    return (result, False)
+
+
+def run_task(msg: StreamMessage, runner: Runner, taskpool: TaskPool, model, model_id: str,
+             complete_stream: RedisStream, stats: ModelStats,
+             cache: Optional[ResultCache] = None):
+    tid = msg.data["tid"].decode()
+    oid = msg.data["oid"].decode()
+    logger.info(f"task id {tid}, object id {oid}")
+
+    task = taskpool.get(tid)
+    if task is None:
+        logger.warning(f"no such task {tid}")
+        msg.ack()
+        return
+
+    obj = task.get_object(oid)
+    if obj is None:
+        logger.warning(f"no such object in task {oid}")
+        msg.ack()
+        return
+
+    logger.info(
+        f"run new inference, task id {task.task_id} object {obj.object_id}, model {model_id}, "
+        + f"image url {str(obj.image_url_list)}"
+    )
+    runner.task = task.task_id
+    task.record_inference(obj, model_id, InferenceState.running)
+
+    # Run inference, measure service time for dispatcher, cache hits not counted.
+    start = time.monotonic()
+    result, cached = run_inference(model, obj, model_id, cache)
+    if not cached:
+        stats.record_service_time(model_id, time.monotonic() - start)
+
+    # Write result and count down inferences remaining of task.
+    # Notify post process only when all inferences of task complete.
+    remaining = task.record_inference(obj, model_id, InferenceState.complete, result)
+    if remaining == 0:
+        complete_stream.publish({"task_id": tid})
+        logger.info(f"task {tid} all inferences complete, notified.")
+    msg.ack()
+    logger.info(f"task {tid} infernece complete, {remaining} remaining.")
 
 
 def main(name: str, model_id: str):
@@ -86,8 +211,25 @@ def main(name: str, model_id: str):
 
     # Connect stream, which use to notify that inference complete.
     complete_stream = Streams(rdb=rdb).task_inference_complete
+
+    # Runner command stream, keep one instance so claim interval works across pulls.
+    command_stream = RedisStream(
+        RedisKeys.runner_stream(name),
+        RedisKeys.runner_stream_readgroup(name),
+        rdb=rdb,
+        claim_interval_ms=settings.stream_claim_interval_ms,
+    )
     logger.info(f"notify complete message via {complete_stream.stream}")
 
+    # In queue mode tasks come from the queue shared by all runners of this model,
+    # command stream only brings stop command.
+    task_queue = None
+    if settings.dispatch_mode == "queue":
+        task_queue = Streams(
+            rdb=rdb, claim_interval_ms=settings.stream_claim_interval_ms
+        ).model_queue(model_id)
+        logger.info(f"pull task from {task_queue.stream}")
+
     # Make a message consumer name which use to receive commands.
     consumer = f"{name}::runner::consumer"
     logger.info(f"receive runner command use name {consumer}")
@@ -95,6 +237,19 @@ def main(name: str, model_id: str):
     # Connect task pool.
     taskpool = TaskPool(connection_pool=rdb.connection_pool)
 
+    # Model load and service time are measured for dispatcher.
+    stats = ModelStats(connection_pool=rdb.connection_pool)
+
+    # Results of repeated images are shared by all runners.
+    cache = None
+    if settings.result_cache:
+        cache = ResultCache(
+            ttl_s=settings.result_cache_ttl_s,
+            path_ttl_s=settings.result_cache_path_ttl_s,
+            max_entries=settings.result_cache_max_entries,
+            connection_pool=rdb.connection_pool,
+        )
+
     # A event to flag if it need to exit.
     stop_flag = threading.Event()
 
@@ -116,15 +271,41 @@ def main(name: str, model_id: str):
         + f"update period {settings.runner_heartbeat_update_period_s} second(s)."
     )
 
-    # Load model.
-    model = load_model(model_id)
+    # Load model, measure load time for dispatcher.
+    def load(m: str):
+        start = time.monotonic()
+        model = load_model(m)
+        load_s = time.monotonic() - start
+        stats.record_load_time(m, load_s)
+        logger.info(f"model {m} loaded in {load_s:.2f} second(s)")
+        return model
+
+    # Multi model runner keeps models in a cache, and loads model task wanted on demand,
+    # others hold only one model.
+    models = ModelCache(
+        load,
+        budget_bytes=settings.runner_model_budget_mb << 20,
+        max_models=settings.runner_max_models if settings.runner_multi_model else 1,
+        release=lambda m, model: model.release(),
+    )
+    models.get(model_id)
+
+    # Model loaded, dispatcher may send task to this runner now.
+    runner.mark_ready()
+    logger.info(f"runner {name} ready.")
 
     logger.info("start message loop.")
     while not stop_flag.is_set():
 
         # Pull one message form command, block 1000 ms.
         # Give a chance to check if stop flag was set.
-        messages = runner.stream.pull(consumer, count=1, block=1 * 1000)
+        # In queue mode check command without blocking, then block on task queue.
+        if task_queue is None:
+            messages = command_stream.pull(consumer, count=1, block=1 * 1000)
+        else:
+            messages = command_stream.pull(consumer, count=1)
+            if len(messages) == 0:
+                messages = task_queue.pull(consumer, count=1, block=1 * 1000)
 
         # Ignore when no message receive.
         if len(messages) == 0:
@@ -138,49 +319,29 @@ def main(name: str, model_id: str):
         cmd = msg.data["cmd"].decode()
 
         if cmd == Command.task:
-            tid = msg.data["tid"].decode()
-            oid = msg.data["oid"].decode()
-            logger.info(f"task id {tid}, object id {oid}")
-
-            task = taskpool.get(tid)
-            if task is None:
-                logger.warning(f"no such task {tid}")
-                msg.ack()
-                continue
-
-            obj = task.get_object(oid)
-            if obj is None:
-                logger.warning(f"no such object in task {oid}")
-                msg.ack()
-                continue
-
-            logger.info(
-                f"run new inference, task id {task.task_id} object {obj.object_id}, model {model_id}, "
-                + f"image url {str(obj.image_url_list)}"
-            )
-            task.update_inference_state(obj, model_id, InferenceState.running)
-
-            # Run inference.
-            result = model.run_inference(
-                obj.image_url_list, extra_args=obj.model_dump(by_alias=True)
-            )
-            task.set_inference_result(obj, model_id, result)
-
-            # Update task status to let dispatcher know inference running.
-            task.update_inference_state(obj, model_id, InferenceState.complete)
-            runner.is_busy = True
-            runner.utime = datetime.now()
-            runner.task = task.task_id
-
-            # Notify post process that inference complete.
-            complete_stream.publish({"task_id": tid})
-            msg.ack()
-            logger.info(f"task {tid} infernece complete, notified.")
-
-            # Update runner status make dispatcher know I'm available.
-            runner.task = None
-            runner.is_busy = False
-
+            # Dispatcher marks runner busy when it claims this runner,
+            # in queue mode runner marks itself, so it won't be stopped.
+            # Always make runner available again, whatever the task result is.
+            if task_queue is not None:
+                runner.is_busy = True
+            try:
+                task_model = model_id
+                if settings.runner_multi_model and "model" in msg.data:
+                    task_model = msg.data["model"].decode()
+
+                # Models this runner holds change, let dispatcher know.
+                loaded = task_model in models
+                model = models.get(task_model)
+                if not loaded:
+                    runner.models = models.models()
+
+                run_task(
+                    msg, runner, taskpool, model, task_model, complete_stream, stats, cache
+                )
+            finally:
+                runner.utime = datetime.now()
+                runner.task = None
+                runner.is_busy = False
             continue
 
         # Command is stop, set stop flag.
@@ -195,18 +356,17 @@ def main(name: str, model_id: str):
     # Set exit flag
     logger.info("message loop stopped, cleanup...")
     runner.clean_heartbeat()
-    model.release()
+    models.clear()
     runner.is_alive = False
     rdb.close()
 
 
-if __name__ == "__main__":
+def run(name: str, model_id: str):
+    # Entry of runner process, started by command line or forked by forkserver.
     from multiprocessing import current_process
 
     from gw.utils import initlize_logger
 
-    (name, model_id) = read_name_and_model_id_from_cli()
-
     initlize_logger(f"runner-{name}")
 
     logger.info(
@@ -216,3 +376,8 @@ if __name__ == "__main__":
     )
     main(name, model_id)
     logger.info(f"runner {name} shutdown.")
+
+
+if __name__ == "__main__":
+    (name, model_id) = read_name_and_model_id_from_cli()
+    run(name, model_id)
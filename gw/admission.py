@@ -0,0 +1,168 @@
+import math
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as aioredis
+
+from .redis_keys import RedisKeys
+
+
+@dataclass(slots=True)
+class LoadStatus:
+    # Tasks created but not dispatched yet.
+    create_pending: int = 0
+    # Inferences waiting for a runner, in model queues or dispatch backlog.
+    model_depths: Dict[str, int] = field(default_factory=dict)
+    # Runners holding each model.
+    model_runners: Dict[str, int] = field(default_factory=dict)
+    # Recent service time of one inference of each model.
+    service_s: Dict[str, float] = field(default_factory=dict)
+    runners: int = 0
+    busy_runners: int = 0
+    max_runner: int = 0
+
+    @property
+    def busy_ratio(self) -> float:
+        if self.max_runner <= 0:
+            return 1.0
+        return self.busy_runners / self.max_runner
+
+    def wait_s(self, model_id: str, default_service_s: float) -> float:
+        # Time to drain inferences queued for model with runners holding it now,
+        # a model without runner waits as if one starts.
+        service = self.service_s.get(model_id, default_service_s)
+        return self.model_depths.get(model_id, 0) * service / max(
+            self.model_runners.get(model_id, 0), 1
+        )
+
+    def create_wait_s(self, default_service_s: float) -> float:
+        # Tasks not dispatched are spread over all runner slots.
+        service = max(self.service_s.values(), default=default_service_s)
+        return self.create_pending * service / max(self.max_runner, 1)
+
+    def to_dict(self, default_service_s: float) -> Dict[str, Any]:
+        d = asdict(self)
+        d["busy_ratio"] = self.busy_ratio
+        d["create_wait_s"] = self.create_wait_s(default_service_s)
+        d["model_wait_s"] = {
+            m: self.wait_s(m, default_service_s) for m in self.model_depths
+        }
+        return d
+
+
+class AdmissionControl:
+
+    # Refuse new tasks when backlog would not drain in time,
+    # so tasks never queue silently until they expire.
+    #
+    # Load is read from redis at most once per refresh interval,
+    # every request in between uses the cached one.
+
+    # Service time of model without stats.
+    DEFAULT_SERVICE_S = 1.0
+
+    # Bounds of Retry-After given to clients.
+    MIN_RETRY_AFTER_S = 1
+    MAX_RETRY_AFTER_S = 60
+
+    def __init__(
+        self,
+        rdb: aioredis.Redis,
+        max_runner: int,
+        max_pending: int = 1000,
+        max_wait_s: float = 60,
+        busy_ratio: float = 0.9,
+        refresh_ms: int = 500,
+    ) -> None:
+        self._rdb = rdb
+        self._max_runner = max_runner
+        self._max_pending = max_pending
+        self._max_wait_s = max_wait_s
+        self._busy_ratio = busy_ratio
+        self._refresh_s = refresh_ms / 1000
+
+        self._status: Optional[LoadStatus] = None
+        self._expire_at = 0.0
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        return self._rdb
+
+    async def status(self) -> LoadStatus:
+        now = time.monotonic()
+        if self._status is None or now >= self._expire_at:
+            self._status = await self._read_status()
+            self._expire_at = now + self._refresh_s
+        return self._status
+
+    async def check(self, model_ids: List[str]) -> Optional[float]:
+        # Return seconds client should retry after, or None if task admitted.
+        status = await self.status()
+
+        waits = [status.create_wait_s(self.DEFAULT_SERVICE_S)]
+        over = status.create_pending >= self._max_pending
+
+        # Deep queue is fine while runners still free to take it.
+        if status.busy_ratio >= self._busy_ratio:
+            for m in set(model_ids):
+                wait = status.wait_s(m, self.DEFAULT_SERVICE_S)
+                waits.append(wait)
+                over = over or wait > self._max_wait_s
+
+        if not over:
+            return None
+        return min(max(math.ceil(max(waits)), self.MIN_RETRY_AFTER_S), self.MAX_RETRY_AFTER_S)
+
+    async def _create_pending(self) -> int:
+        # Messages delivered but not acked, plus ones not delivered yet.
+        stream, group = RedisKeys.stream_task_create, RedisKeys.stream_readgroup_task_create
+        try:
+            groups = await self.redis_client.xinfo_groups(stream)
+        except aioredis.ResponseError:
+            return 0
+        for g in groups:
+            if g["name"].decode() != group:
+                continue
+            pending = (await self.redis_client.xpending(stream, group))["pending"]
+            lag = g.get("lag")
+            if lag is None:
+                lag = await self.redis_client.xlen(stream)
+            return int(pending) + int(lag)
+        return int(await self.redis_client.xlen(stream))
+
+    async def _read_status(self) -> LoadStatus:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.smembers(RedisKeys.model_queues)
+        pipe.zrange(RedisKeys.dispatch_backlog, 0, -1)
+        pipe.zcard(RedisKeys.runner_registry)
+        pipe.zcard(RedisKeys.runner_idle)
+        pipe.get(RedisKeys.max_runner_num)
+        queued, deferred, runners, idle, max_runner = await pipe.execute()
+
+        models = sorted({m.decode() for m in queued} | {m.decode() for m in deferred})
+        pipe = self.redis_client.pipeline(transaction=False)
+        for m in models:
+            pipe.xlen(RedisKeys.model_stream(m))
+            pipe.zcard(RedisKeys.dispatch_backlog_model(m))
+            pipe.zcard(RedisKeys.runner_model_registry(m))
+        if len(models) > 0:
+            pipe.hmget(RedisKeys.model_stats, [f"{m}:service_s" for m in models])
+        resp = await pipe.execute()
+
+        status = LoadStatus(
+            create_pending=await self._create_pending(),
+            runners=int(runners),
+            busy_runners=int(runners) - int(idle),
+            max_runner=int(max_runner) if max_runner is not None else self._max_runner,
+        )
+        for i, m in enumerate(models):
+            depth = int(resp[3 * i]) + int(resp[3 * i + 1])
+            if depth > 0:
+                status.model_depths[m] = depth
+            status.model_runners[m] = int(resp[3 * i + 2])
+        if len(models) > 0:
+            for m, v in zip(models, resp[-1]):
+                if v is not None:
+                    status.service_s[m] = float(v)
+        return status
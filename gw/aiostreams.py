@@ -0,0 +1,326 @@
+import asyncio
+import signal
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import redis
+import redis.asyncio as aioredis
+import redis.typing
+from loguru import logger
+
+from .redis_keys import RedisKeys
+from .streams import RedisStream
+
+
+class AsyncStreamMessage:
+    def __init__(
+        self,
+        id: str,
+        data: Dict[bytes, bytes],
+        stream: "AsyncRedisStream",
+    ) -> None:
+        self._id = id
+        self._data = {x.decode(): data[x] for x in data.keys()}
+        self._stream = stream
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def data(self) -> Dict[str, bytes]:
+        return self._data
+
+    async def ack(self):
+        await self._stream.ack_many([self.id])
+
+
+AsyncMessageCallback = Callable[[AsyncStreamMessage], Awaitable[None]]
+
+
+class AsyncRedisStream:
+
+    CLAIM_MIN_IDLE_TIME_MS = RedisStream.CLAIM_MIN_IDLE_TIME_MS
+
+    def __init__(
+        self,
+        stream: str,
+        readgroup: str,
+        rdb: aioredis.Redis = None,
+        connection_pool: aioredis.ConnectionPool = None,
+        claim_interval_ms: int = 0,
+    ) -> None:
+
+        if rdb is not None:
+            self._rdb = rdb
+        elif connection_pool is not None:
+            self._rdb = aioredis.Redis(connection_pool=connection_pool)
+        else:
+            raise TypeError("must have a valid redis client.")
+
+        self._stream = stream
+        self._readgroup = readgroup
+        self._group_created = False
+
+        # XAUTOCLAIM runs at most once per interval, 0 means before every read.
+        self._claim_interval_ms = claim_interval_ms
+        self._next_claim_at = 0.0
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        return self._rdb
+
+    @property
+    def stream(self) -> str:
+        return self._stream
+
+    @property
+    def readgroup(self) -> str:
+        return self._readgroup
+
+    async def _ensure_group(self):
+        # Constructor can't await, so readgroup is created on first use.
+        if self._group_created:
+            return
+        try:
+            await self.redis_client.xgroup_create(
+                self.stream, self.readgroup, mkstream=True)
+        except redis.ResponseError:
+            pass
+        self._group_created = True
+
+    async def ensure_group(self):
+        # Writers publishing in their own pipeline make readgroup first.
+        await self._ensure_group()
+
+    def _make_messages(self, entries) -> List[AsyncStreamMessage]:
+        # Entries of deleted messages come back as (id, None), skip them.
+        return [
+            AsyncStreamMessage(m[0].decode(), m[1], self)
+            for m in entries
+            if m[1] is not None
+        ]
+
+    def _scan_message(self, resp) -> List[AsyncStreamMessage]:
+        # response like: [[b'test', [(b'1732536686488-0', {b'message': b'ok'})]]]
+        for x in resp:
+            if x[0].decode() == self.stream:
+                return self._make_messages(x[1])
+        return []
+
+    async def publish(self, message: Dict[redis.typing.FieldT, redis.typing.EncodableT]):
+        await self._ensure_group()
+        await self.redis_client.xadd(self.stream, message)
+
+    async def read_pending(
+        self, consumer: str, count: int = None, last_id: str = "0"
+    ) -> List[AsyncStreamMessage]:
+        # read messages delivered to this consumer but not acked yet.
+        await self._ensure_group()
+        resp = await self.redis_client.xreadgroup(
+            self.readgroup, consumer, {self.stream: last_id}, count=count
+        )
+        return self._scan_message(resp)
+
+    async def read_new(
+        self, consumer: str, count: int = None, block: int = None
+    ) -> List[AsyncStreamMessage]:
+        await self._ensure_group()
+        resp = await self.redis_client.xreadgroup(
+            self.readgroup, consumer, {self.stream: ">"}, count=count, block=block
+        )
+        return self._scan_message(resp)
+
+    async def claim(self, consumer: str, count: int = None) -> List[AsyncStreamMessage]:
+        # move idle pending messages of other consumers to myself,
+        # return them at once so no extra read is needed.
+        now = time.monotonic()
+        if now < self._next_claim_at:
+            return []
+        self._next_claim_at = now + self._claim_interval_ms / 1000
+
+        await self._ensure_group()
+        resp = await self.redis_client.xautoclaim(
+            self.stream,
+            self.readgroup,
+            consumer,
+            min_idle_time=self.CLAIM_MIN_IDLE_TIME_MS,
+            count=count,
+        )
+        return self._make_messages(resp[1])
+
+    async def ack_many(self, ids: List[str]) -> int:
+        if len(ids) == 0:
+            return 0
+        return int(await self.redis_client.xack(self.stream, self.readgroup, *ids))
+
+
+class AsyncStreams:
+
+    def __init__(self, rdb: aioredis.Redis = None,
+                 connection_pool: aioredis.ConnectionPool = None,
+                 claim_interval_ms: int = 0):
+        if rdb is not None:
+            self._rdb = rdb
+        elif connection_pool is not None:
+            self._rdb = aioredis.Redis(connection_pool=connection_pool)
+        else:
+            raise TypeError("stream must have a redis connection.")
+        self._claim_interval_ms = claim_interval_ms
+
+    @property
+    def task_create(self) -> AsyncRedisStream:
+        return AsyncRedisStream(
+            stream=RedisKeys.stream_task_create,
+            readgroup=RedisKeys.stream_readgroup_task_create,
+            rdb=self._rdb,
+            claim_interval_ms=self._claim_interval_ms,
+        )
+
+    @property
+    def task_inference_complete(self) -> AsyncRedisStream:
+        return AsyncRedisStream(
+            stream=RedisKeys.stream_inference_complete,
+            readgroup=RedisKeys.stream_readgroup_inference_complete,
+            rdb=self._rdb,
+            claim_interval_ms=self._claim_interval_ms,
+        )
+
+    @property
+    def task_finish(self) -> AsyncRedisStream:
+        return AsyncRedisStream(
+            stream=RedisKeys.stream_postprocess_complete,
+            readgroup=RedisKeys.stream_readgroup_postprocess_complete,
+            rdb=self._rdb,
+            claim_interval_ms=self._claim_interval_ms,
+        )
+
+
+class StreamConsumer:
+
+    def __init__(
+        self,
+        stream: AsyncRedisStream,
+        consumer: str,
+        handler: AsyncMessageCallback,
+        concurrency: int = 10,
+        block_ms: int = 1000,
+    ) -> None:
+        if concurrency <= 0:
+            raise ValueError("consumer concurrency must be positive.")
+
+        self._stream = stream
+        self._consumer = consumer
+        self._handler = handler
+        self._concurrency = concurrency
+        self._block_ms = block_ms
+
+        self._slots = asyncio.Semaphore(concurrency)
+        self._inflight: Set[asyncio.Task] = set()
+        self._stop = asyncio.Event()
+
+    @property
+    def stream(self) -> AsyncRedisStream:
+        return self._stream
+
+    @property
+    def consumer(self) -> str:
+        return self._consumer
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stop(self):
+        self._stop.set()
+
+    async def _handle(self, msg: AsyncStreamMessage):
+        # Message is acked only when handler returns,
+        # if handler raise, message stay pending and will be claimed again later.
+        try:
+            await self._handler(msg)
+            await msg.ack()
+        except Exception as e:
+            logger.error(f"handle message {msg.id} of {self.stream.stream} failed, {e}")
+        finally:
+            self._slots.release()
+
+    async def _acquire_slots(self) -> int:
+        # Wait at least one slot, then take all free slots without waiting.
+        # Never read more messages than we can handle, this is our backpressure.
+        await self._slots.acquire()
+        n = 1
+        while n < self._concurrency and not self._slots.locked():
+            await self._slots.acquire()
+            n += 1
+        return n
+
+    def _submit(self, messages: List[AsyncStreamMessage]):
+        for msg in messages:
+            t = asyncio.create_task(self._handle(msg))
+            self._inflight.add(t)
+            t.add_done_callback(self._inflight.discard)
+
+    async def _recover(self):
+        # Handle messages delivered to this consumer before last shutdown.
+        last_id = "0"
+        while not self._stop.is_set():
+            n = await self._acquire_slots()
+            messages = await self.stream.read_pending(self.consumer, count=n, last_id=last_id)
+            for _ in range(n - len(messages)):
+                self._slots.release()
+            if len(messages) == 0:
+                return
+            self._submit(messages)
+            last_id = messages[-1].id
+
+    async def run(self, drain_timeout: Optional[float] = None):
+        await self._recover()
+
+        while not self._stop.is_set():
+            n = await self._acquire_slots()
+            try:
+                messages = await self.stream.claim(self.consumer, count=n)
+                if len(messages) == 0:
+                    messages = await self.stream.read_new(
+                        self.consumer, count=n, block=self._block_ms
+                    )
+            except Exception as e:
+                logger.error(f"read stream {self.stream.stream} failed, {e}")
+                messages = []
+                await asyncio.sleep(self._block_ms / 1000)
+
+            # Give back slots not used by this read.
+            for _ in range(n - len(messages)):
+                self._slots.release()
+            self._submit(messages)
+
+        await self.drain(drain_timeout)
+
+    async def drain(self, timeout: Optional[float] = None):
+        # Wait messages in flight, unfinished ones stay pending after timeout.
+        if len(self._inflight) == 0:
+            return
+        logger.info(f"drain {len(self._inflight)} message(s) of {self.stream.stream}")
+        _, pending = await asyncio.wait(set(self._inflight), timeout=timeout)
+        for t in pending:
+            t.cancel()
+
+
+async def run_consumers(*consumers: StreamConsumer, drain_timeout: Optional[float] = None):
+    # Stop reading on SIGTERM/SIGINT, then drain messages in flight before return.
+    loop = asyncio.get_running_loop()
+
+    def stop_all():
+        logger.info("receive stop signal, drain consumers...")
+        for c in consumers:
+            c.stop()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_all)
+
+    try:
+        await asyncio.gather(*[c.run(drain_timeout) for c in consumers])
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
@@ -0,0 +1,201 @@
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from loguru import logger
+
+from .aiostreams import AsyncRedisStream
+from .codec import decode
+from .models import (
+    CreateInferenceTaskRequest,
+    InferenceObject,
+    InferenceStatus,
+    TaskResults,
+    TaskStatus,
+)
+from .redis_keys import RedisKeys
+from .settings import get_app_settings
+from .tasks import InferenceState, _queue_new_task
+
+_settings = get_app_settings()
+
+# Task to create, task id, callback url and request.
+NewTask = Tuple[str, str, CreateInferenceTaskRequest]
+
+
+class AsyncTaskPool:
+
+    # Create tasks from event loop, never block it.
+    # Task and its message in create stream are written in one MULTI,
+    # so a task is never created without being dispatched, or the reverse.
+
+    def __init__(
+        self,
+        rdb: aioredis.Redis,
+        stream: AsyncRedisStream,
+        task_ttl: int = _settings.task_lifetime_s,
+    ) -> None:
+        self._rdb = rdb
+        self._stream = stream
+        self._task_ttl = task_ttl
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        return self._rdb
+
+    async def new(
+        self, task_id: str, callback: str, raw_request: CreateInferenceTaskRequest
+    ) -> str:
+        await self.new_many([(task_id, callback, raw_request)])
+        return task_id
+
+    async def new_many(self, tasks: List[NewTask]) -> List[str]:
+        if len(tasks) == 0:
+            return []
+        await self._stream.ensure_group()
+
+        deadline = int(time.time()) + self._task_ttl
+        pipe = self.redis_client.pipeline(transaction=True)
+        for task_id, callback, raw_request in tasks:
+            _queue_new_task(pipe, task_id, callback, raw_request, deadline)
+            pipe.xadd(self._stream.stream, {"task_id": task_id})
+        await pipe.execute()
+        return [t[0] for t in tasks]
+
+    async def query(self, task_id: str) -> Optional[TaskStatus]:
+        # Inference states and result of task, None if task gone,
+        # which also happens after its result delivered.
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hmget(RedisKeys.task(task_id), ["task_id", "remaining"])
+        pipe.hvals(RedisKeys.task_objects(task_id))
+        pipe.get(RedisKeys.postprocess_result(task_id))
+        (exists, remaining), objs, result = await pipe.execute()
+        if exists is None:
+            return None
+
+        if len(objs) > 0:
+            objects = [InferenceObject.model_validate_json(o) for o in objs]
+        else:
+            # Task made before objects stored alone.
+            data = await self.redis_client.hget(RedisKeys.task(task_id), "raw_request")
+            objects = CreateInferenceTaskRequest.model_validate_json(data).object_list
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for obj in objects:
+            pipe.hgetall(RedisKeys.task_inference_state(task_id, obj.object_id))
+        states = await pipe.execute()
+
+        inferences = [
+            InferenceStatus(
+                objectId=obj.object_id,
+                type=model,
+                state=resp.get(model.encode(), str(InferenceState.pending).encode()).decode(),
+            )
+            for obj, resp in zip(objects, states)
+            for model in obj.type_list
+        ]
+
+        if result is not None:
+            state = "complete"
+        elif any(i.state != InferenceState.pending for i in inferences):
+            state = "running"
+        else:
+            state = "pending"
+        return TaskStatus(
+            requestId=task_id,
+            state=state,
+            remaining=int(remaining) if remaining is not None else 0,
+            inferenceList=inferences,
+            result=decode(TaskResults, result) if result is not None else None,
+        )
+
+    async def follow(
+        self,
+        task_id: str,
+        watcher: "TaskWatcher",
+        timeout_s: float,
+        interval_s: Optional[float] = None,
+    ) -> AsyncIterator[Optional[TaskStatus]]:
+        # Yield status now, then again when task finished or every interval,
+        # until task complete, gone, or timeout.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_s
+        ev = watcher.watch(task_id)
+        try:
+            while True:
+                ev.clear()
+                status = await self.query(task_id)
+                yield status
+
+                left = deadline - loop.time()
+                if status is None or status.state == "complete" or left <= 0:
+                    return
+                if interval_s is not None:
+                    left = min(left, interval_s)
+                try:
+                    await asyncio.wait_for(ev.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watcher.unwatch(task_id, ev)
+
+
+class TaskWatcher:
+
+    # Wake waiters when postprocess finishes their tasks.
+    # One subscription serves every waiter of this process,
+    # so waiting clients never hold a redis connection each.
+
+    # Retry delay after subscription lost.
+    RECONNECT_DELAY_S = 1.0
+
+    def __init__(self, rdb: aioredis.Redis) -> None:
+        self._rdb = rdb
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        return self._rdb
+
+    def watch(self, task_id: str) -> asyncio.Event:
+        # Watch before reading task, so result finished in between is not missed.
+        ev = asyncio.Event()
+        self._waiters.setdefault(task_id, set()).add(ev)
+        return ev
+
+    def unwatch(self, task_id: str, ev: asyncio.Event):
+        waiters = self._waiters.get(task_id)
+        if waiters is None:
+            return
+        waiters.discard(ev)
+        if len(waiters) == 0:
+            del self._waiters[task_id]
+
+    def notify(self, task_id: str):
+        for ev in self._waiters.get(task_id, ()):
+            ev.set()
+
+    def notify_all(self):
+        for waiters in self._waiters.values():
+            for ev in waiters:
+                ev.set()
+
+    async def run(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(RedisKeys.channel_task_done)
+                while True:
+                    msg = await pubsub.get_message(timeout=1.0)
+                    if msg is not None:
+                        self.notify(msg["data"].decode())
+            except redis.RedisError as e:
+                # Timeout or error reply breaks subscription too, never let watcher end.
+                # Messages may be lost while disconnected, let waiters check again.
+                logger.error(f"subscribe task done channel failed, {e}")
+                self.notify_all()
+                await asyncio.sleep(self.RECONNECT_DELAY_S)
+            finally:
+                await pubsub.aclose()
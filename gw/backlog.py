@@ -0,0 +1,151 @@
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import redis
+
+from .redis_keys import RedisKeys
+
+# Take models whose backlog is due, and lease them,
+# so concurrent dispatchers never retry the same model at the same time.
+#
+# KEYS: schedule.
+# ARGV: now, lease until.
+_TAKE_DUE_SCRIPT = """
+local models = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, m in ipairs(models) do
+    redis.call('ZADD', KEYS[1], ARGV[2], m)
+end
+return models
+"""
+
+# Reschedule model backlog right now, or remove it from schedule if it's empty.
+#
+# KEYS: schedule, model backlog, attempts.
+# ARGV: model id, now.
+_RELEASE_SCRIPT = """
+redis.call('HDEL', KEYS[3], ARGV[1])
+if redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+end
+"""
+
+
+@dataclass(slots=True)
+class BacklogItem:
+    task_id: str
+    object_id: str
+    model_id: str
+    priority: int = 0
+
+    @property
+    def key(self) -> str:
+        return f"{self.task_id}::{self.object_id}::{self.model_id}"
+
+
+class DispatchBacklog(redis.Redis):
+
+    # Inferences no runner can take now are deferred here.
+    #
+    # Each model has its own FIFO, ordered by priority then defer time,
+    # models are scheduled by the next attempt time of their head,
+    # so one model under saturation retries in order with backoff
+    # and never holds up other models.
+
+    # Model leased by a dispatcher is skipped by others for this long.
+    LEASE_S = 30
+
+    # Priority steps over defer time in ms, one step is about 139 years.
+    PRIORITY_STEP = 2**42
+
+    def __init__(self, retry_base_ms: int = 500, retry_max_ms: int = 30 * 1000, **kws):
+        super().__init__(**kws)
+        self._retry_base_ms = retry_base_ms
+        self._retry_max_ms = retry_max_ms
+
+    def defer(self, item: BacklogItem, now: float = None):
+        if now is None:
+            now = time.time()
+        score = int(now * 1000) - item.priority * self.PRIORITY_STEP
+
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(
+            RedisKeys.dispatch_backlog_items,
+            item.key,
+            json.dumps(
+                {
+                    "tid": item.task_id,
+                    "oid": item.object_id,
+                    "model": item.model_id,
+                    "priority": item.priority,
+                }
+            ),
+        )
+        pipe.zadd(
+            RedisKeys.dispatch_backlog_model(item.model_id), {item.key: score}, nx=True
+        )
+        pipe.zadd(RedisKeys.dispatch_backlog, {item.model_id: now}, nx=True)
+        pipe.execute()
+
+    def take_due(self, now: float = None) -> List[str]:
+        # Models due to retry, leased to caller, must release or backoff them later.
+        if now is None:
+            now = time.time()
+        resp = self.eval(
+            _TAKE_DUE_SCRIPT, 1, RedisKeys.dispatch_backlog, now, now + self.LEASE_S
+        )
+        return [m.decode() for m in resp]
+
+    def head(self, model_id: str) -> Optional[BacklogItem]:
+        resp = self.zrange(RedisKeys.dispatch_backlog_model(model_id), 0, 0)
+        if len(resp) == 0:
+            return None
+        data = self.hget(RedisKeys.dispatch_backlog_items, resp[0])
+        if data is None:
+            # Item data lost, drop it from FIFO.
+            self.zrem(RedisKeys.dispatch_backlog_model(model_id), resp[0])
+            return self.head(model_id)
+        data = json.loads(data)
+        return BacklogItem(data["tid"], data["oid"], data["model"], data["priority"])
+
+    def done(self, item: BacklogItem):
+        pipe = self.pipeline(transaction=True)
+        pipe.zrem(RedisKeys.dispatch_backlog_model(item.model_id), item.key)
+        pipe.hdel(RedisKeys.dispatch_backlog_items, item.key)
+        pipe.execute()
+
+    def release(self, model_id: str, now: float = None):
+        if now is None:
+            now = time.time()
+        self.eval(
+            _RELEASE_SCRIPT,
+            3,
+            RedisKeys.dispatch_backlog,
+            RedisKeys.dispatch_backlog_model(model_id),
+            RedisKeys.dispatch_backlog_attempts,
+            model_id,
+            now,
+        )
+
+    def backoff(self, model_id: str, now: float = None) -> float:
+        # Retry model later, delay doubles with each failed attempt.
+        if now is None:
+            now = time.time()
+        attempts = int(self.hincrby(RedisKeys.dispatch_backlog_attempts, model_id, 1))
+        delay_ms = min(self._retry_base_ms * 2 ** (attempts - 1), self._retry_max_ms)
+        self.zadd(RedisKeys.dispatch_backlog, {model_id: now + delay_ms / 1000}, xx=True)
+        return delay_ms / 1000
+
+    def pending(self, model_id: str) -> int:
+        return int(self.zcard(RedisKeys.dispatch_backlog_model(model_id)))
+
+    def pending_counts(self) -> Dict[str, int]:
+        # Deferred inferences of each model, for scaling decisions.
+        models = [m.decode() for m in self.zrange(RedisKeys.dispatch_backlog, 0, -1)]
+        pipe = self.pipeline(transaction=False)
+        for m in models:
+            pipe.zcard(RedisKeys.dispatch_backlog_model(m))
+        return {m: int(n) for m, n in zip(models, pipe.execute()) if int(n) > 0}
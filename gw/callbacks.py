@@ -0,0 +1,130 @@
+import json
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import redis.asyncio as aioredis
+
+from .redis_keys import RedisKeys
+
+# Take tasks due to retry callback, and lease them,
+# so concurrent notifiers never deliver the same task at the same time.
+#
+# KEYS: retry schedule.
+# ARGV: now, lease until, count.
+_TAKE_DUE_SCRIPT = """
+local tids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+for _, tid in ipairs(tids) do
+    redis.call('ZADD', KEYS[1], ARGV[2], tid)
+end
+return tids
+"""
+
+
+class CallbackRetry:
+
+    # Callbacks failed are retried later with backoff,
+    # and moved to dead letter stream after max attempts.
+
+    # Task leased by a notifier is skipped by others for this long.
+    LEASE_S = 60
+
+    def __init__(
+        self,
+        rdb: aioredis.Redis,
+        retry_base_ms: int = 1000,
+        retry_max_ms: int = 5 * 60 * 1000,
+        max_attempts: int = 8,
+    ) -> None:
+        self._rdb = rdb
+        self._retry_base_ms = retry_base_ms
+        self._retry_max_ms = retry_max_ms
+        self._max_attempts = max_attempts
+
+    @property
+    def redis_client(self) -> aioredis.Redis:
+        return self._rdb
+
+    async def retry(self, tid: str, now: float = None) -> Optional[float]:
+        # Schedule task to deliver again, delay doubles each attempt.
+        # Return delay, or None if attempts exhausted, caller should give up.
+        if now is None:
+            now = time.time()
+        attempts = int(await self.redis_client.hincrby(RedisKeys.callback_attempts, tid, 1))
+        if attempts > self._max_attempts:
+            return None
+        delay_ms = min(self._retry_base_ms * 2 ** (attempts - 1), self._retry_max_ms)
+        await self.redis_client.zadd(RedisKeys.callback_retry, {tid: now + delay_ms / 1000})
+        return delay_ms / 1000
+
+    async def defer(self, tid: str, delay_s: float, now: float = None):
+        # Deliver later without counting an attempt, when callback host is saturated.
+        if now is None:
+            now = time.time()
+        await self.redis_client.zadd(RedisKeys.callback_retry, {tid: now + delay_s})
+
+    async def take_due(self, count: int = 100, now: float = None) -> List[str]:
+        if now is None:
+            now = time.time()
+        resp = await self.redis_client.eval(
+            _TAKE_DUE_SCRIPT, 1, RedisKeys.callback_retry, now, now + self.LEASE_S, count
+        )
+        return [tid.decode() for tid in resp]
+
+    async def done(self, tid: str):
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zrem(RedisKeys.callback_retry, tid)
+        pipe.hdel(RedisKeys.callback_attempts, tid)
+        await pipe.execute()
+
+    async def dead(self, tid: str, callback: str, reason: str):
+        # Give up task, keep it in dead letter stream for later check.
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zrem(RedisKeys.callback_retry, tid)
+        pipe.hdel(RedisKeys.callback_attempts, tid)
+        pipe.xadd(
+            RedisKeys.stream_callback_dead,
+            {"task_id": tid, "callback": callback, "reason": reason},
+        )
+        await pipe.execute()
+
+    async def pending(self) -> int:
+        return int(await self.redis_client.zcard(RedisKeys.callback_retry))
+
+
+class DeliveryStats:
+
+    # Latency of recent deliveries in this process.
+
+    def __init__(self, window: int = 1000) -> None:
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._delivered = 0
+        self._failed = 0
+
+    def record(self, latency_s: float, ok: bool):
+        self._latencies.append(latency_s)
+        if ok:
+            self._delivered += 1
+        else:
+            self._failed += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if len(latencies) == 0:
+                return 0.0
+            return latencies[min(int(p * len(latencies)), len(latencies) - 1)]
+
+        return {
+            "delivered": self._delivered,
+            "failed": self._failed,
+            "p50_s": percentile(0.5),
+            "p95_s": percentile(0.95),
+            "p99_s": percentile(0.99),
+            "max_s": latencies[-1] if len(latencies) > 0 else 0.0,
+        }
+
+    async def export(self, rdb: aioredis.Redis, name: str):
+        # Publish stats of this notifier, one field per notifier.
+        await rdb.hset(RedisKeys.callback_stats, name, json.dumps(self.snapshot()))
@@ -0,0 +1,135 @@
+import json
+import typing
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Dict, Type, TypeVar
+
+from pydantic import BaseModel
+
+from .settings import get_app_settings
+
+# Encoded value is an envelope: magic, version, codec id, payload.
+# JSON text never starts with magic, so values written before envelope
+# are still read, as JSON with validation.
+_MAGIC = b"\x00"
+ENVELOPE_VERSION = 1
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class Codec(ABC):
+
+    # One byte id written in envelope, reader picks codec by it,
+    # so services with different codec configured read each other's values.
+    id: bytes
+    name: str
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        pass
+
+
+class JsonCodec(Codec):
+
+    id = b"j"
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+
+    id = b"o"
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+
+    id = b"m"
+    name = "msgpack"
+
+    def __init__(self) -> None:
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return self._msgpack.unpackb(data, raw=False)
+
+
+_CODECS: Dict[str, Type[Codec]] = {c.name: c for c in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+_CODEC_IDS: Dict[bytes, str] = {c.id: c.name for c in _CODECS.values()}
+
+
+@lru_cache
+def make_codec(name: str) -> Codec:
+    # Codec package is imported only when used.
+    if name not in _CODECS:
+        raise ValueError(f"unknown codec {name}, available: {list(_CODECS.keys())}")
+    return _CODECS[name]()
+
+
+def default_codec() -> Codec:
+    return make_codec(get_app_settings().redis_codec)
+
+
+def encode(model: BaseModel, codec: Codec = None) -> bytes:
+    if codec is None:
+        codec = default_codec()
+    return _MAGIC + bytes([ENVELOPE_VERSION]) + codec.id + codec.dumps(model.model_dump())
+
+
+def decode(cls: Type[M], data: bytes) -> M:
+    # Value in envelope is written by us from a valid model, build it without validation.
+    if not data.startswith(_MAGIC):
+        return cls.model_validate_json(data)
+    if data[1] != ENVELOPE_VERSION:
+        raise ValueError(f"unknown envelope version {data[1]}")
+    codec = make_codec(_CODEC_IDS[data[2:3]])
+    return construct(cls, codec.loads(data[3:]))
+
+
+def construct(cls: Type[M], data: Dict[str, Any]) -> M:
+    # Build model and nested models from trusted data, keyed by field name.
+    values = {}
+    for name, f in cls.model_fields.items():
+        if name in data:
+            values[name] = _construct_value(f.annotation, data[name])
+    return cls.model_construct(**values)
+
+
+def _construct_value(tp: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    origin = typing.get_origin(tp)
+    if origin is list:
+        (arg,) = typing.get_args(tp)
+        return [_construct_value(arg, v) for v in value]
+    if origin is typing.Union:
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        return _construct_value(args[0], value) if len(args) == 1 else value
+    if isinstance(tp, type) and issubclass(tp, BaseModel) and isinstance(value, dict):
+        return construct(tp, value)
+    return value
@@ -1,55 +1,183 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 from loguru import logger
 from redis import ConnectionPool, Redis
 
 from gw.models import InferenceObject
 
+from .backlog import BacklogItem, DispatchBacklog
 from .redis_keys import RedisKeys
-from .runner import RunnerPool
-from .tasks import Task
+from .runner import Command, RunnerPool, RunnerSnapshot
+from .stats import ModelStats
+from .streams import Streams
+from .tasks import Task, TaskPool
 
 
-class LRUDispatchStrategy:
+class DispatchStrategy(ABC):
 
-    def __init__(self, max_runner: int = 10):
+    def __init__(self, max_runner: int = 10, multi_model: bool = False):
         self.max_runner = max_runner
 
+        # Multi model runners load models on demand,
+        # so an idle runner takes task of any model instead of being stopped.
+        self.multi_model = multi_model
+
     @dataclass
     class Result:
         ok: bool
         reason: Optional[str]
 
+    def prepare(
+        self, pool: RunnerPool, runners: List[RunnerSnapshot], demand: Dict[str, int]
+    ):
+        # Called once per batch before dispatch,
+        # demand is how many inferences each model has in this batch.
+        pass
+
+    @abstractmethod
     def dispatch(
-        self, pool: RunnerPool, task: Task, obj: InferenceObject, model_name: str
+        self,
+        pool: RunnerPool,
+        runners: List[RunnerSnapshot],
+        task: Task,
+        obj: InferenceObject,
+        model_name: str,
     ) -> Result:
-        
+        raise NotImplementedError()
+
+    def _boot_and_claim(
+        self,
+        pool: RunnerPool,
+        runners: List[RunnerSnapshot],
+        task: Task,
+        obj: InferenceObject,
+        model_name: str,
+    ) -> Result:
+        runner = pool.new(model_name)
+        runners.append(
+            self._new_snapshot(runner.name, model_name, busy=False, ready=not pool.wait_ready)
+        )
+
+        # Runner takes no task until model loaded, try again later.
+        if pool.wait_ready:
+            logger.info(
+                f"boot a new runner [{runner.name}] to run model {model_name}, "
+                + f"task [{task.task_id}] wait it ready"
+            )
+            return self.Result(ok=False, reason="new runner starting")
+
+        # New runner is idle, but another dispatcher may claim it first,
+        # then any idle runner of this model is fine.
+        name = pool.claim(model_name, task.task_id, obj.object_id)
+        if name is None:
+            logger.warning(
+                f"new runner [{runner.name}] taken by others, "
+                + f"no resource to dispatch task [{task.task_id}]"
+            )
+            return self.Result(ok=False, reason="runner taken by other dispatcher")
+
+        self._mark_busy(runners, name, model_name)
+        logger.info(
+            f"boot a new runner [{runner.name}] to run model {model_name}, "
+            + f"dispatch task [{task.task_id}] inference object {obj.object_id} "
+            + f"to runner [{name}]"
+        )
+        return self.Result(ok=True, reason=None)
+
+    def _load_on_idle(
+        self,
+        pool: RunnerPool,
+        runners: List[RunnerSnapshot],
+        task: Task,
+        obj: InferenceObject,
+        model_name: str,
+        name: str = None,
+    ) -> Result:
+        name = pool.claim_any(model_name, task.task_id, obj.object_id, name)
+        if name is None:
+            logger.warning(f"no idle runner to load model {model_name}")
+            return self.Result(ok=False, reason="runner taken by other dispatcher")
+
+        self._mark_busy(runners, name, model_name)
+        for r in runners:
+            if r.name == name and not r.holds(model_name):
+                r.models.append(model_name)
+        logger.info(
+            f"idle runner [{name}] load model {model_name}, "
+            + f"dispatch task [{task.task_id}] inference object {obj.object_id}"
+        )
+        return self.Result(ok=True, reason=None)
+
+    @classmethod
+    def _mark_busy(cls, runners: List[RunnerSnapshot], name: str, model_id: str):
+        for r in runners:
+            if r.name == name:
+                r.is_busy = True
+                return
+        runners.append(cls._new_snapshot(name, model_id, busy=True))
+
+    @staticmethod
+    def _starting(runners: List[RunnerSnapshot], model_name: str) -> bool:
+        # Runner of this model is loading, boot another one is waste.
+        return any(r.holds(model_name) and not r.is_ready for r in runners)
+
+    @staticmethod
+    def _new_snapshot(
+        name: str, model_id: str, busy: bool, ready: bool = True
+    ) -> RunnerSnapshot:
+        now = datetime.now()
+        return RunnerSnapshot(
+            name=name,
+            model_id=model_id,
+            ctime=now,
+            utime=now,
+            is_busy=busy,
+            is_alive=False,
+            task=None,
+            heartbeat=None,
+            models=[model_id],
+            is_ready=ready,
+        )
+
+
+class LRUDispatchStrategy(DispatchStrategy):
+
+    def dispatch(
+        self,
+        pool: RunnerPool,
+        runners: List[RunnerSnapshot],
+        task: Task,
+        obj: InferenceObject,
+        model_name: str,
+    ) -> DispatchStrategy.Result:
+        # Runner snapshots are loaded once per task and used to make decisions,
+        # actual runner assignment is done by atomic claims in redis,
+        # so dispatchers running concurrently never queue two tasks on one runner.
+        # Snapshots are updated in place after dispatch.
+
         # Try find a running which run the model task wanted.
         # If have, and it's currently no taks in progress, use this one.
-        for r in pool.runners():
-            if r.model_id == model_name and not r.is_busy:
-                r.run_task(task.task_id, obj.object_id)
-                logger.info(
-                    f"find a running worker [{r.name}] running model {model_name}, "
-                    + f"dispatch task [{task.task_id}] inference object {obj.object_id}"
-                )
-                return self.Result(ok=True, reason=None)
-
-        # No any runner running this model, start a new one.
-        # And dispatch task to the new runner.
-        if pool.count() < self.max_runner:
-            runner = pool.new(model_name)
-            runner.run_task(task.task_id, obj.object_id)
+        # If have multiple, the least recently used one is claimed.
+        name = pool.claim(model_name, task.task_id, obj.object_id)
+        if name is not None:
+            self._mark_busy(runners, name, model_name)
             logger.info(
-                f"no runner running model {model_name}, "
-                + f"boot a new runner [{runner.name}] to run model {model_name}, "
+                f"find a running worker [{name}] running model {model_name}, "
                 + f"dispatch task [{task.task_id}] inference object {obj.object_id}"
             )
             return self.Result(ok=True, reason=None)
 
+        if self._starting(runners, model_name):
+            return self.Result(ok=False, reason="runner of model starting")
+
+        # No any runner running this model, start a new one.
+        # And dispatch task to the new runner.
+        if len(runners) < self.max_runner:
+            return self._boot_and_claim(pool, runners, task, obj, model_name)
+
         # No any runner running this model, no free slot to start a new one.
         # Try find a runner currently no task in progress,
         # stop this runner to free a slot to start new runner.
@@ -58,29 +186,168 @@ class LRUDispatchStrategy:
         logger.info(
             f"no running model [{model_name}] and free slot, " + "try free one slot."
         )
-        name = None
-        last_utime = datetime.max
-        for runner in pool.runners():
-            if not runner.is_busy:
-                if runner.utime < last_utime:
-                    last_utime = runner.utime
-                    name = runner.name
+        if any(not r.is_busy for r in runners):
+            if self.multi_model:
+                return self._load_on_idle(pool, runners, task, obj, model_name)
 
+            name = pool.claim_oldest_idle()
+            if name is not None:
+                pool.delete(name)
+                runners[:] = [r for r in runners if r.name != name]
+                logger.info(f"find a idle runner [{name}] can free, stop this.")
+                return self._boot_and_claim(pool, runners, task, obj, model_name)
+
+        # It is too busy to dispatch task currently
+        # Just report a error and maybe try again later.
+        logger.warning(f"no resource to dispatch task [{task.task_id}]")
+        return self.Result(ok=False, reason="too busy, no resource to for new runner")
+
+
+class CostAwareDispatchStrategy(DispatchStrategy):
+
+    # Load time used for models never measured.
+    DEFAULT_LOAD_S = 5.0
+
+    # Recent request rate is counted as requests expected over this many seconds,
+    # so it adds up with requests of current batch in the same unit.
+    RATE_HORIZON_S = 60.0
+
+    def __init__(
+        self,
+        max_runner: int = 10,
+        stats: ModelStats = None,
+        prewarm: bool = False,
+        multi_model: bool = False,
+    ):
+        super().__init__(max_runner, multi_model)
+        if stats is None:
+            raise TypeError("cost aware strategy must have model stats.")
+        self._stats = stats
+        self._prewarm = prewarm
+
+        # Refreshed by prepare once per batch.
+        self._demand: Dict[str, int] = {}
+        self._load_s: Dict[str, Optional[float]] = {}
+        self._rates: Dict[str, float] = {}
+
+    def prepare(
+        self, pool: RunnerPool, runners: List[RunnerSnapshot], demand: Dict[str, int]
+    ):
+        self._demand = dict(demand)
+        models = list({m for r in runners for m in r.models} | set(demand.keys()))
+        self._load_s = self._stats.load_times(models)
+        self._rates = self._stats.request_rates(models)
+
+        if not self._prewarm:
+            return
+
+        # Boot runners for the models wanted by this batch but not loaded,
+        # so they load in parallel instead of one by one on dispatch.
+        # Most wanted models go first, only free slots are used.
+        loaded = {m for r in runners for m in r.models}
+        for model_id in sorted(demand.keys(), key=lambda m: -demand[m]):
+            if len(runners) >= self.max_runner:
+                break
+            if model_id in loaded:
+                continue
+            runner = pool.new(model_id)
+            runners.append(
+                self._new_snapshot(runner.name, model_id, busy=False, ready=not pool.wait_ready)
+            )
+            loaded.add(model_id)
+            logger.info(f"prewarm runner [{runner.name}] for model {model_id}")
+
+    def _value(self, runners: List[RunnerSnapshot], model_id: str) -> float:
+        # How much keep one runner of this model saves,
+        # it is the load time we avoid for each request expected,
+        # shared by all runners of this model.
+        # Requests expected are the ones waiting in current batch,
+        # plus the ones recent rate brings within the horizon.
+        load_s = self._load_s.get(model_id)
+        if load_s is None:
+            load_s = self.DEFAULT_LOAD_S
+        wanted = self._rates.get(model_id, 0.0) * self.RATE_HORIZON_S + self._demand.get(model_id, 0)
+        n = sum(1 for r in runners if r.holds(model_id))
+        return load_s * wanted / max(n, 1)
+
+    def dispatch(
+        self,
+        pool: RunnerPool,
+        runners: List[RunnerSnapshot],
+        task: Task,
+        obj: InferenceObject,
+        model_name: str,
+    ) -> DispatchStrategy.Result:
+        if self._demand.get(model_name, 0) > 0:
+            self._demand[model_name] -= 1
+
+        # Any idle runner already loaded this model is best.
+        name = pool.claim(model_name, task.task_id, obj.object_id)
         if name is not None:
-            pool.delete(name)
-            runner = pool.new(model_name)
-            runner.run_task(task.task_id, obj.object_id)
+            self._mark_busy(runners, name, model_name)
             logger.info(
-                f"find a idle runner [{name}] can free, stop this. "
-                + f"start a new runner with model [{model_name}], "
+                f"find a running worker [{name}] running model {model_name}, "
                 + f"dispatch task [{task.task_id}] inference object {obj.object_id}"
             )
             return self.Result(ok=True, reason=None)
 
-        # It is too busy to dispatch task currently
-        # Just report a error and maybe try again later.
-        logger.warning(f"no resource to dispatch task [{task.task_id}]")
-        return self.Result(ok=False, reason="too busy, no resource to for new runner")
+        if self._starting(runners, model_name):
+            return self.Result(ok=False, reason="runner of model starting")
+
+        if len(runners) < self.max_runner:
+            return self._boot_and_claim(pool, runners, task, obj, model_name)
+
+        # No free slot, evict the idle runner which is cheapest to lose,
+        # oldest one first when equal.
+        idle = [r for r in runners if not r.is_busy]
+        if len(idle) == 0:
+            logger.warning(f"no resource to dispatch task [{task.task_id}]")
+            return self.Result(ok=False, reason="too busy, no resource to for new runner")
+
+        values = {r.name: sum(self._value(runners, m) for m in r.models) for r in idle}
+        victim = min(idle, key=lambda r: (values[r.name], r.utime))
+
+        # Model already has runners will be served once one of them done,
+        # don't evict a model hotter than it, wait instead.
+        if any(r.holds(model_name) for r in runners):
+            if values[victim.name] >= self._value(runners, model_name):
+                logger.info(
+                    f"model {model_name} busy, keep runner [{victim.name}] "
+                    + f"of hotter model {victim.model_id}"
+                )
+                return self.Result(ok=False, reason="model busy, wait for its runners")
+
+        if self.multi_model:
+            return self._load_on_idle(pool, runners, task, obj, model_name, victim.name)
+
+        name = pool.claim_idle(victim.name)
+        if name is None:
+            logger.warning(f"idle runner [{victim.name}] taken by others")
+            return self.Result(ok=False, reason="runner taken by other dispatcher")
+
+        pool.delete(name)
+        runners[:] = [r for r in runners if r.name != name]
+        logger.info(
+            f"evict idle runner [{name}] of model {victim.model_id}, "
+            + f"value {values[victim.name]:.2f}"
+        )
+        return self._boot_and_claim(pool, runners, task, obj, model_name)
+
+
+def make_dispatch_strategy(
+    name: str,
+    max_runner: int,
+    stats: ModelStats = None,
+    prewarm: bool = False,
+    multi_model: bool = False,
+) -> DispatchStrategy:
+    if name == "lru":
+        return LRUDispatchStrategy(max_runner, multi_model=multi_model)
+    if name == "cost":
+        return CostAwareDispatchStrategy(
+            max_runner, stats=stats, prewarm=prewarm, multi_model=multi_model
+        )
+    raise ValueError(f"unknown dispatch strategy {name}")
 
 
 class Dispatcher(ABC):
@@ -94,6 +361,14 @@ class Dispatcher(ABC):
     def dispatch(self, task: Task):
         raise NotImplementedError()
 
+    def prepare(self, tasks: List[Task]):
+        # Called with the whole batch before dispatch any task of it.
+        pass
+
+    def rebalance(self):
+        # Called periodically, even no new task comes.
+        pass
+
 
 class ModuleDispatcher(Dispatcher):
 
@@ -194,23 +469,242 @@ class ModuleDispatcher(Dispatcher):
 
 class ProcDispatcher(Dispatcher):
 
-    def __init__(self, rdb: Redis, runner_pool: RunnerPool, max_runner: int = 10):
+    def __init__(
+        self,
+        rdb: Redis,
+        runner_pool: RunnerPool,
+        max_runner: int = 10,
+        dispatch_strategy: DispatchStrategy = None,
+        stats: ModelStats = None,
+        backlog: DispatchBacklog = None,
+    ):
         self._rdb = rdb
         self._runnerpool = runner_pool
         self._max_runner_num = max_runner
         self._rdb.set(RedisKeys.max_runner_num, max_runner)
+        self._stats = stats
+
+        # Inferences can't dispatch now are deferred to backlog and retried in order,
+        # without backlog they are only logged.
+        self._backlog = backlog
+        self._taskpool = TaskPool(connection_pool=rdb.connection_pool)
 
-        self.dispatch_strategy = LRUDispatchStrategy(max_runner)
+        if dispatch_strategy is None:
+            dispatch_strategy = LRUDispatchStrategy(max_runner)
+        self.dispatch_strategy = dispatch_strategy
 
     @Dispatcher.runner_num.getter
     def runner_num(self) -> int:
         return int(self._rdb.get(RedisKeys.max_runner_num))
 
+    def prepare(self, tasks: List[Task]):
+        # Count inferences each model wanted by this batch,
+        # record them as request rate and let strategy plan ahead.
+        demand: Dict[str, int] = {}
+        for task in tasks:
+            for obj in task.object_list:
+                for model in set(obj.type_list):
+                    demand[model] = demand.get(model, 0) + 1
+
+        if self._stats is not None:
+            self._stats.record_requests(demand)
+
+        # Deferred work is wanted too.
+        if self._backlog is not None:
+            for model, n in self._backlog.pending_counts().items():
+                demand[model] = demand.get(model, 0) + n
+
+        self.dispatch_strategy.prepare(
+            self._runnerpool, self._runnerpool.snapshots(), demand
+        )
+
     def dispatch(self, task: Task):
+        # Read all runners once, strategy keeps the snapshots up to date.
+        runners = self._runnerpool.snapshots()
+        pending = self._backlog.pending_counts() if self._backlog is not None else {}
         for obj in task.object_list:
-            for model in obj.type_list:
+            # Repeated model of one object is one inference, task counts it once.
+            for model in dict.fromkeys(obj.type_list):
                 logger.debug(f"find inference, obj {obj.object_id} require {model}")
+
+                # Model has deferred work, queue behind it to keep order.
+                if pending.get(model, 0) > 0:
+                    self._defer(task, obj, model, "model has deferred work")
+                    pending[model] += 1
+                    continue
+
                 res = self.dispatch_strategy.dispatch(
-                    self._runnerpool, task, obj, model
+                    self._runnerpool, runners, task, obj, model
+                )
+                if res.ok:
+                    continue
+                if self._backlog is None:
+                    logger.warning(
+                        f"drop inference, task [{task.task_id}] object {obj.object_id} "
+                        + f"model {model}, {res.reason}"
+                    )
+                    continue
+                self._defer(task, obj, model, res.reason)
+                pending[model] = 1
+
+    def _defer(self, task: Task, obj: InferenceObject, model: str, reason: str):
+        self._backlog.defer(BacklogItem(task.task_id, obj.object_id, model))
+        logger.info(
+            f"defer inference, task [{task.task_id}] object {obj.object_id} "
+            + f"model {model}, {reason}"
+        )
+
+    def rebalance(self):
+        # Retry deferred work of due models, head first,
+        # stop at the first failure of a model and back it off.
+        if self._backlog is None:
+            return
+
+        models = self._backlog.take_due()
+        if len(models) == 0:
+            return
+
+        runners = self._runnerpool.snapshots()
+        for model in models:
+            self._retry_model(runners, model)
+
+    def _retry_model(self, runners: List[RunnerSnapshot], model: str):
+        while True:
+            item = self._backlog.head(model)
+            if item is None:
+                break
+
+            # Task may expire while waiting, just drop it.
+            task = self._taskpool.get(item.task_id)
+            obj = task.get_object(item.object_id) if task is not None else None
+            if obj is None:
+                logger.warning(f"drop deferred inference of gone task [{item.task_id}]")
+                self._backlog.done(item)
+                continue
+
+            res = self.dispatch_strategy.dispatch(
+                self._runnerpool, runners, task, obj, model
+            )
+            if not res.ok:
+                delay = self._backlog.backoff(model)
+                logger.info(
+                    f"retry model {model} later in {delay:.1f} second(s), {res.reason}"
                 )
-                # if dispatch filed what to do ?
\ No newline at end of file
+                return
+            self._backlog.done(item)
+
+        self._backlog.release(model)
+
+
+class QueueDispatcher(Dispatcher):
+
+    # Runners pull inferences from a queue per model, dispatcher never picks a runner,
+    # it only keeps enough runners for the queued work of each model.
+    # Slow runner no longer holds up work another runner of the model could do.
+
+    def __init__(self, rdb: Redis, runner_pool: RunnerPool, max_runner: int = 10):
+        self._rdb = rdb
+        self._runnerpool = runner_pool
+        self._max_runner_num = max_runner
+        self._rdb.set(RedisKeys.max_runner_num, max_runner)
+
+        self._streams = Streams(rdb=rdb)
+        self._queues = set()
+
+    @Dispatcher.runner_num.getter
+    def runner_num(self) -> int:
+        return int(self._rdb.get(RedisKeys.max_runner_num))
+
+    @property
+    def max_runner(self) -> int:
+        return self._max_runner_num
+
+    def _ensure_queue(self, model_id: str):
+        # Readgroup must exist before first message, or runners skip it.
+        if model_id not in self._queues:
+            self._streams.model_queue(model_id)
+            self._queues.add(model_id)
+
+    def dispatch(self, task: Task):
+        # Repeated model of one object is one inference, task counts it once.
+        items = [
+            (obj.object_id, model)
+            for obj in task.object_list
+            for model in dict.fromkeys(obj.type_list)
+        ]
+        # Nothing to queue, message is still consumed, SADD needs at least one member.
+        if len(items) == 0:
+            logger.warning(f"task [{task.task_id}] has no inference to queue")
+            return
+
+        for _, model in items:
+            self._ensure_queue(model)
+
+        pipe = self._rdb.pipeline(transaction=False)
+        for oid, model in items:
+            pipe.xadd(
+                RedisKeys.model_stream(model),
+                {"cmd": str(Command.task), "tid": task.task_id, "oid": oid},
+            )
+        pipe.sadd(RedisKeys.model_queues, *{model for _, model in items})
+        pipe.execute()
+        logger.debug(f"task [{task.task_id}] queued {len(items)} inference(s)")
+
+    def queue_depths(self) -> Dict[str, int]:
+        # Messages are deleted when done, so length is queued plus in progress.
+        models = [m.decode() for m in self._rdb.smembers(RedisKeys.model_queues)]
+        pipe = self._rdb.pipeline(transaction=False)
+        for m in models:
+            pipe.xlen(RedisKeys.model_stream(m))
+        return dict(zip(models, pipe.execute()))
+
+    def rebalance(self):
+        depths = self.queue_depths()
+        runners = self._runnerpool.snapshots()
+
+        def count(model_id: str) -> int:
+            return sum(1 for r in runners if r.model_id == model_id)
+
+        # First every model with queued work must have one runner,
+        # largest queue first, evict idle runner of model with nothing queued if full.
+        wanted = sorted(
+            [m for m, n in depths.items() if n > 0], key=lambda m: -depths[m]
+        )
+        for model_id in wanted:
+            if count(model_id) > 0:
+                continue
+            if len(runners) >= self.max_runner and not self._evict(runners, depths):
+                logger.info(f"no free slot for model {model_id}, wait for runner done")
+                break
+            self._boot(runners, model_id)
+
+        # Then scale up models whose queue is longer than their runners, while slots free.
+        while len(runners) < self.max_runner:
+            backlog = {m: depths[m] - count(m) for m in wanted}
+            model_id = max(backlog, key=lambda m: backlog[m], default=None)
+            if model_id is None or backlog[model_id] <= 0:
+                break
+            self._boot(runners, model_id)
+
+    def _boot(self, runners: List[RunnerSnapshot], model_id: str):
+        self._ensure_queue(model_id)
+        runner = self._runnerpool.new(model_id)
+        runners.append(
+            DispatchStrategy._new_snapshot(
+                runner.name, model_id, busy=False, ready=not self._runnerpool.wait_ready
+            )
+        )
+        logger.info(f"boot a new runner [{runner.name}] to run model {model_id}")
+
+    def _evict(self, runners: List[RunnerSnapshot], depths: Dict[str, int]) -> bool:
+        # Oldest idle runner of model which has nothing queued.
+        idle = [r for r in runners if not r.is_busy and depths.get(r.model_id, 0) == 0]
+        for r in sorted(idle, key=lambda r: r.utime):
+            name = self._runnerpool.claim_idle(r.name)
+            if name is None:
+                continue
+            self._runnerpool.delete(name)
+            runners[:] = [x for x in runners if x.name != name]
+            logger.info(f"stop idle runner [{name}] of model {r.model_id} to free slot")
+            return True
+        return False
@@ -0,0 +1,209 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP, error_perm
+from typing import Callable, Iterable, Optional, Set, Tuple, Union
+
+from loguru import logger
+
+
+def ftp_connect(host: str, port: int, user: str, password: str, timeout: float) -> FTP:
+    ftp = FTP(timeout=timeout)
+    ftp.connect(host, port)
+    ftp.login(user=user, passwd=password)
+    return ftp
+
+
+def ftp_stat(ftp: FTP, path: str) -> Tuple[int, str]:
+    # Size in binary mode and MDTM modify time, which key cached images.
+    ftp.voidcmd("TYPE I")
+    size = ftp.size(path)
+    mtime = ftp.sendcmd(f"MDTM {path}").split(maxsplit=1)[1].strip()
+    return (int(size), mtime)
+
+
+class ImageCache:
+
+    # Images fetched from FTP, kept in files shared by processes on this host,
+    # /dev/shm keeps them in memory. Readers map files, never copy them.
+    #
+    # Key is path with size and modify time, so a replaced file never hits.
+    # Files are written to temp then renamed, readers never see partial ones.
+    # Least recently read files are removed over byte cap, each process checks
+    # after writing a tenth of cap, so total may be over cap a little.
+
+    # Temp files older than this are left by dead writers.
+    STALE_TMP_S = 60
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self._root = root
+        self._max_bytes = max_bytes
+        self._written = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def _file(self, path: str, size: int, mtime: str) -> str:
+        name = hashlib.sha1(f"{path}\0{size}\0{mtime}".encode()).hexdigest()
+        return os.path.join(self._root, name)
+
+    def contains(self, path: str, size: int, mtime: str) -> bool:
+        return os.path.exists(self._file(path, size, mtime))
+
+    def get(self, path: str, size: int, mtime: str) -> Optional[Union[mmap.mmap, bytes]]:
+        name = self._file(path, size, mtime)
+        try:
+            fd = os.open(name, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            if os.fstat(fd).st_size != size:
+                return None
+            if size == 0:
+                return b""
+            data = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        # Read time is file modify time, for LRU eviction.
+        try:
+            os.utime(name)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, path: str, size: int, mtime: str, data: bytes) -> bool:
+        # File changed while fetching, or too large to cache.
+        if len(data) != size or size > self._max_bytes:
+            return False
+
+        # Partial temp file is removed when write fails, like cache filesystem full.
+        name = self._file(path, size, mtime)
+        tmp = f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, name)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self._written += size
+            if self._written < self._max_bytes // 10:
+                return True
+            self._written = 0
+        self.evict()
+        return True
+
+    def evict(self):
+        now = time.time()
+        files = []
+        total = 0
+        with os.scandir(self._root) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    if entry.name.endswith(".tmp"):
+                        if now - st.st_mtime > self.STALE_TMP_S:
+                            os.remove(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        files.sort()
+        for _, size, name in files:
+            if total <= self._max_bytes:
+                return
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class ImagePrefetcher:
+
+    # Fetch images into cache in background when task arrives,
+    # so runners find them local when they start.
+    # Each worker keeps one connection, reconnects after error.
+
+    def __init__(
+        self,
+        cache: ImageCache,
+        connect: Callable[[], FTP],
+        workers: int = 4,
+        max_pending: int = 1000,
+    ) -> None:
+        self._cache = cache
+        self._connect = connect
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._local = threading.local()
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def prefetch(self, paths: Iterable[str]) -> int:
+        # Return number of paths submitted, duplicated or over max pending skipped.
+        n = 0
+        with self._lock:
+            for p in paths:
+                if p in self._pending or len(self._pending) >= self._max_pending:
+                    continue
+                self._pending.add(p)
+                self._executor.submit(self._fetch, p)
+                n += 1
+        return n
+
+    def _ftp(self) -> FTP:
+        ftp = getattr(self._local, "ftp", None)
+        if ftp is None:
+            ftp = self._connect()
+            self._local.ftp = ftp
+        return ftp
+
+    def _drop(self):
+        ftp = getattr(self._local, "ftp", None)
+        self._local.ftp = None
+        if ftp is not None:
+            try:
+                ftp.close()
+            except Exception:
+                pass
+
+    def _fetch(self, path: str):
+        try:
+            ftp = self._ftp()
+            size, mtime = ftp_stat(ftp, path)
+            if self._cache.contains(path, size, mtime):
+                return
+            chunks = []
+            ftp.retrbinary(f"RETR {path}", chunks.append)
+        except error_perm as e:
+            logger.warning(f"prefetch image {path} failed, {e}")
+        except Exception as e:
+            logger.warning(f"prefetch image {path} failed, {e}")
+            self._drop()
+        else:
+            # Cache write error is not a broken connection.
+            try:
+                self._cache.put(path, size, mtime, b"".join(chunks))
+            except OSError as e:
+                logger.warning(f"cache prefetched image {path} failed, {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
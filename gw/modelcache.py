@@ -0,0 +1,101 @@
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+
+def current_rss() -> int:
+    # Resident memory of this process in bytes, 0 if unknown.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ModelCache:
+
+    # Models loaded in one process, least recently used ones are released
+    # when total size over memory budget, or number over max models.
+    #
+    # Size of a model is process RSS growth when it loads,
+    # device memory is not counted, so max models also matters on NPU.
+    # Size is remembered after release, to free memory before loading again.
+
+    def __init__(
+        self,
+        loader: Callable[[str], Any],
+        budget_bytes: int,
+        max_models: Optional[int] = None,
+        release: Optional[Callable[[str, Any], None]] = None,
+        rss: Callable[[], int] = current_rss,
+    ) -> None:
+        self._loader = loader
+        self._budget = budget_bytes
+        self._max_models = max_models
+        self._release = release
+        self._rss = rss
+
+        self._models: OrderedDict[str, Any] = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def models(self) -> List[str]:
+        # Most recently used first.
+        return list(reversed(self._models.keys()))
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(self._sizes.get(m, 0) for m in self._models)
+
+    def get(self, model_id: str) -> Any:
+        if model_id in self._models:
+            self._models.move_to_end(model_id)
+            return self._models[model_id]
+
+        # Make room with size known from last load.
+        self._evict(self._sizes.get(model_id, 0), 1)
+
+        before = self._rss()
+        model = self._loader(model_id)
+        self._sizes[model_id] = max(self._rss() - before, 0)
+        self._models[model_id] = model
+        logger.info(
+            f"model {model_id} loaded, size {self._sizes[model_id] >> 20} MiB, "
+            + f"cache used {self.used_bytes >> 20} MiB"
+        )
+
+        # Real size may be larger than expected, never evict the one just loaded.
+        self._evict(0, 0)
+        return model
+
+    def _evict(self, incoming_bytes: int, incoming_num: int):
+        while len(self._models) > 0:
+            over_budget = self.used_bytes + incoming_bytes > self._budget
+            over_num = (
+                self._max_models is not None
+                and len(self._models) + incoming_num > self._max_models
+            )
+            if not over_budget and not over_num:
+                return
+            if incoming_num == 0 and len(self._models) == 1:
+                return
+            self.evict(next(iter(self._models)))
+
+    def evict(self, model_id: str):
+        model = self._models.pop(model_id, None)
+        if model is None:
+            return
+        if self._release is not None:
+            self._release(model_id, model)
+        logger.info(f"model {model_id} released, cache used {self.used_bytes >> 20} MiB")
+
+    def clear(self):
+        for m in list(self._models.keys()):
+            self.evict(m)
@@ -1,6 +1,6 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 
 class Vector2(BaseModel):
@@ -45,3 +45,26 @@ class ComposedResult(BaseModel):
 class TaskResults(BaseModel):
     request_id: str = Field(alias="requestId")
     request_list: List[ComposedResult] = Field(alias="requestList")
+
+
+# Inference states as stored, which differ from the API names.
+_STORED_INFERENCE_STATES = {"complelte": "complete"}
+
+
+class InferenceStatus(BaseModel):
+    object_id: str = Field(alias="objectId")
+    type: str
+    state: Literal["pending", "running", "complete", "failed"]
+
+    @field_validator("state", mode="before")
+    @classmethod
+    def _api_state(cls, v):
+        return _STORED_INFERENCE_STATES.get(v, v)
+
+
+class TaskStatus(BaseModel):
+    request_id: str = Field(alias="requestId")
+    state: str
+    remaining: int
+    inference_list: List[InferenceStatus] = Field(alias="inferenceList")
+    result: Optional[TaskResults] = None
@@ -9,6 +9,7 @@ class RedisKeys(StrEnum):
 
     task_suffix = "task::gw"
     def task(x): return f"{x}::task::gw"
+    def task_objects(x): return f"objects::{x}::task::gw"
     def task_inference_state(x, o): return f"state::{o}::{x}::task::gw"
     def task_inference_result(x, o): return f"result::{o}::{x}::task::gw"
 
@@ -18,6 +19,28 @@ class RedisKeys(StrEnum):
     def runner_stream(x): return f"{x}::runner::stream::gw"
     def runner_stream_readgroup(x): return f"{x}::runner::readgroup::gw"
 
+    runner_registry = "registry::runners::gw"
+    runner_idle = "idle::runners::gw"
+    def runner_model_registry(m): return f"{m}::model::runners::gw"
+    def runner_model_idle(m): return f"{m}::model::idle::runners::gw"
+
+    model_queues = "queues::models::gw"
+    def model_stream(m): return f"{m}::model::stream::gw"
+    def model_stream_readgroup(m): return f"{m}::model::readgroup::gw"
+
+    dispatch_backlog = "backlog::dispatcher::gw"
+    dispatch_backlog_items = "items::backlog::dispatcher::gw"
+    dispatch_backlog_attempts = "attempts::backlog::dispatcher::gw"
+    def dispatch_backlog_model(m): return f"{m}::model::backlog::dispatcher::gw"
+
+    result_cache_index = "index::result::cache::gw"
+    result_cache_stats = "stats::result::cache::gw"
+    def result_cache(x): return f"{x}::result::cache::gw"
+    def result_cache_path(x): return f"{x}::path::result::cache::gw"
+
+    model_stats = "stats::models::gw"
+    def model_requests(m, b): return f"{m}::{b}::requests::models::gw"
+
     stream_task_create = "task_create::stream::gw"
     stream_readgroup_task_create = "task_create::readgroup::gw"
 
@@ -26,3 +49,10 @@ class RedisKeys(StrEnum):
 
     stream_postprocess_complete = "postprocess_complete::stream::gw"
     stream_readgroup_postprocess_complete = "postprocess_complete::readgroup::gw"
+
+    callback_retry = "retry::callbacks::notifier::gw"
+    callback_attempts = "attempts::callbacks::notifier::gw"
+    callback_stats = "stats::callbacks::notifier::gw"
+    stream_callback_dead = "callback_dead::stream::gw"
+
+    channel_task_done = "task_done::channel::gw"
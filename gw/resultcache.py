@@ -0,0 +1,143 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+
+from .codec import decode, encode
+from .models import InferenceResult
+from .redis_keys import RedisKeys
+
+# Read cached result by content digest, or by image paths linked to a digest.
+# Hit refreshes entry in LRU index, content hit also links paths to it.
+#
+# KEYS: LRU index, stats hash, [path key].
+# ARGV: now, entry key suffix, "path" or "content", [digest, path ttl].
+_GET_SCRIPT = """
+local digest = ARGV[4]
+if ARGV[3] == 'path' then
+    digest = redis.call('GET', KEYS[3])
+    if not digest then
+        redis.call('HINCRBY', KEYS[2], 'path_misses', 1)
+        return false
+    end
+end
+
+local value = redis.call('GET', digest .. ARGV[2])
+if not value then
+    redis.call('HINCRBY', KEYS[2], ARGV[3] .. '_misses', 1)
+    return false
+end
+redis.call('ZADD', KEYS[1], ARGV[1], digest)
+redis.call('HINCRBY', KEYS[2], ARGV[3] .. '_hits', 1)
+if ARGV[3] == 'content' and KEYS[3] then
+    redis.call('SET', KEYS[3], digest, 'EX', ARGV[5])
+end
+return value
+"""
+
+# Write result, link paths to it, and evict least recently used entries over max.
+#
+# KEYS: LRU index, [path key].
+# ARGV: digest, result, ttl, now, max entries, entry key suffix, [path ttl].
+_PUT_SCRIPT = """
+redis.call('SET', ARGV[1] .. ARGV[6], ARGV[2], 'EX', ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+if KEYS[2] then
+    redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[7])
+end
+
+local over = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[5])
+if over > 0 then
+    local evicted = redis.call('ZPOPMIN', KEYS[1], over)
+    for i = 1, #evicted, 2 do
+        redis.call('DEL', evicted[i] .. ARGV[6])
+    end
+end
+return over
+"""
+
+
+def _digest(*parts: Any) -> str:
+    data = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResultCache(redis.Redis):
+
+    # Inference results keyed by model, image content and arguments that change result.
+    #
+    # Same content under another path hits too, but images must be fetched to hash.
+    # Image paths are linked to content for a short time, so a path sent again
+    # hits without fetch, path TTL bounds how stale a replaced image can be.
+
+    def __init__(
+        self,
+        ttl_s: int = 60 * 60,
+        path_ttl_s: int = 5 * 60,
+        max_entries: int = 100000,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._ttl_s = ttl_s
+        self._path_ttl_s = path_ttl_s
+        self._max_entries = max_entries
+
+    @staticmethod
+    def content_key(model_id: str, images: List[Any], params: Dict[str, Any]) -> str:
+        # Images are bytes like, mapped files included, or str like base64 encoded ones.
+        digests = [
+            hashlib.sha256(x.encode() if isinstance(x, str) else x).hexdigest()
+            for x in images
+        ]
+        return _digest(model_id, digests, params)
+
+    @staticmethod
+    def path_key(model_id: str, paths: List[str], params: Dict[str, Any]) -> str:
+        return _digest(model_id, paths, params)
+
+    def _get(self, kind: str, keys: List[str], args: List[Any]) -> Optional[InferenceResult]:
+        resp = self.eval(
+            _GET_SCRIPT,
+            2 + len(keys),
+            RedisKeys.result_cache_index,
+            RedisKeys.result_cache_stats,
+            *keys,
+            time.time(),
+            RedisKeys.result_cache(""),
+            kind,
+            *args,
+        )
+        if resp is None:
+            return None
+        return decode(InferenceResult, resp)
+
+    def get_by_path(self, path_key: str) -> Optional[InferenceResult]:
+        return self._get("path", [RedisKeys.result_cache_path(path_key)], [])
+
+    def get(self, content_key: str, path_key: str = None) -> Optional[InferenceResult]:
+        # Link path to content on hit, so next time it hits without fetch.
+        keys = [] if path_key is None else [RedisKeys.result_cache_path(path_key)]
+        return self._get("content", keys, [content_key, self._path_ttl_s])
+
+    def put(self, content_key: str, result: InferenceResult, path_key: str = None):
+        keys = [] if path_key is None else [RedisKeys.result_cache_path(path_key)]
+        self.eval(
+            _PUT_SCRIPT,
+            1 + len(keys),
+            RedisKeys.result_cache_index,
+            *keys,
+            content_key,
+            encode(result),
+            self._ttl_s,
+            time.time(),
+            self._max_entries,
+            RedisKeys.result_cache(""),
+            self._path_ttl_s,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        resp = self.hgetall(RedisKeys.result_cache_stats)
+        return {k.decode(): int(v) for k, v in resp.items()}
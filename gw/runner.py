@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from datetime import datetime
 from enum import StrEnum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import redis
 from loguru import logger
@@ -12,6 +13,197 @@ from .utils import generate_a_random_hex_str
 
 RUNNER_ID_LENGTH = 4
 
+# Models a runner holds, multi model runner lists them in "models" field,
+# others hold only the model in "model_id" field.
+# Prepended to scripts which need to update model indexes.
+_RUNNER_MODELS_LUA = """
+local function runner_models(key)
+    local models = redis.call('HGET', key, 'models')
+    if models then
+        local result = {}
+        for m in string.gmatch(models, '[^,]+') do
+            table.insert(result, m)
+        end
+        return result
+    end
+    local model_id = redis.call('HGET', key, 'model_id')
+    if model_id then
+        return {model_id}
+    end
+    return {}
+end
+"""
+
+# Move runner between idle indexes and write busy flag in one step.
+# Do nothing if runner already deleted, so a late update never brings it back,
+# runner not ready yet stays out of idle indexes.
+#
+# KEYS: runner hash, registry, idle index.
+# ARGV: runner name, busy flag, model idle index key suffix.
+_SET_BUSY_SCRIPT = _RUNNER_MODELS_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'busy', ARGV[2])
+local models = runner_models(KEYS[1])
+if ARGV[2] == '1' then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    for _, m in ipairs(models) do
+        redis.call('ZREM', m .. ARGV[3], ARGV[1])
+    end
+elseif redis.call('HGET', KEYS[1], 'ready') ~= '0' then
+    local ts = redis.call('ZSCORE', KEYS[2], ARGV[1])
+    redis.call('ZADD', KEYS[3], ts, ARGV[1])
+    for _, m in ipairs(models) do
+        redis.call('ZADD', m .. ARGV[3], ts, ARGV[1])
+    end
+end
+return 1
+"""
+
+# Mark runner ready, and register it as idle if it's not busy.
+# Runner not ready never joins idle indexes, so no task is sent before model loaded.
+#
+# KEYS: runner hash, registry, idle index.
+# ARGV: runner name, model idle index key suffix.
+_READY_SCRIPT = _RUNNER_MODELS_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'ready', 1)
+if redis.call('HGET', KEYS[1], 'busy') == '0' then
+    local ts = redis.call('ZSCORE', KEYS[2], ARGV[1])
+    redis.call('ZADD', KEYS[3], ts, ARGV[1])
+    for _, m in ipairs(runner_models(KEYS[1])) do
+        redis.call('ZADD', m .. ARGV[2], ts, ARGV[1])
+    end
+end
+return 1
+"""
+
+# Write update time, which is also the score in registry indexes.
+# XX only update runners already in the index.
+#
+# KEYS: runner hash, registry, idle index.
+# ARGV: runner name, update time, timestamp,
+#       model registry key suffix, model idle index key suffix.
+_TOUCH_SCRIPT = _RUNNER_MODELS_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'utime', ARGV[2])
+redis.call('ZADD', KEYS[2], 'XX', ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[3], 'XX', ARGV[3], ARGV[1])
+for _, m in ipairs(runner_models(KEYS[1])) do
+    redis.call('ZADD', m .. ARGV[4], 'XX', ARGV[3], ARGV[1])
+    redis.call('ZADD', m .. ARGV[5], 'XX', ARGV[3], ARGV[1])
+end
+return 1
+"""
+
+# Replace models a multi model runner holds, and move it between model indexes.
+#
+# KEYS: runner hash, registry, idle index.
+# ARGV: runner name, model registry key suffix, model idle index key suffix,
+#       models joined by comma.
+_SET_MODELS_SCRIPT = _RUNNER_MODELS_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for _, m in ipairs(runner_models(KEYS[1])) do
+    redis.call('ZREM', m .. ARGV[2], ARGV[1])
+    redis.call('ZREM', m .. ARGV[3], ARGV[1])
+end
+redis.call('HSET', KEYS[1], 'models', ARGV[4])
+local ts = redis.call('ZSCORE', KEYS[2], ARGV[1])
+local idle = redis.call('ZSCORE', KEYS[3], ARGV[1])
+for _, m in ipairs(runner_models(KEYS[1])) do
+    redis.call('ZADD', m .. ARGV[2], ts, ARGV[1])
+    if idle then
+        redis.call('ZADD', m .. ARGV[3], ts, ARGV[1])
+    end
+end
+return 1
+"""
+
+
+# Read every runner in registry with its heartbeat in one call.
+#
+# KEYS: registry.
+# ARGV: runner hash key suffix, runner heartbeat key suffix.
+_SNAPSHOT_SCRIPT = """
+local names = redis.call('ZRANGE', KEYS[1], 0, -1)
+local result = {}
+for i, name in ipairs(names) do
+    local data = redis.call('HGETALL', name .. ARGV[1])
+    local heartbeat = redis.call('GET', name .. ARGV[2])
+    result[i] = {name, data, heartbeat}
+end
+return result
+"""
+
+
+# Pick the least recently used runner in an idle index, or the given runner if it's idle,
+# mark it busy and enqueue task command to its stream, all in one atomic step.
+# So dispatchers running concurrently never pick the same runner.
+#
+# Pick from model idle index to find runner already holds the model,
+# or from idle index to let a multi model runner load it.
+#
+# KEYS: index to pick from, idle index.
+# ARGV: runner hash key suffix, runner stream key suffix, model idle index key suffix,
+#       command, task id, object id, model id, [runner name].
+_CLAIM_SCRIPT = _RUNNER_MODELS_LUA + """
+local name = ARGV[8]
+if name then
+    if not redis.call('ZSCORE', KEYS[1], name) then
+        return false
+    end
+else
+    local names = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #names == 0 then
+        return false
+    end
+    name = names[1]
+end
+redis.call('ZREM', KEYS[2], name)
+for _, m in ipairs(runner_models(name .. ARGV[1])) do
+    redis.call('ZREM', m .. ARGV[3], name)
+end
+redis.call('HSET', name .. ARGV[1], 'busy', 1)
+redis.call(
+    'XADD', name .. ARGV[2], '*',
+    'cmd', ARGV[4], 'tid', ARGV[5], 'oid', ARGV[6], 'model', ARGV[7]
+)
+return name
+"""
+
+# Pick the oldest idle runner of any model, or the given idle runner, and mark it busy,
+# so it can be stopped without other dispatchers sending task to it.
+#
+# KEYS: idle index.
+# ARGV: runner hash key suffix, model idle index key suffix, [runner name].
+_CLAIM_IDLE_SCRIPT = _RUNNER_MODELS_LUA + """
+local name = ARGV[3]
+if name then
+    if not redis.call('ZSCORE', KEYS[1], name) then
+        return false
+    end
+else
+    local names = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #names == 0 then
+        return false
+    end
+    name = names[1]
+end
+redis.call('ZREM', KEYS[1], name)
+for _, m in ipairs(runner_models(name .. ARGV[1])) do
+    redis.call('ZREM', m .. ARGV[2], name)
+end
+redis.call('HSET', name .. ARGV[1], 'busy', 1)
+return name
+"""
+
 
 class WorkerStarter(ABC):
 
@@ -25,12 +217,66 @@ class Command(StrEnum):
     task = "task"
 
 
+@dataclass(slots=True)
+class RunnerSnapshot:
+    name: str
+    model_id: str
+    ctime: datetime
+    utime: datetime
+    is_busy: bool
+    is_alive: bool
+    task: Optional[str]
+    heartbeat: Optional[datetime]
+    # Runner without models field holds only the model it boots with.
+    models: Optional[List[str]] = None
+    is_ready: bool = True
+
+    def __post_init__(self):
+        if self.models is None:
+            self.models = [self.model_id]
+
+    def holds(self, model_id: str) -> bool:
+        # Boot model may be evicted from a multi model runner, trust models only.
+        return model_id in self.models
+
+    @classmethod
+    def from_redis(
+        cls, name: str, data: Dict[bytes, bytes], heartbeat: Optional[bytes]
+    ) -> Optional["RunnerSnapshot"]:
+        # Runner hash may be deleted between index read and hash read.
+        if len(data) == 0:
+            return None
+        task = data.get(b"task")
+        model_id = data[b"model_id"].decode()
+        models = data.get(b"models")
+        ready = data.get(b"ready")
+        return cls(
+            name=name,
+            model_id=model_id,
+            ctime=datetime.fromisoformat(data[b"ctime"].decode()),
+            utime=datetime.fromisoformat(data[b"utime"].decode()),
+            is_busy=int(data[b"busy"]) == 1,
+            is_alive=int(data[b"is_alive"]) == 1,
+            task=task.decode() if task is not None else None,
+            heartbeat=(
+                datetime.fromisoformat(heartbeat.decode())
+                if heartbeat is not None
+                else None
+            ),
+            models=[m for m in models.decode().split(",") if m] if models is not None else None,
+            is_ready=ready is None or int(ready) == 1,
+        )
+
+
 class Runner:
 
-    def __init__(self, rdb: redis.Redis, name: str) -> None:
+    def __init__(self, rdb: redis.Redis, name: str, model_id: str = None) -> None:
         self._name = name
         self._rdb = rdb
 
+        # Model of a runner never change, cache it once known.
+        self._model_id = model_id
+
     @property
     def name(self) -> str:
         return self._name
@@ -41,7 +287,11 @@ class Runner:
 
     @property
     def model_id(self) -> str:
-        return self.redis_client.hget(RedisKeys.runner(self.name), "model_id").decode()
+        if self._model_id is None:
+            self._model_id = self.redis_client.hget(
+                RedisKeys.runner(self.name), "model_id"
+            ).decode()
+        return self._model_id
 
     @property
     def ctime(self) -> datetime:
@@ -55,7 +305,40 @@ class Runner:
 
     @utime.setter
     def utime(self, dt: datetime):
-        self.redis_client.hset(RedisKeys.runner(self.name), "utime", dt.isoformat())
+        self.redis_client.eval(
+            _TOUCH_SCRIPT,
+            3,
+            RedisKeys.runner(self.name),
+            RedisKeys.runner_registry,
+            RedisKeys.runner_idle,
+            self.name,
+            dt.isoformat(),
+            dt.timestamp(),
+            RedisKeys.runner_model_registry(""),
+            RedisKeys.runner_model_idle(""),
+        )
+
+    @property
+    def models(self) -> List[str]:
+        # Models this runner holds, multi model runner may hold more than one.
+        resp = self.redis_client.hget(RedisKeys.runner(self.name), "models")
+        if resp is None:
+            return [self.model_id]
+        return resp.decode().split(",")
+
+    @models.setter
+    def models(self, models: List[str]):
+        self.redis_client.eval(
+            _SET_MODELS_SCRIPT,
+            3,
+            RedisKeys.runner(self.name),
+            RedisKeys.runner_registry,
+            RedisKeys.runner_idle,
+            self.name,
+            RedisKeys.runner_model_registry(""),
+            RedisKeys.runner_model_idle(""),
+            ",".join(models),
+        )
 
     @property
     def is_busy(self) -> bool:
@@ -64,7 +347,33 @@ class Runner:
 
     @is_busy.setter
     def is_busy(self, busy: bool):
-        self.redis_client.hset(RedisKeys.runner(self.name), "busy", 1 if busy else 0)
+        self.redis_client.eval(
+            _SET_BUSY_SCRIPT,
+            3,
+            RedisKeys.runner(self.name),
+            RedisKeys.runner_registry,
+            RedisKeys.runner_idle,
+            self.name,
+            1 if busy else 0,
+            RedisKeys.runner_model_idle(""),
+        )
+
+    @property
+    def is_ready(self) -> bool:
+        # Runners made before ready flag exists are always ready.
+        ready = self.redis_client.hget(RedisKeys.runner(self.name), "ready")
+        return ready is None or int(ready) == 1
+
+    def mark_ready(self):
+        self.redis_client.eval(
+            _READY_SCRIPT,
+            3,
+            RedisKeys.runner(self.name),
+            RedisKeys.runner_registry,
+            RedisKeys.runner_idle,
+            self.name,
+            RedisKeys.runner_model_idle(""),
+        )
 
     @property
     def is_alive(self) -> bool:
@@ -94,6 +403,13 @@ class Runner:
         resp = self.redis_client.get(RedisKeys.runner_heartbeat(self.name))
         return datetime.fromisoformat(resp.decode()) if resp is not None else None
 
+    def snapshot(self) -> Optional[RunnerSnapshot]:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(RedisKeys.runner(self.name))
+        pipe.get(RedisKeys.runner_heartbeat(self.name))
+        data, heartbeat = pipe.execute()
+        return RunnerSnapshot.from_redis(self.name, data, heartbeat)
+
     @property
     def stream(self) -> RedisStream:
         return RedisStream(
@@ -119,10 +435,26 @@ class Runner:
 
 class RunnerPool(redis.Redis):
 
-    def __init__(self, starter: WorkerStarter, **kws):
+    def __init__(self, starter: WorkerStarter, wait_ready: bool = False, **kws):
         super().__init__(**kws)
         self._starter = starter
 
+        # New runner joins idle indexes only after it marks itself ready,
+        # otherwise it's idle once created.
+        self._wait_ready = wait_ready
+
+    @property
+    def wait_ready(self) -> bool:
+        return self._wait_ready
+
+    def attach(self, name: str, model_id: str = None) -> Runner:
+        # Make runner object without existence check, name must come from registry.
+        return Runner(
+            rdb=redis.Redis(connection_pool=self.connection_pool),
+            name=name,
+            model_id=model_id,
+        )
+
     def get(self, name: str) -> Optional[Runner]:
 
         # Try find runner key in redis
@@ -130,7 +462,7 @@ class RunnerPool(redis.Redis):
         exists = int(self.exists(RedisKeys.runner(name)))
         if exists == 0:
             return None
-        return Runner(rdb=redis.Redis(connection_pool=self.connection_pool), name=name)
+        return self.attach(name)
 
     def new(self, model_id: str, name: str = None, ctime: datetime = None) -> Runner:
         is_specify_name = name is not None
@@ -153,12 +485,14 @@ class RunnerPool(redis.Redis):
                 runner = self.get(name)
 
         # Name ok, make a new runner.
-        runner = Runner(
-            rdb=redis.Redis(connection_pool=self.connection_pool), name=name
-        )
-
-        # Write runner metadata.
-        self.hset(
+        runner = self.attach(name, model_id)
+
+        # Write runner metadata, register it as a idle runner if not wait it ready,
+        # and create runner stream and readgroup for command message.
+        # All in one transaction so other dispatchers never see a half made runner.
+        ts = ctime.timestamp()
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(
             RedisKeys.runner(runner.name),
             mapping={
                 "name": name,
@@ -167,16 +501,21 @@ class RunnerPool(redis.Redis):
                 "utime": ctime.isoformat(),
                 "busy": 0,
                 "is_alive": 0,
+                "ready": 0 if self._wait_ready else 1,
             },
         )
-        logger.debug(f"runner data, name [{name}], model id [{model_id}]")
-
-        # Create runner stream and readgroup for command message.
-        self.xgroup_create(
+        pipe.zadd(RedisKeys.runner_registry, {name: ts})
+        pipe.zadd(RedisKeys.runner_model_registry(model_id), {name: ts})
+        if not self._wait_ready:
+            pipe.zadd(RedisKeys.runner_idle, {name: ts})
+            pipe.zadd(RedisKeys.runner_model_idle(model_id), {name: ts})
+        pipe.xgroup_create(
             RedisKeys.runner_stream(runner.name),
             RedisKeys.runner_stream_readgroup(runner.name),
             mkstream=True,
         )
+        pipe.execute()
+        logger.debug(f"runner data, name [{name}], model id [{model_id}]")
 
         # Start runner worker.
         self._starter.start_runner(name=name, model_id=model_id)
@@ -186,34 +525,145 @@ class RunnerPool(redis.Redis):
         r = self.get(name)
         if r is not None:
             r.stop()
-        super().delete(
+
+        # Models are required to find model indexes,
+        # runner hash may already gone, then only clean global indexes.
+        model_id, models = self.hmget(RedisKeys.runner(name), "model_id", "models")
+        models = models.decode().split(",") if models is not None else []
+        if model_id is not None:
+            models.append(model_id.decode())
+
+        pipe = self.pipeline(transaction=True)
+        pipe.delete(
             RedisKeys.runner(name),
             RedisKeys.runner_heartbeat(name),
             RedisKeys.runner_stream(name),
         )
+        pipe.zrem(RedisKeys.runner_registry, name)
+        pipe.zrem(RedisKeys.runner_idle, name)
+        for m in set(models):
+            pipe.zrem(RedisKeys.runner_model_registry(m), name)
+            pipe.zrem(RedisKeys.runner_model_idle(m), name)
+        pipe.execute()
 
     def count(self) -> int:
-        return len(self._get_all_runner_keys())
+        return int(self.zcard(RedisKeys.runner_registry))
+
+    def count_model(self, model_id: str) -> int:
+        return int(self.zcard(RedisKeys.runner_model_registry(model_id)))
 
     def runners(self) -> List[Runner]:
-        result = []
+        return [
+            self.attach(name.decode())
+            for name in self.zrange(RedisKeys.runner_registry, 0, -1)
+        ]
+
+    def idle_runner(self, model_id: str) -> Optional[Runner]:
+        # Least recently used idle runner of this model.
+        resp = self.zrange(RedisKeys.runner_model_idle(model_id), 0, 0)
+        if len(resp) == 0:
+            return None
+        return self.attach(resp[0].decode(), model_id)
 
-        runner_keys = self._get_all_runner_keys()
-        for k in runner_keys:
-            r = Runner(
-                rdb=redis.Redis(connection_pool=self.connection_pool),
-                name=k.decode().removesuffix(f"::{RedisKeys.runner_suffix}"),
+    def oldest_idle_runner(self) -> Optional[Runner]:
+        resp = self.zrange(RedisKeys.runner_idle, 0, 0)
+        if len(resp) == 0:
+            return None
+        return self.attach(resp[0].decode())
+
+    def snapshots(self) -> List[RunnerSnapshot]:
+        # One round trip for all runners, instead of one per runner property.
+        resp = self.eval(
+            _SNAPSHOT_SCRIPT,
+            1,
+            RedisKeys.runner_registry,
+            RedisKeys.runner(""),
+            RedisKeys.runner_heartbeat(""),
+        )
+        result = []
+        for name, data, heartbeat in resp:
+            snapshot = RunnerSnapshot.from_redis(
+                name.decode(), dict(zip(data[::2], data[1::2])), heartbeat
             )
-            result.append(r)
-
+            if snapshot is not None:
+                result.append(snapshot)
         return result
 
-    def clean_dead_runners(self):
-        for r in self.runners():
+    def claim(self, model_id: str, tid: str, obj_id: str) -> Optional[str]:
+        # Atomically take an idle runner of the model and send task to it.
+        # Return runner name, or None if no idle runner.
+        return self._claim(RedisKeys.runner_model_idle(model_id), model_id, tid, obj_id)
+
+    def claim_any(
+        self, model_id: str, tid: str, obj_id: str, name: str = None
+    ) -> Optional[str]:
+        # Like claim, but take the oldest idle runner of any model, or the given one,
+        # only multi model runner can run task of model it not holds.
+        return self._claim(RedisKeys.runner_idle, model_id, tid, obj_id, name)
+
+    def _claim(
+        self, index: str, model_id: str, tid: str, obj_id: str, name: str = None
+    ) -> Optional[str]:
+        args = [
+            RedisKeys.runner(""),
+            RedisKeys.runner_stream(""),
+            RedisKeys.runner_model_idle(""),
+            str(Command.task),
+            tid,
+            obj_id,
+            model_id,
+        ]
+        if name is not None:
+            args.append(name)
+        resp = self.eval(_CLAIM_SCRIPT, 2, index, RedisKeys.runner_idle, *args)
+        return resp.decode() if resp is not None else None
+
+    def claim_oldest_idle(self) -> Optional[str]:
+        # Atomically take the oldest idle runner, caller usually stop it to free a slot.
+        return self.claim_idle()
+
+    def claim_idle(self, name: str = None) -> Optional[str]:
+        # Atomically take the given runner if it is idle,
+        # or the oldest idle runner if name not given.
+        args = [RedisKeys.runner(""), RedisKeys.runner_model_idle("")]
+        if name is not None:
+            args.append(name)
+        resp = self.eval(_CLAIM_IDLE_SCRIPT, 1, RedisKeys.runner_idle, *args)
+        return resp.decode() if resp is not None else None
+
+    def clean_dead_runners(self, start_timeout_s: float = 0):
+        # Runner still starting has no heartbeat yet, give it start timeout.
+        now = datetime.now()
+        for r in self.snapshots():
             if r.is_alive and r.heartbeat is not None:
                 continue
+            if not r.is_ready and (now - r.ctime).total_seconds() < start_timeout_s:
+                continue
             logger.debug(f"runner [{r.name}] is dead, clean.")
             self.delete(r.name)
 
-    def _get_all_runner_keys(self):
-        return self.keys(f"*::{RedisKeys.runner_suffix}")
+    def rebuild_registry(self):
+        # Index runners created before registry exists.
+        # Use SCAN rather than KEYS, it never block redis.
+        for k in self.scan_iter(match=f"*::{RedisKeys.runner_suffix}", count=1000):
+            name = k.decode().removesuffix(f"::{RedisKeys.runner_suffix}")
+            data = self.hmget(k, "model_id", "utime", "busy", "models", "ready")
+            if data[0] is None or data[1] is None:
+                continue
+            models = [data[0].decode()]
+            if data[3] is not None:
+                models = data[3].decode().split(",")
+            ts = datetime.fromisoformat(data[1].decode()).timestamp()
+            idle = data[2] is not None and int(data[2]) == 0
+            if data[4] is not None and int(data[4]) == 0:
+                idle = False
+
+            pipe = self.pipeline(transaction=True)
+            pipe.zadd(RedisKeys.runner_registry, {name: ts})
+            if idle:
+                pipe.zadd(RedisKeys.runner_idle, {name: ts})
+            for m in models:
+                pipe.zadd(RedisKeys.runner_model_registry(m), {name: ts})
+                if idle:
+                    pipe.zadd(RedisKeys.runner_model_idle(m), {name: ts})
+            pipe.execute()
@@ -1,6 +1,6 @@
 import os
 from functools import lru_cache
-from typing import Set
+from typing import List, Set
 
 from pydantic_settings import BaseSettings
 
@@ -18,6 +18,47 @@ class AppSettings(BaseSettings):
     allow_format: Set[str] = {"png", "jpg", "jpeg"}
 
     pending_message_claim_time_ms: int = 30 * 1000
+    stream_claim_interval_ms: int = 5 * 1000
+    stream_pull_batch_size: int = 16
+
+    consumer_concurrency: int = 10
+    consumer_drain_timeout_s: float = 30
+
+    # Callback delivery of notifier.
+    notifier_timeout_s: float = 10
+    notifier_max_connections: int = 100
+    notifier_per_host_concurrency: int = 4
+    notifier_retry_base_ms: int = 1000
+    notifier_retry_max_ms: int = 5 * 60 * 1000
+    notifier_max_attempts: int = 8
+
+    # Buffer results to the same callback url and send them in a row,
+    # batch size is also limited by consumer concurrency.
+    notifier_coalesce: bool = False
+    notifier_coalesce_window_ms: int = 50
+    notifier_coalesce_max: int = 8
+
+    # Ingest of webapp, pooled connections shared by all requests.
+    webapp_redis_max_connections: int = 64
+    webapp_bulk_max_tasks: int = 1000
+
+    # Refuse tasks with 503 when too many not dispatched, or when runners are
+    # busy and queued inferences of a requested model won't drain in max wait.
+    webapp_admission: bool = True
+    webapp_admit_max_pending: int = 1000
+    webapp_admit_max_wait_s: float = 60
+    webapp_admit_busy_ratio: float = 0.9
+    webapp_admit_refresh_ms: int = 500
+
+    # Task query waits result at most this long, events stream closes after max,
+    # and sends status every interval when nothing happens.
+    webapp_longpoll_max_s: float = 60
+    webapp_events_max_s: float = 10 * 60
+    webapp_events_interval_s: float = 15
+
+    # Codec of inference and task results in redis, "json", "orjson" or "msgpack".
+    # Values of any codec are read, but its package must be installed in every service.
+    redis_codec: str = "json"
 
     image_lifetime_s: int = 24 * 60 * 60
     task_lifetime_s: int = 24 * 60 * 60
@@ -26,6 +67,78 @@ class AppSettings(BaseSettings):
     runner_heartbeat_ttl_s: int = 10
     runner_heartbeat_update_period_s: int = 9
 
+    # "forkserver" forks runners from a process with modules preloaded,
+    # "subprocess" starts a new interpreter for each runner.
+    runner_starter: str = "forkserver"
+    runner_preload_modules: List[str] = [
+        "numpy",
+        "cv2",
+        "onnxruntime",
+        "loguru",
+        "gwproc.gwproc",
+    ]
+
+    # Runner not ready in this time and has no heartbeat is dead.
+    runner_start_timeout_s: float = 120
+
+    # Multi model runner hosts several models in one process,
+    # least recently used ones released when over budget or max models.
+    runner_multi_model: bool = False
+    runner_model_budget_mb: int = 2048
+    runner_max_models: int = 4
+
+    # Platform and device models run on, "ASCEND" or "ONNX".
+    proc_platform: str = "ASCEND"
+    proc_device_id: int = 0
+
+    # FTP serving images, connections are pooled and kept alive in each runner,
+    # images of one inference download in parallel within timeout and byte budget.
+    ftp_host: str = "127.0.0.1"
+    ftp_port: int = 21
+    ftp_user: str = "anonymous"
+    ftp_password: str = ""
+    ftp_pool_size: int = 6
+    ftp_timeout_s: float = 10
+    ftp_request_timeout_s: float = 30
+    ftp_max_bytes: int = 64 << 20
+    ftp_keepalive_s: float = 30
+
+    # Images fetched are kept in files shared by runners on this host,
+    # dispatcher prefetches images of new tasks into it.
+    image_cache: bool = False
+    image_cache_root: str = "/dev/shm/gw-images"
+    image_cache_max_mb: int = 1024
+    image_prefetch_workers: int = 4
+
+    # Decoded frames and input tensors are shared by runners on this host,
+    # so models of the same object decode and resize each image once.
+    # Unused frames are kept for linger seconds for models dispatched later.
+    frame_store: bool = False
+    frame_store_root: str = "/dev/shm/gw-frames"
+    # 0 caps it to a quarter of the shared memory filesystem it lives in,
+    # docker default shm is only 64 MB, see shm_size in docker-compose.yaml.
+    frame_store_max_mb: int = 0
+    frame_store_linger_s: float = 30
+
+    # Inference results cached by model, image content and arguments.
+    # Image paths link to content for path ttl, hit on them skips image fetch.
+    result_cache: bool = False
+    result_cache_ttl_s: int = 60 * 60
+    result_cache_path_ttl_s: int = 5 * 60
+    result_cache_max_entries: int = 100000
+
+    # "push" sends each inference to a runner picked by strategy,
+    # "queue" lets runners pull from a queue per model.
+    dispatch_mode: str = "push"
+
+    # "lru" or "cost", cost strategy weighs model load time and request rate.
+    dispatch_strategy: str = "lru"
+    dispatch_prewarm: bool = False
+
+    # Deferred dispatch retry delay, doubles each failed attempt up to max.
+    dispatch_retry_base_ms: int = 500
+    dispatch_retry_max_ms: int = 30 * 1000
+
     @property
     def pt_model_root(self) -> str:
         return os.path.join(self.app_root, "models")
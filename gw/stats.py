@@ -0,0 +1,89 @@
+import time
+from typing import Dict, List, Optional
+
+import redis
+
+from .redis_keys import RedisKeys
+
+# Exponential moving average update, read and write in one step.
+#
+# KEYS: stats hash.
+# ARGV: field, new sample, smoothing factor.
+_EWMA_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+local value = tonumber(ARGV[2])
+if old then
+    local alpha = tonumber(ARGV[3])
+    value = alpha * value + (1 - alpha) * tonumber(old)
+end
+redis.call('HSET', KEYS[1], ARGV[1], tostring(value))
+return tostring(value)
+"""
+
+
+class ModelStats(redis.Redis):
+
+    # Request counters are kept in buckets of this many seconds,
+    # rate is calculated from the latest BUCKET_NUM buckets.
+    BUCKET_S = 10
+    BUCKET_NUM = 6
+
+    # Smoothing factor of moving averages, higher means new samples weight more.
+    ALPHA = 0.3
+
+    def _bucket(self, now: float = None) -> int:
+        if now is None:
+            now = time.time()
+        return int(now // self.BUCKET_S)
+
+    def _record_average(self, field: str, seconds: float):
+        self.eval(_EWMA_SCRIPT, 1, RedisKeys.model_stats, field, seconds, self.ALPHA)
+
+    def record_load_time(self, model_id: str, seconds: float):
+        self._record_average(f"{model_id}:load_s", seconds)
+
+    def record_service_time(self, model_id: str, seconds: float):
+        self._record_average(f"{model_id}:service_s", seconds)
+
+    def record_requests(self, counts: Dict[str, int], now: float = None):
+        if len(counts) == 0:
+            return
+        bucket = self._bucket(now)
+        ttl = self.BUCKET_S * (self.BUCKET_NUM + 1)
+
+        pipe = self.pipeline(transaction=False)
+        for model_id, n in counts.items():
+            key = RedisKeys.model_requests(model_id, bucket)
+            pipe.incrby(key, n)
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+    def load_times(self, model_ids: List[str]) -> Dict[str, Optional[float]]:
+        return self._averages(model_ids, "load_s")
+
+    def service_times(self, model_ids: List[str]) -> Dict[str, Optional[float]]:
+        return self._averages(model_ids, "service_s")
+
+    def _averages(self, model_ids: List[str], name: str) -> Dict[str, Optional[float]]:
+        if len(model_ids) == 0:
+            return {}
+        resp = self.hmget(RedisKeys.model_stats, [f"{m}:{name}" for m in model_ids])
+        return {
+            m: float(v) if v is not None else None for m, v in zip(model_ids, resp)
+        }
+
+    def request_rates(self, model_ids: List[str], now: float = None) -> Dict[str, float]:
+        # Requests per second of each model in the latest window.
+        if len(model_ids) == 0:
+            return {}
+        bucket = self._bucket(now)
+        buckets = range(bucket - self.BUCKET_NUM + 1, bucket + 1)
+        keys = [RedisKeys.model_requests(m, b) for m in model_ids for b in buckets]
+        resp = self.mget(keys)
+
+        window = self.BUCKET_S * self.BUCKET_NUM
+        rates = {}
+        for i, m in enumerate(model_ids):
+            values = resp[i * self.BUCKET_NUM:(i + 1) * self.BUCKET_NUM]
+            rates[m] = sum(int(v) for v in values if v is not None) / window
+        return rates
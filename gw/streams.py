@@ -1,3 +1,4 @@
+import time
 from concurrent.futures.thread import ThreadPoolExecutor
 from threading import Event, Thread
 from typing import Callable, Dict, List
@@ -7,6 +8,32 @@ import redis.typing
 
 from .redis_keys import RedisKeys
 
+# Read pending messages of consumer first, then only as many new messages as
+# the batch has room for, so new messages are never taken into pending list
+# of a consumer that can not return them now.
+#
+# KEYS: stream.
+# ARGV: readgroup, consumer, count.
+_READ_BATCH_SCRIPT = """
+local function entries(resp)
+    if not resp or not resp[1] then
+        return {}
+    end
+    return resp[1][2]
+end
+
+local count = tonumber(ARGV[3])
+local messages = entries(redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', count, 'STREAMS', KEYS[1], '0'))
+local left = count - #messages
+if left > 0 then
+    local new = redis.call('XREADGROUP', 'GROUP', ARGV[1], ARGV[2], 'COUNT', left, 'STREAMS', KEYS[1], '>')
+    for _, m in ipairs(entries(new)) do
+        table.insert(messages, m)
+    end
+end
+return messages
+"""
+
 
 class StreamMessage:
     def __init__(
@@ -16,12 +43,14 @@ class StreamMessage:
         rdb: redis.Redis,
         stream: str,
         readgroup: str,
+        delete_on_ack: bool = False,
     ) -> None:
         self._id = id
         self._data = {x.decode(): data[x] for x in data.keys()}
         self._rdb = rdb
         self._stream = stream
         self._readgroup = readgroup
+        self._delete_on_ack = delete_on_ack
 
     @property
     def id(self) -> str:
@@ -32,7 +61,13 @@ class StreamMessage:
         return self._data
 
     def ack(self):
-        self._rdb.xack(self._stream, self._readgroup, self.id)
+        if not self._delete_on_ack:
+            self._rdb.xack(self._stream, self._readgroup, self.id)
+            return
+        pipe = self._rdb.pipeline(transaction=True)
+        pipe.xack(self._stream, self._readgroup, self.id)
+        pipe.xdel(self._stream, self.id)
+        pipe.execute()
 
 
 MessageCallback = Callable[[redis.Redis, StreamMessage], None]
@@ -40,12 +75,17 @@ MessageCallback = Callable[[redis.Redis, StreamMessage], None]
 
 class RedisStream:
 
+    # Pending messages idle longer than this will be claimed by another consumer.
+    CLAIM_MIN_IDLE_TIME_MS = 6000
+
     def __init__(
         self,
         stream: str,
         readgroup: str,
         rdb: redis.Redis = None,
         connection_pool: redis.ConnectionPool = None,
+        claim_interval_ms: int = 0,
+        delete_on_ack: bool = False,
     ) -> None:
 
         if rdb is not None:
@@ -58,6 +98,13 @@ class RedisStream:
         self._stream = stream
         self._readgroup = readgroup
 
+        # Work queues delete messages once done, so stream length is the queue depth.
+        self._delete_on_ack = delete_on_ack
+
+        # XAUTOCLAIM runs at most once per interval, 0 means before every pull.
+        self._claim_interval_ms = claim_interval_ms
+        self._next_claim_at = 0.0
+
         try:
             self.redis_client.xgroup_create(
                 self.stream, self.readgroup, mkstream=True)
@@ -90,6 +137,7 @@ class RedisStream:
                         connection_pool=self.redis_client.connection_pool),
                     self.stream,
                     self.readgroup,
+                    self._delete_on_ack,
                 )
                 for m in x[1]
             ]
@@ -101,12 +149,27 @@ class RedisStream:
     def publish(self, message: Dict[redis.typing.FieldT, redis.typing.EncodableT]):
         self.redis_client.xadd(self.stream, message)
 
-    def pull(self, consumer: str, count: int = None, block: int = None) -> List[StreamMessage]:
+    def _claim_due(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_claim_at:
+            return False
+        self._next_claim_at = now + self._claim_interval_ms / 1000
+        return True
+
+    def _autoclaim(self, client, consumer: str):
         # move pending message belongs to another consumer in this readgroup to myself.
-        self.redis_client.xautoclaim(
-            self.stream, self.readgroup, consumer, min_idle_time=6000, justid=True
+        client.xautoclaim(
+            self.stream,
+            self.readgroup,
+            consumer,
+            min_idle_time=self.CLAIM_MIN_IDLE_TIME_MS,
+            justid=True,
         )
 
+    def pull(self, consumer: str, count: int = None, block: int = None) -> List[StreamMessage]:
+        if self._claim_due():
+            self._autoclaim(self.redis_client, consumer)
+
         # read pending messages.
         resp = self.redis_client.xreadgroup(
             self.readgroup, consumer, {self.stream: "0"}, count=count, block=block
@@ -121,6 +184,43 @@ class RedisStream:
         )
         return self._scan_message(resp)
 
+    def pull_batch(self, consumer: str, count: int, block: int = None) -> List[StreamMessage]:
+        # Claim, read pending and read new messages in one round trip,
+        # so a busy stream costs one round trip per batch instead of three per message.
+        # Blocking commands never block inside a script, so only when the stream is idle
+        # we do a second, blocking read.
+        pipe = self.redis_client.pipeline(transaction=True)
+        claimed = self._claim_due()
+        if claimed:
+            self._autoclaim(pipe, consumer)
+        pipe.eval(_READ_BATCH_SCRIPT, 1, self.stream, self.readgroup, consumer, count)
+        entries = pipe.execute()[-1]
+
+        # Script returns entries like [id, [field, value, ...]], pending messages first,
+        # fields of a pending message deleted meanwhile are missing.
+        items = []
+        for m in entries:
+            fields = m[1] if len(m) > 1 and m[1] else []
+            items.append((m[0], dict(zip(fields[::2], fields[1::2]))))
+        messages = self._scan_message([[self.stream.encode(), items]])
+        if len(messages) != 0 or block is None:
+            return messages
+
+        resp = self.redis_client.xreadgroup(
+            self.readgroup, consumer, {self.stream: ">"}, count=count, block=block
+        )
+        return self._scan_message(resp)
+
+    def ack_many(self, ids: List[str]) -> int:
+        if len(ids) == 0:
+            return 0
+        if not self._delete_on_ack:
+            return int(self.redis_client.xack(self.stream, self.readgroup, *ids))
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.xack(self.stream, self.readgroup, *ids)
+        pipe.xdel(self.stream, *ids)
+        return int(pipe.execute()[0])
+
     def subscribe(self, consumer: str, cb: MessageCallback) -> Event:
         # Use to stop notifier thread.
         evt = Event()
@@ -142,24 +242,32 @@ class RedisStream:
 class Streams:
 
     def __init__(self, rdb: redis.Redis = None,
-                 connection_pool: redis.ConnectionPool = None):
+                 connection_pool: redis.ConnectionPool = None,
+                 claim_interval_ms: int = 0):
         if rdb is not None:
             self._rdb = rdb
         elif connection_pool is not None:
             self._rdb = redis.Redis(connection_pool=connection_pool)
         else:
             raise TypeError("stream must have a redis connection.")
+        self._claim_interval_ms = claim_interval_ms
 
     @property
     def task_create(self) -> RedisStream:
-        return RedisStream(RedisKeys.stream_task_create, RedisKeys.stream_readgroup_task_create, connection_pool=self._rdb.connection_pool)
+        return RedisStream(
+            stream=RedisKeys.stream_task_create,
+            readgroup=RedisKeys.stream_readgroup_task_create,
+            connection_pool=self._rdb.connection_pool,
+            claim_interval_ms=self._claim_interval_ms,
+        )
 
     @property
     def task_inference_complete(self) -> RedisStream:
         return RedisStream(
             stream=RedisKeys.stream_inference_complete,
             readgroup=RedisKeys.stream_readgroup_inference_complete,
-            connection_pool=self._rdb.connection_pool
+            connection_pool=self._rdb.connection_pool,
+            claim_interval_ms=self._claim_interval_ms,
         )
 
     @property
@@ -167,5 +275,16 @@ class Streams:
         return RedisStream(
             stream=RedisKeys.stream_postprocess_complete,
             readgroup=RedisKeys.stream_readgroup_postprocess_complete,
-            connection_pool=self._rdb.connection_pool
+            connection_pool=self._rdb.connection_pool,
+            claim_interval_ms=self._claim_interval_ms,
+        )
+
+    def model_queue(self, model_id: str) -> RedisStream:
+        # Work queue shared by all runners of this model.
+        return RedisStream(
+            stream=RedisKeys.model_stream(model_id),
+            readgroup=RedisKeys.model_stream_readgroup(model_id),
+            connection_pool=self._rdb.connection_pool,
+            claim_interval_ms=self._claim_interval_ms,
+            delete_on_ack=True,
         )
@@ -1,8 +1,10 @@
+import time
 from enum import StrEnum
 from typing import Dict, List, Optional
 
 import redis
 
+from .codec import decode, encode
 from .models import (
     CreateInferenceTaskRequest,
     InferenceObject,
@@ -14,6 +16,87 @@ from .settings import get_app_settings
 
 _settings = get_app_settings()
 
+# Record inference state, and result if given, in one step.
+# Keys expire at task deadline, task made before deadline exists uses its TTL.
+#
+# When state is complete, count down inferences remaining of task.
+# Complete inference is never written again, so a redelivered run can not
+# turn it back to running and count down twice, it gets -2 and notifies nothing.
+# Return inferences remaining, or -1 if task gone.
+# Task made before counter exists always gets 0, check all inferences on compose.
+#
+# KEYS: task hash, inference state hash, inference result hash.
+# ARGV: model, state, complete state, [result].
+_RECORD_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[1], 'deadline')
+if not deadline then
+    local ttl = redis.call('TTL', KEYS[1])
+    if ttl == -2 then
+        return -1
+    end
+    if ttl > 0 then
+        deadline = redis.call('TIME')[1] + ttl
+    end
+end
+
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[3] then
+    return -2
+end
+
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+if ARGV[4] then
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[4])
+end
+if deadline then
+    redis.call('EXPIREAT', KEYS[2], deadline)
+    if ARGV[4] then
+        redis.call('EXPIREAT', KEYS[3], deadline)
+    end
+end
+
+local remaining = redis.call('HGET', KEYS[1], 'remaining')
+if not remaining then
+    return 0
+end
+if ARGV[2] ~= ARGV[3] then
+    return tonumber(remaining)
+end
+return redis.call('HINCRBY', KEYS[1], 'remaining', -1)
+"""
+
+
+def _queue_new_task(
+    pipe: redis.client.Pipeline,
+    task_id: str,
+    callback: str,
+    raw_request: CreateInferenceTaskRequest,
+    deadline: int,
+):
+    # Queue commands making a task in pipeline, sync or async pipeline both works.
+    # Objects are also stored alone, so one object is read without whole request.
+    # Deadline is kept in task, so other keys of task expire with it without TTL read.
+    pipe.hset(
+        RedisKeys.task(task_id),
+        mapping={
+            "task_id": task_id,
+            "callback": callback,
+            "raw_request": raw_request.model_dump_json(by_alias=True),
+            # One inference state field for each model of object, repeated model runs once.
+            "remaining": sum(len(set(obj.type_list)) for obj in raw_request.object_list),
+            "deadline": deadline,
+        },
+    )
+    if len(raw_request.object_list) > 0:
+        pipe.hset(
+            RedisKeys.task_objects(task_id),
+            mapping={
+                obj.object_id: obj.model_dump_json(by_alias=True)
+                for obj in raw_request.object_list
+            },
+        )
+    pipe.expireat(RedisKeys.task(task_id), deadline)
+    pipe.expireat(RedisKeys.task_objects(task_id), deadline)
+
 
 class InferenceState(StrEnum):
     pending = "pending"
@@ -28,28 +111,65 @@ class Task(redis.Redis):
         super().__init__(*args, **kwargs)
         self._tid = tid
 
+        # Task data never change after created, parse once and keep it.
+        self._callback: Optional[str] = None
+        self._request: Optional[CreateInferenceTaskRequest] = None
+        self._objects: Dict[str, InferenceObject] = {}
+        self._deadline: Optional[int] = None
+
     @property
     def task_id(self) -> str:
         return self._tid
 
     @property
     def callback(self) -> str:
-        return self.hget(RedisKeys.task(self.task_id), "callback").decode()
+        if self._callback is None:
+            self._callback = self.hget(RedisKeys.task(self.task_id), "callback").decode()
+        return self._callback
 
     @property
     def raw_request(self) -> CreateInferenceTaskRequest:
-        data = self.hget(RedisKeys.task(self.task_id), "raw_request").decode()
-        return CreateInferenceTaskRequest.model_validate_json(data)
+        if self._request is None:
+            data = self.hget(RedisKeys.task(self.task_id), "raw_request").decode()
+            self._request = CreateInferenceTaskRequest.model_validate_json(data)
+            self._objects = {obj.object_id: obj for obj in self._request.object_list}
+        return self._request
 
     @property
     def ttl(self) -> int:
         return int(super().ttl(RedisKeys.task(self.task_id)))
 
+    @property
+    def deadline(self) -> int:
+        # Unix time task expires, fixed when task created.
+        if self._deadline is None:
+            resp = self.hget(RedisKeys.task(self.task_id), "deadline")
+            if resp is not None:
+                self._deadline = int(resp)
+            else:
+                self._deadline = int(time.time()) + self.ttl
+        return self._deadline
+
     @property
     def object_list(self) -> List[InferenceObject]:
         return self.raw_request.object_list
 
     def get_object(self, name: str) -> Optional[InferenceObject]:
+        if name in self._objects:
+            return self._objects[name]
+        if self._request is not None:
+            return None
+
+        # Only parse the object wanted, runner needs one object of a task.
+        data = self.hget(RedisKeys.task_objects(self.task_id), name)
+        if data is not None:
+            obj = InferenceObject.model_validate_json(data)
+            self._objects[name] = obj
+            return obj
+
+        # Task made before objects stored alone.
+        if int(self.exists(RedisKeys.task_objects(self.task_id))) == 1:
+            return None
         for obj in self.object_list:
             if obj.object_id == name:
                 return obj
@@ -58,9 +178,7 @@ class Task(redis.Redis):
     def update_inference_state(
         self, obj: InferenceObject, model: str, state: InferenceState
     ):
-        name = RedisKeys.task_inference_state(self.task_id, obj.object_id)
-        super().hset(name, mapping={model: str(state)})
-        super().expire(name, self.ttl)
+        self.record_inference(obj, model, state)
 
     def get_inference_state(self, obj: InferenceObject, model: str) -> InferenceState:
         if model in obj.type_list:
@@ -78,25 +196,74 @@ class Task(redis.Redis):
         res = super().hget(name, model)
         if res is None:
             return None
-        return InferenceResult.model_validate_json(res)
+        return decode(InferenceResult, res)
 
     def set_inference_result(
         self, obj: InferenceObject, model: str, res: InferenceResult
     ):
         name = RedisKeys.task_inference_result(self.task_id, obj.object_id)
-        super().hset(name, mapping={model: res.model_dump_json(by_alias=True)})
-        super().expire(name, self.ttl)
+        pipe = self.pipeline(transaction=True)
+        pipe.hset(name, mapping={model: encode(res)})
+        pipe.expireat(name, self.deadline)
+        pipe.execute()
+
+    def record_inference(
+        self,
+        obj: InferenceObject,
+        model: str,
+        state: InferenceState,
+        res: InferenceResult = None,
+    ) -> Optional[int]:
+        # Write state, result and expiry in one round trip.
+        # Return inferences remaining of the task,
+        # None if task gone or inference already complete, nothing written or notified then.
+        args = [model, str(state), str(InferenceState.complete)]
+        if res is not None:
+            args.append(encode(res))
+        remaining = self.eval(
+            _RECORD_SCRIPT,
+            3,
+            RedisKeys.task(self.task_id),
+            RedisKeys.task_inference_state(self.task_id, obj.object_id),
+            RedisKeys.task_inference_result(self.task_id, obj.object_id),
+            *args,
+        )
+        return int(remaining) if int(remaining) >= 0 else None
+
+    @property
+    def remaining_inferences(self) -> int:
+        # Task made before counter exists has no remaining, treat as counted down.
+        resp = self.hget(RedisKeys.task(self.task_id), "remaining")
+        return int(resp) if resp is not None else 0
+
+    def get_inference_results(self) -> Dict[str, Dict[str, InferenceResult]]:
+        # Results of every object, keyed by object id and model,
+        # one HGETALL per object in one round trip.
+        objs = self.object_list
+        pipe = self.pipeline(transaction=False)
+        for obj in objs:
+            pipe.hgetall(RedisKeys.task_inference_result(self.task_id, obj.object_id))
+        return {
+            obj.object_id: {
+                k.decode(): decode(InferenceResult, v) for k, v in resp.items()
+            }
+            for obj, resp in zip(objs, pipe.execute())
+        }
 
     def set_postprocess_result(self, res: TaskResults):
+        # Wake clients waiting for the result of this task.
         name = RedisKeys.postprocess_result(self.task_id)
-        super().set(name, res.model_dump_json(by_alias=True), ex=self.ttl)
+        pipe = self.pipeline(transaction=True)
+        pipe.set(name, encode(res), exat=self.deadline)
+        pipe.publish(RedisKeys.channel_task_done, self.task_id)
+        pipe.execute()
 
     def get_postprocess_result(self) -> Optional[TaskResults]:
         name = RedisKeys.postprocess_result(self.task_id)
         res = super().get(name)
         if res is None:
             return None
-        return TaskResults.model_validate_json(res)
+        return decode(TaskResults, res)
 
 
 class TaskPool(redis.Redis):
@@ -110,15 +277,9 @@ class TaskPool(redis.Redis):
     def new(
         self, task_id: str, callback: str, raw_request: CreateInferenceTaskRequest
     ) -> Task:
-        self.hset(
-            RedisKeys.task(task_id),
-            mapping={
-                "task_id": task_id,
-                "callback": callback,
-                "raw_request": raw_request.model_dump_json(by_alias=True),
-            },
-        )
-        self.expire(RedisKeys.task(task_id), self._task_ttl)
+        pipe = self.pipeline(transaction=True)
+        _queue_new_task(pipe, task_id, callback, raw_request, int(time.time()) + self._task_ttl)
+        pipe.execute()
         return Task(tid=task_id, connection_pool=self.connection_pool)
 
     def get(self, task_id: str) -> Optional[Task]:
@@ -128,4 +289,8 @@ class TaskPool(redis.Redis):
         return Task(task_id, connection_pool=self.connection_pool)
 
     def delete(self, task_id: str):
-        super().delete(RedisKeys.task(task_id), RedisKeys.postprocess_result(task_id))
+        super().delete(
+            RedisKeys.task(task_id),
+            RedisKeys.task_objects(task_id),
+            RedisKeys.postprocess_result(task_id),
+        )
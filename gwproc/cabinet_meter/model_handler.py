@@ -521,13 +521,13 @@ class IndicatorMeterDetectCabinetMeterHandler(ImageHandler):
         else:
             logger.info(f'Model {self.model_name} Relased')
 
-    def run_inference(self, images_data, extra_args=None):
+    def run_inference(self, images_data, extra_args=None, image_type="base64"):
         if extra_args is not None:
             logger.info(f'{self.model_name}不支持extra_args, 忽略')
 
         payload = {
             'task_tag': 'indicator_meter_detect',
-            'image_type': 'base64',
+            'image_type': image_type,
             'images': images_data,
         }
 
@@ -544,18 +544,18 @@ class IndicatorMeterDetectCabinetMeterHandler(ImageHandler):
             #当前仅支持单输入单输出, 仅取[0]号元素
             _defects = data['data'][0]['defect_data']
             if len(_defects) == 0:
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
             else:
                 #本算法仅支持单读数输出, 仅有[0]号元素
                 _item = _defects[0]
                 _value = str(_item['extra_info']['reading'])
                 _desc = _item['defect_desc']
                 _areas = [{"areas": [{"x":_item['x1'],"y":_item['y1']},{"x":_item['x2'],"y":_item['y2']}]}]
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_AND_DETECT, value=_value, desc=_desc, conf=_item['confidence']/100.0, pos=_areas)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_AND_DETECT, value=_value, desc=_desc, conf=_item['confidence']/100.0, pos=_areas)
         except Exception as e:
             _data = f"{self.model_name}: An error occurred: {e}"
             logger.error(_data)
-            return GWProc.result_json(self.model_name, GWProc_Result.INFER_FAIL, _data)
+            return GWProc.result(self.model_name, GWProc_Result.INFER_FAIL, _data)
 
     def preprocess(self, data, *args, **kwargs):
         return data
@@ -583,7 +583,7 @@ class IndicatorMeterDetectCabinetMeterHandler(ImageHandler):
                         filter_size = self.filter_size
                     break
 
-        assert image_type == 'base64', f'image_type: {image_type}'
+        assert image_type in self.IMAGE_TYPES, f'image_type: {image_type}'
 
         data = {"code": 200, "data": [], "message": "", "time": 0}
 
@@ -606,9 +606,8 @@ class IndicatorMeterDetectCabinetMeterHandler(ImageHandler):
             input_name_center = sess_dial.get_inputs()[0].name
             label_name_center = [i.name for i in sess_dial.get_outputs()]
 
-        for image_num, base64_str in enumerate(images):
-            img0 = self.base64_to_cv2(base64_str)
-            img = self.prepare_input(img0, swapRB=False)
+        for image_num, image in enumerate(images):
+            img0, img = self.load_input(image, image_type, swapRB=False)
 
             if self.platform == 'ONNX':
                 output = sess_detect.run(label_name_detect, {input_name_detect: img}, **kwargs)[0]
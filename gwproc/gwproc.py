@@ -3,7 +3,6 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 #import json
-import base64
 from pathlib import Path
 
 #import cv2
@@ -15,8 +14,6 @@ import os
 import json
 #import requests
 from PIL import Image
-from io import BytesIO
-from ftplib import FTP, error_perm
 
 from hat.model_handler import HatDetectHatHandler
 from intrusion.model_handler import IntrusionDetectIntrusionHandler
@@ -24,6 +21,9 @@ from wandering.model_handler import BehaviorDetectWanderingHandler
 from lightning_rod_current_meter.model_handler import PointerMeterDetectLightningRodCurrentMeterHandler
 from cabinet_meter.model_handler import IndicatorMeterDetectCabinetMeterHandler
 
+from utils.commons import ImageHandler
+from utils.frame_store import FrameStore
+from utils.ftp_pool import FTPPool
 from utils.log_config import get_logger
 
 logger = get_logger()
@@ -54,13 +54,17 @@ PLATFORM = ['ONNX', 'ASCEND']
     
 class GWProc:
     ftp_config = None #shared ftp config
+    ftp_pool = None #shared ftp connection pool
     
-    def __init__(self, model_name, platform='ASCEND', device_id=None, ftp=None):
+    def __init__(self, model_name, platform='ASCEND', device_id=None, ftp=None, frames=None):
         if ftp is None:
             if self.__class__.ftp_config is None:
                 raise ValueError(
                     f"GWProc initialization failed, missing ftp configuration!")
         else:
+            if self.__class__.ftp_config != ftp and self.__class__.ftp_pool is not None:
+                self.__class__.ftp_pool.close()
+                self.__class__.ftp_pool = None
             self.__class__.ftp_config = ftp
             
         # Validate the model type
@@ -80,131 +84,115 @@ class GWProc:
                 raise ValueError(
                     f"In valid device ID {device_id}")
 
+        # 同一主机上的模型共享解码图像和预处理结果, 所有模型共用一个存储
+        if frames is not None and ImageHandler.frame_store is None:
+            ImageHandler.frame_store = FrameStore(**frames)
+
         self.model_instance = model_classes[model_name](platform=platform, device_id=device_id)
 
     def run_inference(self, image_files, extra_args=None):
         """Run inference using the specific model instance."""
         
-        _result, _return_data = GWProc.read_images(image_files)
+        return self.infer_images(self.fetch_images(image_files), extra_args=extra_args)
+
+    # 拆分读图与推理, 调用方可在推理前按图像内容查询结果缓存
+    def fetch_images(self, image_files):
+        """Read images, return (success, images data or error message)."""
+        return GWProc.read_images(image_files)
+
+    def infer_images(self, fetched, extra_args=None):
+        """Run inference on images returned by fetch_images."""
+        _result, _return_data = fetched
         
         if _result == False:
-            return GWProc.result_json(self.model_instance.model_name, GWProc_Result.IMAGE_FAIL, desc=_return_data)
+            return GWProc.result(self.model_instance.model_name, GWProc_Result.IMAGE_FAIL, desc=_return_data)
         else:
-            return self.model_instance.run_inference(_return_data, extra_args=extra_args)
+            try:
+                return self.model_instance.run_inference(_return_data, extra_args=extra_args, image_type="bytes")
+            finally:
+                self.model_instance.release_frames()
+
+    # 启用去重的模型, 结果依赖已告警图片库, 同一图片再次推理可能被判为重复告警, 结果不能缓存
+    @property
+    def cacheable(self):
+        return not getattr(self.model_instance, 'do_dedup', False)
 
     def release(self) -> None:
         self.model_instance.release()
 
+    # FTP连接池, 同一进程内所有模型共享, 首次读图时按ftp_config创建
+    @classmethod
+    def get_ftp_pool(cls):
+        if cls.ftp_pool is None:
+            cls.ftp_pool = FTPPool(
+                cls.ftp_config['ip'],
+                cls.ftp_config['port'],
+                cls.ftp_config['user'],
+                cls.ftp_config['password'],
+                size=cls.ftp_config.get('pool_size', 6),
+                timeout=cls.ftp_config.get('timeout', 10),
+                max_bytes=cls.ftp_config.get('max_bytes', 64 << 20),
+                keepalive=cls.ftp_config.get('keepalive', 30),
+                cache=cls.get_image_cache(),
+            )
+        return cls.ftp_pool
+
+    # 本机图像缓存, 与dispatcher预取共享, 未配置时不使用
+    @classmethod
+    def get_image_cache(cls):
+        _conf = cls.ftp_config.get('image_cache')
+        if _conf is None:
+            return None
+        from gw.imagecache import ImageCache
+        return ImageCache(_conf['root'], _conf['max_bytes'])
+
     # 图像通过ftp服务服务器提供，API调用中URL没有ftp头，仅包括服务器内的路径
     @classmethod
     def read_image(cls, path):
-        try:
-            _connected = False
-            _result = False
-            _data = None
-
-            # Connect to the FTP server
-            ftp = FTP()
-            ftp.connect(cls.ftp_config['ip'], cls.ftp_config['port'])
-            ftp.login(user=cls.ftp_config['user'],passwd=cls.ftp_config['password'])
-            _connected = True
-
-            image_data = BytesIO()
-            ftp.retrbinary(f'RETR {path}', image_data.write)
-            #ftp.quit()
-
-            image_data.seek(0)
-            _data = image_data.read()
-            _result = True
-
-        except error_perm as e:
-            if str(e).startswith('550'):
-                _data = f"File not found on FTP server: {path}"
-            else:
-                _data = f"Permission error: {e}"
-            logger.error(_data)
-        except FileNotFoundError:
-            _data =f"The specified image file {path} was not found."
-            logger.error(_data)
-        except Exception as e:
-            _data = f"An error occurred: {e}"
+        _result, _data = cls.get_ftp_pool().fetch_many([path])[0]
+        if not _result:
             logger.error(_data)
-        finally:
-            # Ensure the FTP connection is closed
-            if _connected:
-                ftp.quit()
-                
-            return _result, _data
+        return _result, _data
 
     # 图像通过ftp服务服务器提供，API调用中URL没有ftp头，仅包括服务器内的路径
+    # 复用连接池中已登录的连接, 多张图像并行下载
     @classmethod
     def read_images(cls, files_path):
-        # Connect to the FTP server
         try:
-            ftp = FTP()
-            ftp.connect(cls.ftp_config['ip'], cls.ftp_config['port'])
-            ftp.login(user=cls.ftp_config['user'],passwd=cls.ftp_config['password'])
-        except error_perm as e:
-            _error_message = f"Login failed: {e}"
-            return False, _error_message
+            _pool = cls.get_ftp_pool()
         except Exception as e:
             _error_message = f"An error occurred during login: {e}"
             return False, _error_message
 
-        _result = True
-        _images_data = []
-        _error_message = ""
-        _newline = ""
+        _results = _pool.fetch_many(files_path, timeout=cls.ftp_config.get('request_timeout'))
 
-        for _path in files_path:
-            try:
-                _data = BytesIO()
-                ftp.retrbinary(f'RETR {_path}', _data.write)
-                _data.seek(0)
-                _encoded_str = base64.urlsafe_b64encode(_data.read())
-                _images_data.append(_encoded_str.decode('utf8'))
-            except error_perm as e:
-                _result = False
-                if str(e).startswith('550'):
-                    _msg = f"File not found on FTP server: {_path}"
-                else:
-                    _msg = f"Permission error: {e}"
-                logger.error(_msg)
-                _error_message += _newline+_msg
-                _newline='\n'           
-            except FileNotFoundError:
-                _result = False
-                _msg =f"The specified image file {_path} was not found."
+        _errors = [_data for _ok, _data in _results if not _ok]
+        if len(_errors) > 0:
+            for _msg in _errors:
                 logger.error(_msg)
-                _error_message += _newline+_msg
-                _newline='\n'
-            except Exception as e:
-                _result = False
-                _msg = f"An error occurred: {e}"
-                logger.error(_msg)
-                _error_message += _newline+_msg
-                _newline='\n'
-            
-        ftp.quit()
-        
-        if _result:
-            return _result, _images_data
-        else:
-            return _result, _error_message
+            return False, '\n'.join(_errors)
+
+        # 直接返回原始图片字节, 不再做base64编解码
+        return True, [_data for _, _data in _results]
 
+    # 返回结构化结果, 由调用方直接构造InferenceResult, 无需再解析JSON字符串
     @classmethod
-    def result_json(cls, type, result, value="0", desc="正常", conf=0.0, pos=[]):
+    def result(cls, type, result, value="0", desc="正常", conf=0.0, pos=[]):
         assert isinstance(result,GWProc_Result), f'返回结果类型{result}非法'
 
-        json_data = {
+        return {
             "type": type,
             "value": value,
             "code": GWProc_result_dict[result],
             "resImageUrl": "",
             "pos": pos,
-            "conf": f'{conf:.4f}',
+            "conf": round(float(conf), 4),
             "desc":desc
         }
+
+    @classmethod
+    def result_json(cls, type, result, value="0", desc="正常", conf=0.0, pos=[]):
+        json_data = cls.result(type, result, value=value, desc=desc, conf=conf, pos=pos)
         
         return json.dumps(json_data, indent=4, ensure_ascii=False)
 
@@ -87,14 +87,14 @@ class HatDetectHatHandler(ImageHandler):
         else:
             logger.info(f'Model {self.model_name} Relased')
 
-    def run_inference(self, images_data, extra_args=None):
+    def run_inference(self, images_data, extra_args=None, image_type="base64"):
 
         if extra_args is not None:
             logger.info(f'{self.model_name}不支持extra_args, 忽略')
 
         payload = {
             "task_tag": "hat_detect",
-            "image_type": "base64",
+            "image_type": image_type,
             "images": images_data,
         }
 
@@ -111,7 +111,7 @@ class HatDetectHatHandler(ImageHandler):
             #当前仅支持单输入单输出, 仅取[0]号元素
             _defects = data['data'][0]['defect_data']
             if len(_defects) == 0:
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
             else:
                 _max_conf = 0.0
                 _pos = []
@@ -124,11 +124,11 @@ class HatDetectHatHandler(ImageHandler):
                     else:
                         _pos=_pos+[_areas]
 
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
         except Exception as e:
             _data = f"{self.model_name}: An error occurred: {e}"
             logger.error(_data)
-            return GWProc.result_json(self.model_name, GWProc_Result.INFER_FAIL, _data)
+            return GWProc.result(self.model_name, GWProc_Result.INFER_FAIL, _data)
 
     def preprocess(self, data, **kwargs):
         return data
@@ -177,10 +177,9 @@ class HatDetectHatHandler(ImageHandler):
                     if ( filter_size2 is not None ) and ( filter_size != filter_size2 ):
                         filter_size = filter_size2
 
-        if image_type == "base64":
-            for i, base64_str in enumerate(images):
-                img0 = self.base64_to_cv2(base64_str)
-                img = self.prepare_input(img0, swapRB=False)
+        if image_type in self.IMAGE_TYPES:
+            for i, image in enumerate(images):
+                img0, img = self.load_input(image, image_type, swapRB=False)
                 
                 if self.platform == 'ONNX':
                     output = sess_hat.run(label_name, {input_name: img}, **kwargs)[0]
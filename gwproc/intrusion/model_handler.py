@@ -108,7 +108,7 @@ class IntrusionDetectIntrusionHandler(ImageHandler):
         else:
             logger.info(f'Model {self.model_name} Relased')
 
-    def run_inference(self, images_data, extra_args=None):
+    def run_inference(self, images_data, extra_args=None, image_type="base64"):
         _areas=[]
         if extra_args is None or extra_args.get('pos') is None:
             logger.info(f'{self.model_name}收到无效extra_args, 忽略')
@@ -138,7 +138,7 @@ class IntrusionDetectIntrusionHandler(ImageHandler):
 
         payload = {
             "task_tag": "intrusion_detect",
-            "image_type": "base64",
+            "image_type": image_type,
             "images": images_data,
             "extra_args": [
                 {
@@ -163,7 +163,7 @@ class IntrusionDetectIntrusionHandler(ImageHandler):
             #当前仅支持单输入单输出, 仅取[0]号元素
             _defects = data['data'][0]['defect_data']
             if len(_defects) == 0:
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
             else:
                 _max_conf = 0.0
                 _pos = []
@@ -189,11 +189,11 @@ class IntrusionDetectIntrusionHandler(ImageHandler):
                     else:
                         _pos=_pos+[_defect_areas]
 
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
         except Exception as e:
             _data = f"{self.model_name}: An error occurred: {e}"
             logger.error(_data)
-            return GWProc.result_json(self.model_name, GWProc_Result.INFER_FAIL, _data)
+            return GWProc.result(self.model_name, GWProc_Result.INFER_FAIL, _data)
         # data = self.preprocess(payload)
         # data = self.inference(data)
         # data = self.postprocess(data)
@@ -270,10 +270,9 @@ class IntrusionDetectIntrusionHandler(ImageHandler):
             areas = self.areas
             #kpt_thres = self.kpt_thres
 
-        if image_type == "base64":
-            for i, base64_str in enumerate(images):
-                img0 = self.base64_to_cv2(base64_str)
-                img = self.prepare_input(img0, swapRB=False)
+        if image_type in self.IMAGE_TYPES:
+            for i, image in enumerate(images):
+                img0, img = self.load_input(image, image_type, swapRB=False)
                 
                 if self.platform == 'ONNX':
                     #output0 = sess.run(label_name, {input_name: img}, **kwargs)
@@ -106,13 +106,13 @@ class PointerMeterDetectLightningRodCurrentMeterHandler(ImageHandler):
             logger.info(f'Model {self.model_name} Relased')
 
 
-    def run_inference(self, images_data, extra_args=None):
+    def run_inference(self, images_data, extra_args=None, image_type="base64"):
         if extra_args is not None:
             logger.info(f'{self.model_name}不支持extra_args, 忽略')
 
         payload = {
             'task_tag': 'pointer_meter_detect',
-            'image_type': 'base64',
+            'image_type': image_type,
             "images": images_data
         }
 
@@ -128,18 +128,18 @@ class PointerMeterDetectLightningRodCurrentMeterHandler(ImageHandler):
 
             _defects = data['data'][0]['defect_data']
             if len(_defects) == 0:
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
             else:
                 #本算法仅支持单读数输出, 仅有[0]号元素
                 _item = _defects[0]
                 _value = str(_item['extra_info']['reading'])
                 _desc = _item['defect_desc']
                 _areas = [{"areas": [{"x":_item['x1'],"y":_item['y1']},{"x":_item['x2'],"y":_item['y2']}]}]
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_AND_DETECT, value=_value, desc=_desc, conf=_item['confidence']/100.0, pos=_areas)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_AND_DETECT, value=_value, desc=_desc, conf=_item['confidence']/100.0, pos=_areas)
         except Exception as e:
             _data = f"{self.model_name}: An error occurred: {e}"
             logger.error(_data)
-            return GWProc.result_json(self.model_name, GWProc_Result.INFER_FAIL, _data)
+            return GWProc.result(self.model_name, GWProc_Result.INFER_FAIL, _data)
 
     def angel_calculate(self, point_yuandian, point):
         point_yuandian = point_yuandian[::-1] * -1
@@ -231,7 +231,7 @@ class PointerMeterDetectLightningRodCurrentMeterHandler(ImageHandler):
                         filter_size = self.filter_size
                     break
 
-        assert image_type == 'base64', f'image_type: {image_type}'
+        assert image_type in self.IMAGE_TYPES, f'image_type: {image_type}'
 
         data = {"code": 200, "data": [], "message": "", "time": 0}
 
@@ -251,9 +251,8 @@ class PointerMeterDetectLightningRodCurrentMeterHandler(ImageHandler):
             input_name_pose2 = sess_pose2.get_inputs()[0].name
             label_name_pose2 = [i.name for i in sess_pose2.get_outputs()]
 
-        for image_num, base64_str in enumerate(images):
-            img0 = self.base64_to_cv2(base64_str)
-            img = self.prepare_input(img0, swapRB=False)
+        for image_num, image in enumerate(images):
+            img0, img = self.load_input(image, image_type, swapRB=False)
 
             # 表类别检测
             if self.platform == 'ONNX':
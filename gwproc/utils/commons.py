@@ -7,6 +7,7 @@ import cv2
 import math
 import numpy as np
 from core.basehandler import BaseHandler
+from utils.letterbox import Letterbox
 from utils.log_config import get_logger
 
 logger = get_logger()
@@ -52,6 +53,32 @@ class ImageHandler(BaseHandler):
         self.classes = ['A_baise_beiyong']
         self.unique_set = self.UniqueImageSet()
 
+    # 支持的图片输入类型: base64仅用于外部传入的数据, 内部直接传原始字节或已解码图像
+    IMAGE_TYPES = ("base64", "bytes", "ndarray")
+
+    # 本机共享的解码图像存储(utils.frame_store.FrameStore), 未配置时每个模型各自解码
+    frame_store = None
+
+    # 按image_type读取图片，返回cv2 image
+    def load_image(self, image, image_type):
+        if image_type == "ndarray":
+            return image
+        if image_type == "bytes":
+            return self.bytes_to_cv2(image)
+        return self.base64_to_cv2(image)
+
+    # 图片读取，从原始图片字节返回cv2 image
+    def bytes_to_cv2(self, data: bytes):
+        try:
+            img0 = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        except Exception as e:
+            raise ValueError(f'图片字节解析错误：{e.__str__()}')
+
+        if img0 is not None:
+            return img0
+        else:
+            raise ValueError(f'图片字节解析错误：图片格式非法')
+
     # 图片读取，从urlsafe base64 string返回cv2 image
     def base64_to_cv2(self, base64string: str):
         try:
@@ -65,33 +92,71 @@ class ImageHandler(BaseHandler):
         else:
             raise ValueError(f'base64字符串解析错误：图片格式非法')
 
-    # 图片预处理，返回图片numpy
-    def prepare_input(self, image, swapRB=True):
-        self.img_height, self.img_width = image.shape[:2]
-
-        # Input shape
-        # create new images of desired size and color (blue) for padding
-
-        r = min(self.new_shape[0] / self.img_height, self.new_shape[1] / self.img_width, 1)
-
-        new_unpad = int(round(self.img_height * r)), int(round(self.img_width * r))
-        dh, dw = self.new_shape[0] - new_unpad[0], self.new_shape[1] - new_unpad[1]
-        dw /= 2  # divide padding into 2 sides
-        dh /= 2
-        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    # 读图并预处理，返回(cv2 image, 输入tensor)
+    # 配置了frame_store时按图片内容共享: 同一图片只解码一次, 相同输入尺寸和通道顺序只预处理一次
+    # 返回的共享数组只读, 推理结束后调用release_frames释放引用
+    def load_input(self, image, image_type, swapRB=True):
+        img0s, img, _ = self.load_inputs([image], image_type, swapRB=swapRB)
+        return img0s[0], img
+
+    # 批量读图并预处理到同一个NCHW缓冲区, 返回(cv2 image列表, tensor, letterbox参数列表)
+    # batch大于图片数时多余位置填0
+    def load_inputs(self, images, image_type, swapRB=True, batch=None):
+        engine = self.letterbox_engine()
+        store = self.frame_store if image_type == "bytes" else None
+        buf = engine.buffer(len(images) if batch is None else batch)
+
+        img0s, params = [], []
+        for i, image in enumerate(images):
+            if store is None:
+                img0s.append(self.load_image(image, image_type))
+                params.append(engine.fill(img0s[-1], i, swapRB))
+                continue
 
-        image = cv2.resize(image, (new_unpad[1], new_unpad[0]))
+            key = store.key(image)
+            img0 = store.load(key, lambda: self.load_image(image, image_type))
+            img0s.append(img0)
 
-        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+            _key = f"{key}-{'x'.join(map(str, engine.shape))}-{int(swapRB)}"
+            shared = store.get(_key)
+            if shared is not None:
+                buf[i] = shared[0]
+                params.append(engine.params(*img0.shape[:2]))
+            else:
+                params.append(engine.fill(img0, i, swapRB))
+                store.put(_key, buf[i:i + 1])
+
+        buf[len(images):] = 0
+        # 兼容旧接口, 同prepare_input记录最后一张原图尺寸
+        if len(params) > 0:
+            self.img_height, self.img_width = params[-1].src_h, params[-1].src_w
+        return img0s, buf, params
+
+    def release_frames(self):
+        if self.frame_store is not None:
+            self.frame_store.release()
+
+    # 预处理引擎, 按输入尺寸预分配float32 NCHW缓冲区, 同一模型反复复用
+    # 返回的tensor是缓冲区视图, 下次预处理时被覆盖
+    def letterbox_engine(self):
+        engine = getattr(self, '_letterbox', None)
+        if engine is None or engine.shape != tuple(self.new_shape):
+            engine = self._letterbox = Letterbox(self.new_shape)
+        return engine
+
+    # 图片预处理，返回(1, 3, H, W) tensor和letterbox参数
+    def letterbox(self, image, swapRB=True):
+        return self.letterbox_engine()(image, swapRB=swapRB)
+
+    # 批量图片预处理到同一缓冲区，返回(n, 3, H, W) tensor和letterbox参数列表
+    def prepare_batch(self, images, swapRB=True, batch=None):
+        return self.letterbox_engine().batch(images, swapRB=swapRB, n=batch)
 
-        if swapRB:
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        else:
-            image_rgb = image
-        input_image = image_rgb / 255.0
-        input_image = input_image.transpose(2, 0, 1)[::-1]
-        input_tensor = input_image[np.newaxis, :, :, :].astype(np.float32)
+    # 图片预处理，返回图片numpy
+    # 兼容旧接口: 记录原图尺寸供rescale_boxes等使用, 新代码使用letterbox显式取得参数
+    def prepare_input(self, image, swapRB=True):
+        input_tensor, params = self.letterbox(image, swapRB=swapRB)
+        self.img_height, self.img_width = params.src_h, params.src_w
         return input_tensor
 
     # nms iou xywh2xyxy
@@ -363,7 +428,13 @@ class ImageHandler(BaseHandler):
 
         return box_out, score_out, class_out, mask_out
 
-    def rescale_boxes(self, boxes):
+    def rescale_boxes(self, boxes, params=None):
+        if params is not None:
+            boxes[..., 0] = boxes[..., 0] - params.left
+            boxes[..., 1] = boxes[..., 1] - params.top
+            boxes[..., :4] /= params.r
+            return boxes
+
         r = min(self.new_shape[0] / self.img_height, self.new_shape[1] / self.img_width, 1)
         new_unpad = int(round(self.img_height * r)), int(round(self.img_width * r))
         dh, dw = self.new_shape[0] - new_unpad[0], self.new_shape[1] - new_unpad[1]
@@ -0,0 +1,216 @@
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from utils.log_config import get_logger
+
+logger = get_logger()
+
+
+# 段头: 魔数, 就绪标志, 引用计数, 最后释放时间, dtype, 维度数, 各维大小
+_HEADER = struct.Struct("<4sB3xqd8sI4q")
+_HEADER_SIZE = 128
+_MAGIC = b"GWFS"
+
+
+class FrameStore:
+    """Decoded frames and input tensors shared by runners on one host.
+
+    Each frame or tensor is a POSIX shared memory segment (a file under
+    /dev/shm), keyed by image content, mapped read-only by every reader.
+    Readers hold a reference until release(); segments with no reference
+    are kept for linger_s so other models of the same object reuse them,
+    then removed. Segments older than max_age_s are removed anyway, so
+    references leaked by dead runners never pin memory.
+    """
+
+    # 未指定上限时, 占用所在共享内存文件系统的比例, 其余留给图像缓存等
+    DEFAULT_SHM_SHARE = 0.25
+
+    def __init__(self, root="/dev/shm/gw-frames", max_bytes=None, linger_s=30, max_age_s=600):
+        os.makedirs(root, exist_ok=True)
+        if max_bytes is None:
+            st = os.statvfs(root)
+            max_bytes = int(st.f_frsize * st.f_blocks * self.DEFAULT_SHM_SHARE)
+
+        self._root = root
+        self._max_bytes = max_bytes
+        self._linger_s = linger_s
+        self._max_age_s = max_age_s
+
+        # 本进程持有引用的段, 每次attach记一次
+        self._held = []
+        self._next_sweep = 0.0
+
+        self._lock_fd = os.open(os.path.join(root, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self._root, name)
+
+    # 段头只在持有全局锁时读写, 锁只保护引用计数和就绪标志, 数据拷贝在锁外
+    @contextlib.contextmanager
+    def _locked(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _array(mm, header):
+        _, _, _, _, dtype, ndim, *shape = header
+        dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        shape = tuple(shape[:ndim])
+        count = int(np.prod(shape)) if ndim > 0 else 1
+        arr = np.frombuffer(mm, dtype=dtype, count=count, offset=_HEADER_SIZE).reshape(shape)
+        # 其他模型也在读, 不允许原地修改
+        arr.flags.writeable = False
+        return arr
+
+    def get(self, name):
+        """Attach a ready segment, return read-only array or None."""
+        try:
+            fd = os.open(self._path(name), os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            with self._locked():
+                if os.fstat(fd).st_size < _HEADER_SIZE:
+                    return None
+                mm = mmap.mmap(fd, 0)
+                header = _HEADER.unpack_from(mm, 0)
+                if header[0] != _MAGIC or header[1] == 0:
+                    mm.close()
+                    return None
+                _HEADER.pack_into(mm, 0, *header[:2], header[2] + 1, *header[3:])
+        finally:
+            os.close(fd)
+
+        self._held.append(mm)
+        return self._array(mm, header)
+
+    def put(self, name, array):
+        """Copy array into a new segment and attach it.
+
+        Return the shared read-only array, or array itself if segment
+        exists (written by another runner now) or store is full.
+        """
+        if array.ndim > 4:
+            return array
+        array = np.ascontiguousarray(array)
+        size = _HEADER_SIZE + array.nbytes
+        if size > self._max_bytes:
+            return array
+
+        path = self._path(name)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return array
+        # 先分配实际空间: ftruncate在tmpfs上只产生稀疏文件, 写满时通过mmap写入会触发SIGBUS
+        try:
+            os.posix_fallocate(fd, 0, size)
+            mm = mmap.mmap(fd, size)
+        except OSError as e:
+            # /dev/shm已满
+            logger.warning(f"frame store create {name} failed: {e}")
+            os.close(fd)
+            os.unlink(path)
+            return array
+        os.close(fd)
+
+        if array.size > 0:
+            np.frombuffer(mm, dtype=array.dtype, count=array.size, offset=_HEADER_SIZE)[:] = array.reshape(-1)
+        shape = list(array.shape) + [0] * (4 - array.ndim)
+        header = (_MAGIC, 1, 1, 0.0, array.dtype.str.encode(), array.ndim, *shape)
+        with self._locked():
+            _HEADER.pack_into(mm, 0, *header)
+
+        self._held.append(mm)
+        return self._array(mm, header)
+
+    def load(self, name, make):
+        """Return shared array of name, make and share it if missing."""
+        arr = self.get(name)
+        if arr is None:
+            arr = self.put(name, make())
+        return arr
+
+    def release(self):
+        """Drop references taken since last release.
+
+        Arrays already returned stay valid, mapping is unmapped when
+        the last array of it is gone.
+        """
+        now = time.time()
+        with self._locked():
+            for mm in self._held:
+                try:
+                    header = _HEADER.unpack_from(mm, 0)
+                    _HEADER.pack_into(mm, 0, *header[:2], max(header[2] - 1, 0), now, *header[4:])
+                except (ValueError, struct.error):
+                    pass
+        self._held = []
+
+        if now >= self._next_sweep:
+            self._next_sweep = now + self._linger_s / 2
+            try:
+                self.sweep(now)
+            except OSError as e:
+                logger.warning(f"frame store sweep failed: {e}")
+
+    def sweep(self, now=None):
+        """Remove idle segments after linger, and least recently released over cap."""
+        if now is None:
+            now = time.time()
+
+        with self._locked():
+            idle = []
+            total = 0
+            with os.scandir(self._root) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        st = entry.stat()
+                        with open(entry.path, "rb") as f:
+                            raw = f.read(_HEADER.size)
+                    except FileNotFoundError:
+                        continue
+
+                    # 正在写入的段没有魔数, 超过linger仍未写完视为写入者已退出
+                    if len(raw) < _HEADER.size or raw[:4] != _MAGIC:
+                        if now - st.st_mtime > self._linger_s:
+                            os.unlink(entry.path)
+                        continue
+
+                    # 过期段直接删除, 已映射的读者不受影响
+                    if now - st.st_mtime > self._max_age_s:
+                        os.unlink(entry.path)
+                        continue
+
+                    _, ready, refs, released_at, *_ = _HEADER.unpack(raw)
+                    if ready and refs <= 0:
+                        if now - released_at > self._linger_s:
+                            os.unlink(entry.path)
+                            continue
+                        idle.append((released_at, st.st_size, entry.path))
+                    total += st.st_size
+
+            # 超出上限时, 从最早释放的空闲段开始删除
+            idle.sort()
+            for _, size, path in idle:
+                if total <= self._max_bytes:
+                    break
+                os.unlink(path)
+                total -= size
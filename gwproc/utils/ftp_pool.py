@@ -0,0 +1,217 @@
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from ftplib import FTP, error_perm, error_temp
+
+from utils.log_config import get_logger
+
+logger = get_logger()
+
+
+class FTPBudgetExceeded(Exception):
+    pass
+
+
+class _Budget:
+    # 一次请求下载的总字节数上限, 并行下载共享
+    def __init__(self, max_bytes):
+        self._left = max_bytes
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        with self._lock:
+            self._left -= n
+            if self._left < 0:
+                raise FTPBudgetExceeded("image bytes over budget")
+
+
+class FTPPool:
+    """Pool of logged-in FTP connections, reused across requests.
+
+    Idle connections are kept alive by NOOP, broken ones are dropped and
+    reconnected on next use. Images of one request download in parallel.
+    """
+
+    def __init__(self, ip, port, user, password, size=6, timeout=10,
+                 max_bytes=64 << 20, keepalive=30, cache=None):
+        self._ip = ip
+        self._port = port
+        self._user = user
+        self._password = password
+        self._timeout = timeout
+        self._max_bytes = max_bytes
+        self._keepalive = keepalive
+
+        # 本机图像缓存(gw.imagecache.ImageCache), 按路径+大小+修改时间命中, 命中时直接映射文件
+        self._cache = cache
+
+        # 同时使用的连接数不超过size, 空闲连接后进先出, 优先复用最近用过的
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="ftp")
+
+        self._stop = threading.Event()
+        threading.Thread(target=self._keepalive_loop, daemon=True).start()
+
+    def _connect(self):
+        ftp = FTP(timeout=self._timeout)
+        ftp.connect(self._ip, self._port)
+        ftp.login(user=self._user, passwd=self._password)
+        ftp.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return ftp
+
+    @staticmethod
+    def _close(ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise TimeoutError("no free ftp connection")
+        try:
+            return self._idle.get_nowait()[0]
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, ftp, healthy):
+        if healthy and not self._stop.is_set():
+            self._idle.put((ftp, time.monotonic()))
+        else:
+            self._close(ftp)
+        self._slots.release()
+
+    def _keepalive_loop(self):
+        # 定期对空闲连接发送NOOP, 防止服务端断开空闲连接, 失效连接直接丢弃
+        # 取出的连接占用连接数, 并发请求等待而不是因空闲队列暂时为空另建连接
+        while not self._stop.wait(self._keepalive):
+            fresh, stale = [], []
+            while self._slots.acquire(blocking=False):
+                try:
+                    ftp, used = self._idle.get_nowait()
+                except queue.Empty:
+                    self._slots.release()
+                    break
+                if time.monotonic() - used < self._keepalive:
+                    fresh.append((ftp, used))
+                else:
+                    stale.append(ftp)
+            for item in reversed(fresh):
+                self._idle.put(item)
+                self._slots.release()
+            # 逐个检查, 检查完立即归还
+            for ftp in stale:
+                try:
+                    ftp.voidcmd("NOOP")
+                    healthy = True
+                except Exception:
+                    healthy = False
+                self._release(ftp, healthy)
+
+    def _retrieve(self, ftp, path, budget):
+        chunks = []
+
+        def write(block):
+            budget.take(len(block))
+            chunks.append(block)
+
+        if self._cache is None:
+            ftp.retrbinary(f'RETR {path}', write)
+            return b"".join(chunks)
+
+        # 文件大小和修改时间作为缓存键, 文件被替换后不会命中旧数据
+        # 与dispatcher预取使用同一函数, 保证缓存键一致
+        from gw.imagecache import ftp_stat
+        try:
+            size, mtime = ftp_stat(ftp, path)
+        except error_perm as e:
+            if str(e).startswith('550'):
+                raise
+            # 服务端不支持SIZE/MDTM, 不再使用缓存
+            logger.warning(f"ftp server not support SIZE/MDTM, image cache disabled: {e}")
+            self._cache = None
+            ftp.retrbinary(f'RETR {path}', write)
+            return b"".join(chunks)
+
+        data = self._cache.get(path, size, mtime)
+        if data is not None:
+            budget.take(len(data))
+            return data
+
+        ftp.retrbinary(f'RETR {path}', write)
+        data = b"".join(chunks)
+        # 缓存写入失败(如/dev/shm已满)不影响本次读图, 连接也正常
+        try:
+            self._cache.put(path, size, mtime, data)
+        except OSError as e:
+            logger.warning(f"image cache put {path} failed: {e}")
+        return data
+
+    def fetch(self, path, budget=None):
+        """Download one file, retry once on a fresh connection if connection broken."""
+        if budget is None:
+            budget = _Budget(self._max_bytes)
+
+        for attempt in range(2):
+            ftp = self._acquire()
+            healthy = False
+            try:
+                data = self._retrieve(ftp, path, budget)
+                healthy = True
+                return data
+            except error_perm:
+                # 文件不存在或无权限, 连接本身正常
+                healthy = True
+                raise
+            except FTPBudgetExceeded:
+                # 传输被中断, 连接状态未知, 丢弃
+                raise
+            except (OSError, EOFError, error_temp) as e:
+                if attempt == 1:
+                    raise
+                logger.warning(f"ftp connection broken, reconnect and retry {path}: {e}")
+            finally:
+                self._release(ftp, healthy)
+
+    def fetch_many(self, paths, timeout=None):
+        """Download files in parallel, in order of paths.
+
+        Return list of (success, bytes or error message).
+        """
+        budget = _Budget(self._max_bytes)
+        futures = [self._executor.submit(self.fetch, p, budget) for p in paths]
+        wait(futures, timeout=timeout)
+
+        results = []
+        for path, f in zip(paths, futures):
+            if not f.done():
+                results.append((False, f"Download timeout: {path}"))
+                continue
+            e = f.exception()
+            if e is None:
+                results.append((True, f.result()))
+            elif isinstance(e, error_perm) and str(e).startswith('550'):
+                results.append((False, f"File not found on FTP server: {path}"))
+            elif isinstance(e, error_perm):
+                results.append((False, f"Permission error: {e}"))
+            else:
+                results.append((False, f"An error occurred: {e}"))
+        return results
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                ftp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(ftp)
@@ -0,0 +1,75 @@
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+
+class LetterboxParams(NamedTuple):
+    # 原图尺寸, 缩放比例, 缩放后尺寸, 上/左填充; 输出坐标减去填充再除以r即为原图坐标
+    src_h: int
+    src_w: int
+    r: float
+    new_h: int
+    new_w: int
+    top: int
+    left: int
+
+
+class Letterbox:
+    """Letterbox BGR images into a preallocated float32 NCHW buffer.
+
+    Resized pixels are scaled to [0, 1] and written straight into the
+    buffer in model channel order, only padding around them is filled.
+    Returned tensors are views of the buffer, valid until next call.
+    """
+
+    def __init__(self, new_shape=(640, 640), max_batch=1, pad=114):
+        self.shape = tuple(new_shape)
+        # 与原实现一致: 先按float64计算再转float32
+        self._pad = pad / 255.0
+        self._buf = np.empty((max_batch, 3) + self.shape, dtype=np.float32)
+
+    def params(self, h, w):
+        r = min(self.shape[0] / h, self.shape[1] / w, 1)
+        new_h, new_w = int(round(h * r)), int(round(w * r))
+        dh, dw = (self.shape[0] - new_h) / 2, (self.shape[1] - new_w) / 2
+        return LetterboxParams(h, w, r, new_h, new_w, int(round(dh - 0.1)), int(round(dw - 0.1)))
+
+    def buffer(self, n):
+        # 批量大小超过已分配时扩容, 之后一直复用
+        if n > self._buf.shape[0]:
+            self._buf = np.empty((n, 3) + self.shape, dtype=np.float32)
+        return self._buf[:n]
+
+    def fill(self, image, index=0, swapRB=True):
+        """Letterbox image into slot index of buffer, return its params."""
+        p = self.params(*image.shape[:2])
+        if (p.new_h, p.new_w) != (p.src_h, p.src_w):
+            image = cv2.resize(image, (p.new_w, p.new_h))
+
+        out = self._buf[index]
+        bottom, right = p.top + p.new_h, p.left + p.new_w
+        out[:, :p.top] = self._pad
+        out[:, bottom:] = self._pad
+        out[:, p.top:bottom, :p.left] = self._pad
+        out[:, p.top:bottom, right:] = self._pad
+
+        # 原实现swapRB时先转RGB, 再整体翻转通道, 合并为一次通道映射
+        order = (0, 1, 2) if swapRB else (2, 1, 0)
+        for c, src in enumerate(order):
+            np.divide(image[:, :, src], 255.0, out=out[c, p.top:bottom, p.left:right], casting="unsafe")
+        return p
+
+    def __call__(self, image, swapRB=True):
+        """Return (1, 3, H, W) tensor and params of one image."""
+        self.buffer(1)
+        p = self.fill(image, 0, swapRB)
+        return self._buf[:1], p
+
+    def batch(self, images, swapRB=True, n=None):
+        """Return (n, 3, H, W) tensor and params of images, slots past images are zero."""
+        n = len(images) if n is None else n
+        buf = self.buffer(n)
+        params = [self.fill(image, i, swapRB) for i, image in enumerate(images)]
+        buf[len(images):] = 0
+        return buf, params
@@ -861,7 +861,7 @@ class BehaviorDetectWanderingHandler(ImageHandler):
         else:
             logger.info(f'Model {self.model_name} Relased')
 
-    def run_inference(self, images_data, extra_args=None):
+    def run_inference(self, images_data, extra_args=None, image_type="base64"):
         _areas=[]
         if extra_args is None or extra_args.get('pos') is None:
             logger.info(f'{self.model_name}收到无效extra_args, 忽略')
@@ -891,7 +891,7 @@ class BehaviorDetectWanderingHandler(ImageHandler):
 
         payload = {
         "task_tag": "behavior_detect",
-        "image_type": "base64",
+        "image_type": image_type,
         "images": images_data,
             "extra_args": [
                 {
@@ -916,7 +916,7 @@ class BehaviorDetectWanderingHandler(ImageHandler):
             #当前仅支持单输入单输出, 仅取[0]号元素
             _defects = data['data'][0]['defect_data']
             if len(_defects) == 0:
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_ZERO_DETECT)
             else:
                 _max_conf = 0.0
                 _pos = []
@@ -942,11 +942,11 @@ class BehaviorDetectWanderingHandler(ImageHandler):
                     else:
                         _pos=_pos+[_defect_areas]
 
-                return GWProc.result_json(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
+                return GWProc.result(self.model_name, GWProc_Result.INFER_AND_DETECT, value="1", desc=_desc, conf=_max_conf/100.0, pos=_pos)
         except Exception as e:
             _data = f"{self.model_name}: An error occurred: {e}"
             logger.error(_data)
-            return GWProc.result_json(self.model_name, GWProc_Result.INFER_FAIL, _data)
+            return GWProc.result(self.model_name, GWProc_Result.INFER_FAIL, _data)
         # data = self.preprocess(payload)
         # data = self.inference(data)
         # data = self.postprocess(data)
@@ -1005,20 +1005,16 @@ class BehaviorDetectWanderingHandler(ImageHandler):
                 filter_size = self.filter_size
             #kpt_thres = self.kpt_thres
                                     
-        if image_type == "base64":
-            im = np.zeros((6, 3, 640, 640), dtype = np.float32)
-            for i ,base64_str in enumerate(images):
-                img0 = self.base64_to_cv2(base64_str)
-                img = self.prepare_input(img0, swapRB=False)
-                im[i] = img
+        if image_type in self.IMAGE_TYPES:
+            # 每张图只解码一次, 推理后复用解码结果; 6帧直接预处理到同一个预分配的输入缓冲区
+            img0s, im, _ = self.load_inputs(images, image_type, swapRB=False, batch=6)
             
             if self.platform == 'ONNX':
                 output = sess.run(label_name, {input_name: im}, **kwargs)[0]
             elif self.platform == 'ASCEND':
                 output = sess.execute([im])[0]
 
-            for i, base64_str in enumerate(images):
-                img0 = self.base64_to_cv2(base64_str)
+            for i, img0 in enumerate(img0s):
                 return_datas.append(["img" + str(i + 1), img0, np.expand_dims(output[i], axis=0)])
 
         else:
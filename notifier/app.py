@@ -1,35 +1,58 @@
-import json
-import signal
-import threading
+import asyncio
 
 import redis
-import requests
+import redis.asyncio as aioredis
 from loguru import logger
 
+from delivery import CallbackDeliverer, CoalescingDeliverer
+from gw.aiostreams import AsyncStreamMessage, AsyncStreams, StreamConsumer, run_consumers
+from gw.callbacks import CallbackRetry, DeliveryStats
 from gw.settings import get_app_settings
-from gw.streams import Streams
 from gw.tasks import TaskPool
 from gw.utils import generate_a_random_hex_str
 from gw.utils import initlize_logger
-from gw.models import TaskResults
 
-def make_signal_handler(evt: threading.Event):
-    def handler(signum, frame):
-        evt.set()
-    return handler
+
+async def maintain(
+    deliverer: CallbackDeliverer,
+    retry: CallbackRetry,
+    stats: DeliveryStats,
+    rdb: aioredis.Redis,
+    consumer: str,
+    batch: int,
+):
+    # Deliver tasks due to retry, and export delivery stats, every second.
+    # Runs until cancelled.
+    deliveries = set()
+    while True:
+        try:
+            for tid in await retry.take_due(count=max(batch - len(deliveries), 0)):
+                t = asyncio.create_task(deliverer.deliver(tid))
+                deliveries.add(t)
+                t.add_done_callback(deliveries.discard)
+            await stats.export(rdb, consumer)
+        except Exception as e:
+            logger.error(f"retry callbacks failed, {e}")
+        await asyncio.sleep(1)
 
 
-def main():
+async def main():
     settings = get_app_settings()
 
     initlize_logger("notifier")
 
     # Connect redis.
+    # Async client serves message stream, sync client serves task pool.
     rdb = redis.Redis(
         host=settings.redis_host,
         port=settings.redis_port,
         db=settings.redis_db
     )
+    ardb = aioredis.Redis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=settings.redis_db
+    )
     logger.info(f"connect redis {settings.redis_host}:{settings.redis_port}, " +
                 f"use db {settings.redis_db}")
 
@@ -41,73 +64,64 @@ def main():
     # Connect stream. receive message from task finish stream.
     # Make a unique consumer name.
     consumer = f"{generate_a_random_hex_str(length=8)}::notifier::consumer"
-    stream = Streams(connection_pool=rdb.connection_pool).task_finish
+    stream = AsyncStreams(rdb=ardb,
+                          claim_interval_ms=settings.stream_claim_interval_ms).task_finish
     logger.info(f"use stream {stream.stream} receive message, readgroup {stream.readgroup}, " +
                 f"consumer name {consumer}")
 
-    # Make loop stop flag and register signal handler
-    stop_flag = threading.Event()
-    signal.signal(signal.SIGTERM, make_signal_handler(stop_flag))
-    signal.signal(signal.SIGINT, make_signal_handler(stop_flag))
-
-    logger.info("start event loop.")
-    while not stop_flag.is_set():
-
-        # Pull one message from stream once, block wating 1000 ms.
-        # Which in order to check if stop flag set every 1 second.
-        # If stop flag set, stop message loop.
-        messages = stream.pull(consumer, count=1, block=1 * 1000)
-
-        # Ignore when timeout or stream broken.
-        if len(messages) == 0:
-            continue
+    # Deliver over pooled connections, failed deliveries go to retry schedule.
+    retry = CallbackRetry(
+        ardb,
+        retry_base_ms=settings.notifier_retry_base_ms,
+        retry_max_ms=settings.notifier_retry_max_ms,
+        max_attempts=settings.notifier_max_attempts,
+    )
+    stats = DeliveryStats()
+    kws = dict(
+        timeout_s=settings.notifier_timeout_s,
+        max_connections=settings.notifier_max_connections,
+        per_host_concurrency=settings.notifier_per_host_concurrency,
+    )
+    if settings.notifier_coalesce:
+        deliverer = CoalescingDeliverer(
+            taskpool,
+            retry,
+            stats,
+            window_ms=settings.notifier_coalesce_window_ms,
+            max_batch=settings.notifier_coalesce_max,
+            **kws,
+        )
+    else:
+        deliverer = CallbackDeliverer(taskpool, retry, stats, **kws)
+    maintainer = asyncio.create_task(
+        maintain(deliverer, retry, stats, ardb, consumer, settings.consumer_concurrency)
+    )
 
-        msg = messages[0]
-        mid = msg.id
+    # Every message is consumed after handled, even delivery failed,
+    # failed one is already scheduled to retry.
+    async def handle(msg: AsyncStreamMessage):
         tid = msg.data["task_id"].decode()
-        logger.info(f"recieve message {mid}, task id {tid}")
+        logger.info(f"recieve message {msg.id}, task id {tid}")
+        await deliverer.deliver(tid)
 
-        # Read task data, ignore if task invalid
-        # Need consume this message.
-        task = taskpool.get(tid)
-        if task is None:
-            msg.ack()
-            continue
-
-        try:
-            res = task.get_postprocess_result()
-            resp = requests.post(task.callback, json=res.model_dump(by_alias=True))
-        except requests.exceptions.InvalidURL as e:
-            logger.error(f"invalid url: {e}")
-            # TODO: task have a invalid callback url, what should do ?
-            msg.ack()
-            continue
-        except requests.exceptions.ConnectionError as e:
-            logger.error(f"send request error: {e}")
-            
-            # Ack this message to prevent retry. We will retry later.
-            msg.ack()
-
-            # TODO: mark this task, it need retry callback.
-            continue
-
-        if resp.status_code == 200:
-            logger.info(f"call {task.callback} send result.")
-            msg.ack()
-        else:
-            # TODO: handle request failed.
-            msg.ack()
-            pass
-
-        # Every things ok, delete this task and its results.
-        taskpool.delete(task.task_id)
+    # Deliver concurrently so one slow callback not stall others.
+    # Stop on signal and drain deliveries in flight.
+    logger.info("start event loop.")
+    await run_consumers(
+        StreamConsumer(stream, consumer, handle,
+                       concurrency=settings.consumer_concurrency),
+        drain_timeout=settings.consumer_drain_timeout_s,
+    )
 
     # Stop loop, do cleanup.
     logger.info("recieve stop signal, cleanup...")
+    maintainer.cancel()
+    await deliverer.aclose()
+    await ardb.aclose()
     rdb.close()
 
 
 if __name__ == "__main__":
     logger.info("start norifier app...")
-    main()
+    asyncio.run(main())
     logger.info("notifier app shutdown.")
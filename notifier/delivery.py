@@ -0,0 +1,247 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+from loguru import logger
+
+from gw.callbacks import CallbackRetry, DeliveryStats
+from gw.tasks import TaskPool
+
+
+class CallbackDeliverer:
+
+    # Deliver task results to callback url over pooled keep-alive connections.
+    # Deliveries in flight to one host are limited, so a slow host never takes
+    # all notifier slots, its tasks are deferred instead.
+
+    # Delay of task deferred because its host is saturated.
+    HOST_BUSY_DELAY_S = 1.0
+
+    def __init__(
+        self,
+        taskpool: TaskPool,
+        retry: CallbackRetry,
+        stats: DeliveryStats,
+        timeout_s: float = 10,
+        max_connections: int = 100,
+        per_host_concurrency: int = 4,
+    ) -> None:
+        self._taskpool = taskpool
+        self._retry = retry
+        self._stats = stats
+        self._per_host_concurrency = per_host_concurrency
+        self._inflight: Dict[str, int] = {}
+
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout_s),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def _read_task(self, tid: str) -> Optional[Tuple[str, Any]]:
+        # Callback url and result of task, None if task or result gone.
+        task = self._taskpool.get(tid)
+        if task is None:
+            return None
+        res = task.get_postprocess_result()
+        if res is None:
+            return None
+        return (task.callback, res.model_dump(by_alias=True))
+
+    async def _load(self, tid: str) -> Optional[Tuple[str, Any]]:
+        data = await asyncio.to_thread(self._read_task, tid)
+        if data is None:
+            logger.warning(f"task {tid} or its result gone, skip callback.")
+            await self._retry.done(tid)
+        return data
+
+    async def _post(
+        self, url: httpx.URL, payload: Any
+    ) -> Tuple[Optional[httpx.Response], str, bool]:
+        # Return response if succeeded, or failure reason and if it's permanent.
+        start = time.monotonic()
+        resp = None
+        try:
+            resp = await self._client.post(url, json=payload)
+            reason = f"status {resp.status_code}"
+            permanent = resp.is_client_error and resp.status_code not in (408, 429)
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+            reason, permanent = f"invalid url, {e}", True
+        except httpx.HTTPError as e:
+            reason, permanent = f"{type(e).__name__} {e}", False
+
+        ok = resp is not None and resp.is_success
+        self._stats.record(time.monotonic() - start, ok)
+        return (resp if ok else None, reason, permanent)
+
+    async def _settle(
+        self, tid: str, callback: str, ok: bool, reason: str, permanent: bool, now: float = None
+    ):
+        # Every things ok, delete this task and its results.
+        if ok:
+            logger.info(f"call {callback} send result of task {tid}.")
+            await self._retry.done(tid)
+            await asyncio.to_thread(self._taskpool.delete, tid)
+            return
+
+        if permanent:
+            logger.error(f"callback {callback} of task {tid} rejected, {reason}")
+            await self._retry.dead(tid, callback, reason)
+            return
+
+        delay = await self._retry.retry(tid, now=now)
+        if delay is None:
+            logger.error(f"callback {callback} of task {tid} failed too many times, {reason}")
+            await self._retry.dead(tid, callback, f"attempts exhausted, {reason}")
+            return
+        logger.warning(f"callback {callback} of task {tid} failed, {reason}, retry in {delay}s")
+
+    async def deliver(self, tid: str):
+        data = await self._load(tid)
+        if data is None:
+            return
+        (callback, payload) = data
+
+        try:
+            url = httpx.URL(callback)
+            host = f"{url.host}:{url.port}"
+        except (httpx.InvalidURL, TypeError) as e:
+            await self._settle(tid, callback, False, f"invalid url, {e}", True)
+            return
+
+        if self._inflight.get(host, 0) >= self._per_host_concurrency:
+            logger.debug(f"host {host} saturated, defer task {tid}")
+            await self._retry.defer(tid, self.HOST_BUSY_DELAY_S)
+            return
+
+        self._inflight[host] = self._inflight.get(host, 0) + 1
+        try:
+            resp, reason, permanent = await self._post(url, payload)
+        finally:
+            self._inflight[host] -= 1
+            if self._inflight[host] == 0:
+                del self._inflight[host]
+        await self._settle(tid, callback, resp is not None, reason, permanent)
+
+
+class CoalescingDeliverer(CallbackDeliverer):
+
+    # Results to the same callback url are buffered for a short window, or up to
+    # max batch, then sent by one worker of that url over its keep-alive connection.
+    # One worker per url keeps delivery order.
+    #
+    # Client advertises batch support by BATCH_URL_HEADER in callback response,
+    # then buffered results are posted to that url as one json list.
+
+    BATCH_URL_HEADER = "X-GW-Batch-Url"
+
+    def __init__(self, *args, window_ms: int = 50, max_batch: int = 16, **kws) -> None:
+        super().__init__(*args, **kws)
+        self._window_s = window_ms / 1000
+        self._max_batch = max_batch
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._batch_urls: Dict[str, httpx.URL] = {}
+        # Loop keeps tasks only by weak reference, hold workers until they exit.
+        self._workers: Set[asyncio.Task] = set()
+
+    async def deliver(self, tid: str):
+        # Return after result sent, or scheduled to retry,
+        # so stream message is acked only then.
+        data = await self._load(tid)
+        if data is None:
+            return
+        (callback, payload) = data
+
+        done = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(callback)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[callback] = queue
+            t = asyncio.create_task(self._worker(callback, queue))
+            self._workers.add(t)
+            t.add_done_callback(self._workers.discard)
+        queue.put_nowait((tid, payload, done))
+        await done
+
+    async def _worker(self, callback: str, queue: asyncio.Queue):
+        # Exit when no result comes in a window, next result starts a new worker.
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                batch = [await asyncio.wait_for(queue.get(), self._window_s)]
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[callback]
+                    return
+                continue
+
+            deadline = loop.time() + self._window_s
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._send(callback, batch)
+            except Exception as e:
+                logger.error(f"send {len(batch)} result(s) to {callback} failed, {e}")
+                await self._reschedule(callback, batch, f"{type(e).__name__} {e}")
+            finally:
+                for _, _, done in batch:
+                    if not done.done():
+                        done.set_result(None)
+
+    async def _reschedule(
+        self, callback: str, batch: List[Tuple[str, Any, asyncio.Future]], reason: str
+    ):
+        # Send broke in the middle, retry whole batch in order. Tasks already
+        # delivered are gone when retried, and just cleared then.
+        # If even retry not scheduled, fail the delivery, so message stays pending.
+        now = time.time()
+        for i, (tid, _, done) in enumerate(batch):
+            try:
+                await self._settle(tid, callback, False, reason, False, now=now + i / 1000)
+            except Exception as e:
+                logger.error(f"schedule retry of task {tid} failed, {e}")
+                if not done.done():
+                    done.set_exception(e)
+
+    async def _send(self, callback: str, batch: List[Tuple[str, Any, asyncio.Future]]):
+        try:
+            url = httpx.URL(callback)
+        except (httpx.InvalidURL, TypeError) as e:
+            for tid, _, _ in batch:
+                await self._settle(tid, callback, False, f"invalid url, {e}", True)
+            return
+
+        # Retries keep order of batch, by schedule time.
+        now = time.time()
+
+        batch_url = self._batch_urls.get(callback)
+        if batch_url is not None and len(batch) > 1:
+            resp, reason, permanent = await self._post(batch_url, [p for _, p, _ in batch])
+            for i, (tid, _, _) in enumerate(batch):
+                await self._settle(
+                    tid, callback, resp is not None, reason, permanent, now=now + i / 1000
+                )
+            return
+
+        # Send one by one, stop at first retryable failure and retry the rest in order.
+        for i, (tid, payload, _) in enumerate(batch):
+            resp, reason, permanent = await self._post(url, payload)
+            if resp is not None and self.BATCH_URL_HEADER in resp.headers:
+                self._batch_urls[callback] = url.join(resp.headers[self.BATCH_URL_HEADER])
+            if resp is None and not permanent:
+                for j, (rest, _, _) in enumerate(batch[i:]):
+                    await self._settle(rest, callback, False, reason, False, now=now + j / 1000)
+                return
+            await self._settle(tid, callback, resp is not None, reason, permanent)
@@ -1,47 +1,40 @@
-import signal
-import threading
+import asyncio
 
 import redis
+import redis.asyncio as aioredis
 from loguru import logger
 
+from gw.aiostreams import AsyncStreamMessage, AsyncStreams, StreamConsumer, run_consumers
 from gw.models import ComposedResult, TaskResults
 from gw.settings import get_app_settings
-from gw.streams import Streams
-from gw.tasks import InferenceState, Task, TaskPool
+from gw.tasks import Task, TaskPool
 from gw.utils import generate_a_random_hex_str
 
 
-def make_signal_handler(evt: threading.Event):
-    def handler(signum, frame):
-        evt.set()
-
-    return handler
-
-
 def compose_results(task: Task) -> bool:
-    # Check if all inference under a object are completed.
-    # And try to compose inference result.
+    # Runner counts down inferences remaining of task,
+    # compose only when all inferences are completed.
+    if task.remaining_inferences > 0:
+        return False
+
+    # Read results of all objects at once.
+    results = task.get_inference_results()
     composed_results = []
 
     # Check each object and each model.
     for obj in task.object_list:
+        obj_results = results.get(obj.object_id, {})
 
-        # Use to track inference results.
-        results = []
-
-        for model in obj.type_list:
-            if task.get_inference_state(obj, model) == InferenceState.complete:
-                res = task.get_inference_result(obj, model)
-                if res is None:
-                    return False
-                results.append(res)
-
-            # If any inference not complete, compose failed.
-            else:
-                return False
+        # If any inference not complete, compose failed.
+        # Only tasks made before counter exists may reach here.
+        if any(model not in obj_results for model in obj.type_list):
+            return False
 
         # Compose inference result about this object, push to result list.
-        compose_res = ComposedResult(objectId=obj.object_id, results=results)
+        compose_res = ComposedResult(
+            objectId=obj.object_id,
+            results=[obj_results[model] for model in obj.type_list],
+        )
         composed_results.append(compose_res)
 
     # So all inference are completed.
@@ -53,13 +46,18 @@ def compose_results(task: Task) -> bool:
     return True
 
 
-def main():
+async def main():
 
     # Connect to redis.
+    # Async client serves message streams, sync client serves task pool
+    # which is used from worker threads.
     settings = get_app_settings()
     rdb = redis.Redis(
         host=settings.redis_host, port=settings.redis_port, db=settings.redis_db
     )
+    ardb = aioredis.Redis(
+        host=settings.redis_host, port=settings.redis_port, db=settings.redis_db
+    )
     logger.info(
         f"connect redis {settings.redis_host}:{settings.redis_port}, "
         + f"use db {settings.redis_db}"
@@ -69,7 +67,9 @@ def main():
     # in stream use to pull message from runner to notify that inference complete.
     # out stream use to send postprocess complete message to next step,
     consumer = f"{generate_a_random_hex_str(length=8)}::postprocess::consumer"
-    streams_maker = Streams(connection_pool=rdb.connection_pool)
+    streams_maker = AsyncStreams(
+        rdb=ardb, claim_interval_ms=settings.stream_claim_interval_ms
+    )
     in_stream = streams_maker.task_inference_complete
     out_stream = streams_maker.task_finish
     logger.info(
@@ -81,45 +81,35 @@ def main():
     # Connect to task pool.
     taskpool = TaskPool(connection_pool=rdb.connection_pool)
 
-    # Make stop flag and register signal handler.
-    stop_flag = threading.Event()
-    signal.signal(signal.SIGTERM, make_signal_handler(stop_flag))
-    signal.signal(signal.SIGINT, make_signal_handler(stop_flag))
-
-    logger.info("register signal handler and start message loop.")
-    while not stop_flag.is_set():
-
-        # Pull a message from input stream, block wait 1000 ms.
-        # If no message we just continue.
-        # This is in order to check if stop flag was set.
-        # and if set we will stop loop.
-        messages = in_stream.pull(consumer, count=1, block=1 * 1000)
-        if len(messages) == 0:
-            continue
-
-        msg = messages[0]
-        mid = msg.id
-        tid = msg.data["task_id"].decode()
-        logger.info(f"message received, message id {mid}, task id {tid}")
-
+    def compose(tid: str) -> bool:
         # Read task data from task pool,
         # if task invalid, ignore and consume message.
         task = taskpool.get(tid)
         if task is None:
-            msg.ack()
-            continue
+            return False
+        return compose_results(task)
+
+    async def handle(msg: AsyncStreamMessage):
+        tid = msg.data["task_id"].decode()
+        logger.info(f"message received, message id {msg.id}, task id {tid}")
 
         # compose results.
         # if complete, notify next processer, or ignore.
-        if compose_results(task):
-            out_stream.publish({"task_id": task.task_id})
-            logger.info(f"task {task.task_id} result compose complete")
+        if await asyncio.to_thread(compose, tid):
+            await out_stream.publish({"task_id": tid})
+            logger.info(f"task {tid} result compose complete")
 
-        msg.ack()
+    # Handle messages concurrently, stop on signal and drain messages in flight.
+    logger.info("register signal handler and start message loop.")
+    await run_consumers(
+        StreamConsumer(
+            in_stream, consumer, handle, concurrency=settings.consumer_concurrency
+        ),
+        drain_timeout=settings.consumer_drain_timeout_s,
+    )
 
-    # Clean worker pool, terminate all working process.
-    # Any unfinished post process will be drop.
     logger.info("recieve stop signal, cleanup...")
+    await ardb.aclose()
     rdb.close()
 
 
@@ -129,5 +119,5 @@ if __name__ == "__main__":
     initlize_logger("postprocess")
 
     logger.info("start post process app...")
-    main()
+    asyncio.run(main())
     logger.info("post process app shutdown.")
@@ -3,4 +3,54 @@ import pytest
 @pytest.fixture
 def fake_redis_client():
     import fakeredis
-    return fakeredis.FakeStrictRedis()
\ No newline at end of file
+    return fakeredis.FakeStrictRedis()
+
+@pytest.fixture
+def fake_async_redis_client():
+    import fakeredis.aioredis
+    return fakeredis.aioredis.FakeRedis()
+
+@pytest.fixture
+def make_request():
+    from gw.models import CreateInferenceTaskRequest
+
+    # Request of n objects with the same types, or one object per entry of object_types.
+    def make(n=1, types=("hat",), request_id="task", object_types=None):
+        if object_types is None:
+            object_types = [types] * n
+        return CreateInferenceTaskRequest.model_validate({
+            "requestHostIp": "127.0.0.1",
+            "requestHostPort": "9000",
+            "requestId": request_id,
+            "objectList": [
+                {
+                    "objectId": f"obj{i}",
+                    "typeList": list(t),
+                    "imageUrlList": [f"{i}.jpg"],
+                    "imageNormalUrlPath": "",
+                    "pos": [],
+                }
+                for i, t in enumerate(object_types)
+            ],
+        })
+    return make
+
+@pytest.fixture
+def record_starter():
+    from gw.runner import WorkerStarter
+
+    # Record runners started, without starting any process.
+    class RecordStarter(WorkerStarter):
+        def __init__(self):
+            self.started = []
+
+        def start_runner(self, name, model_id):
+            self.started.append((name, model_id))
+
+    return RecordStarter()
+
+@pytest.fixture
+def runner_pool(fake_redis_client, record_starter):
+    from gw.runner import RunnerPool
+    yield RunnerPool(connection_pool=fake_redis_client.connection_pool,
+                     starter=record_starter)
@@ -0,0 +1,54 @@
+import json
+
+from dispatcher.task_proc_runner import run_inference
+from gw.models import InferenceObject
+from gw.resultcache import ResultCache
+
+
+class FakeProc:
+    # Like GWProc, handlers return result as JSON string.
+    def __init__(self, cacheable=True):
+        self.cacheable = cacheable
+        self.inferences = 0
+
+    def fetch_images(self, image_files):
+        return (True, [f"content of {f}".encode() for f in image_files])
+
+    def run_inference(self, image_files, extra_args=None):
+        return self.infer_images(self.fetch_images(image_files), extra_args)
+
+    def infer_images(self, fetched, extra_args=None):
+        self.inferences += 1
+        return json.dumps({
+            "type": "hat", "value": "1", "code": "2000", "resImageUrl": "",
+            "pos": [], "conf": 0.9, "desc": "ok",
+        })
+
+
+def make_object(image):
+    return InferenceObject.model_validate({
+        "objectId": "obj", "typeList": ["hat"], "imageUrlList": [image],
+        "imageNormalUrlPath": "", "pos": [],
+    })
+
+
+def test_run_inference_cached(fake_redis_client):
+    cache = ResultCache(connection_pool=fake_redis_client.connection_pool)
+    model = FakeProc()
+
+    result, cached = run_inference(model, make_object("a.jpg"), "hat", cache)
+    assert not cached and result.conf == 0.9
+
+    result, cached = run_inference(model, make_object("a.jpg"), "hat", cache)
+    assert cached and result.conf == 0.9
+    assert model.inferences == 1
+
+
+def test_run_inference_not_cacheable(fake_redis_client):
+    cache = ResultCache(connection_pool=fake_redis_client.connection_pool)
+    model = FakeProc(cacheable=False)
+
+    for _ in range(2):
+        result, cached = run_inference(model, make_object("a.jpg"), "hat", cache)
+        assert not cached and result.code == "2000"
+    assert model.inferences == 2
@@ -0,0 +1,62 @@
+import asyncio
+
+from gw.admission import AdmissionControl
+from gw.redis_keys import RedisKeys
+
+
+def test_admission_status(fake_async_redis_client):
+    async def run():
+        r = fake_async_redis_client
+        await r.xgroup_create(
+            RedisKeys.stream_task_create, RedisKeys.stream_readgroup_task_create, mkstream=True
+        )
+        for i in range(3):
+            await r.xadd(RedisKeys.stream_task_create, {"task_id": f"t{i}"})
+        await r.xreadgroup(
+            RedisKeys.stream_readgroup_task_create, "c", {RedisKeys.stream_task_create: ">"}, count=1
+        )
+
+        await r.sadd(RedisKeys.model_queues, "hat")
+        for i in range(4):
+            await r.xadd(RedisKeys.model_stream("hat"), {"task_id": f"t{i}"})
+        await r.zadd(RedisKeys.dispatch_backlog, {"hat": 1, "fire": 1})
+        await r.zadd(RedisKeys.dispatch_backlog_model("hat"), {"a": 1, "b": 2})
+        await r.zadd(RedisKeys.runner_registry, {"r1": 1, "r2": 1})
+        await r.zadd(RedisKeys.runner_model_registry("hat"), {"r1": 1, "r2": 1})
+        await r.hset(RedisKeys.model_stats, "hat:service_s", "0.5")
+
+        status = await AdmissionControl(r, max_runner=2).status()
+        assert status.create_pending == 3
+        assert status.model_depths == {"hat": 6}
+        assert status.model_runners == {"fire": 0, "hat": 2}
+        assert status.busy_ratio == 1.0
+        assert status.wait_s("hat", 1.0) == 1.5
+        assert status.to_dict(1.0)["model_wait_s"] == {"hat": 1.5}
+
+    asyncio.run(run())
+
+
+def test_admission_check(fake_async_redis_client):
+    async def run():
+        r = fake_async_redis_client
+        await r.zadd(RedisKeys.dispatch_backlog, {"hat": 1})
+        await r.zadd(RedisKeys.dispatch_backlog_model("hat"), {str(i): i for i in range(10)})
+        await r.hset(RedisKeys.model_stats, "hat:service_s", "2")
+
+        # Runners free, deep queue is taken soon.
+        admission = AdmissionControl(r, max_runner=2, max_wait_s=5, refresh_ms=0)
+        assert await admission.check(["hat"]) is None
+
+        # Runners all busy, 10 inferences take 20s on one runner.
+        await r.zadd(RedisKeys.runner_registry, {"r1": 1, "r2": 1})
+        await r.zadd(RedisKeys.runner_model_registry("hat"), {"r1": 1})
+        assert await admission.check(["hat"]) == 20
+        assert await admission.check(["other"]) is None
+
+        # Too many tasks not dispatched refused whatever models.
+        admission = AdmissionControl(r, max_runner=2, max_pending=2, refresh_ms=0)
+        for i in range(2):
+            await r.xadd(RedisKeys.stream_task_create, {"task_id": f"t{i}"})
+        assert await admission.check(["other"]) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+
+from gw.aiostreams import AsyncRedisStream, AsyncStreamMessage, StreamConsumer
+
+
+def test_async_publish_and_read(fake_async_redis_client):
+    async def run():
+        stream = AsyncRedisStream("test", "test-reader", rdb=fake_async_redis_client)
+
+        for i in range(3):
+            await stream.publish({"message": i})
+
+        messages = await stream.read_new("consumer", count=10)
+        assert [int(m.data["message"]) for m in messages] == [0, 1, 2]
+
+        assert await stream.ack_many([m.id for m in messages]) == 3
+        assert len(await stream.read_new("consumer", count=10, block=1)) == 0
+
+    asyncio.run(run())
+
+
+def test_consumer_bounded_concurrency(fake_async_redis_client):
+    async def run():
+        stream = AsyncRedisStream("abc", "def", rdb=fake_async_redis_client)
+        for i in range(20):
+            await stream.publish({"message": i})
+
+        running = 0
+        max_running = 0
+        handled = []
+
+        async def handler(msg: AsyncStreamMessage):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            handled.append(int(msg.data["message"]))
+            running -= 1
+            if len(handled) == 20:
+                consumer.stop()
+
+        consumer = StreamConsumer(stream, "consumer", handler, concurrency=4, block_ms=10)
+        await asyncio.wait_for(consumer.run(), timeout=5)
+
+        assert sorted(handled) == list(range(20))
+        assert max_running <= 4
+        assert consumer.inflight == 0
+
+        pending = await fake_async_redis_client.xpending("abc", "def")
+        assert pending["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_consumer_failed_message_stay_pending(fake_async_redis_client):
+    async def run():
+        stream = AsyncRedisStream("abc", "def", rdb=fake_async_redis_client)
+        await stream.publish({"message": "boom"})
+
+        async def handler(msg: AsyncStreamMessage):
+            consumer.stop()
+            raise RuntimeError("boom")
+
+        consumer = StreamConsumer(stream, "consumer", handler, concurrency=2, block_ms=10)
+        await asyncio.wait_for(consumer.run(), timeout=5)
+
+        pending = await fake_async_redis_client.xpending("abc", "def")
+        assert pending["pending"] == 1
+
+    asyncio.run(run())
+
+
+def test_consumer_drain_on_stop(fake_async_redis_client):
+    async def run():
+        stream = AsyncRedisStream("abc", "def", rdb=fake_async_redis_client)
+        await stream.publish({"message": "slow"})
+
+        done = asyncio.Event()
+
+        async def handler(msg: AsyncStreamMessage):
+            consumer.stop()
+            await asyncio.sleep(0.05)
+            done.set()
+
+        consumer = StreamConsumer(stream, "consumer", handler, concurrency=2, block_ms=10)
+        await asyncio.wait_for(consumer.run(drain_timeout=5), timeout=5)
+
+        assert done.is_set()
+        pending = await fake_async_redis_client.xpending("abc", "def")
+        assert pending["pending"] == 0
+
+    asyncio.run(run())
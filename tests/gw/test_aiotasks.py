@@ -0,0 +1,115 @@
+import asyncio
+
+import redis
+
+from gw.aiostreams import AsyncStreams
+from gw.aiotasks import AsyncTaskPool, TaskWatcher
+from gw.models import TaskResults
+from gw.redis_keys import RedisKeys
+from gw.tasks import InferenceState
+
+
+def test_async_task_pool_new_many(fake_async_redis_client, make_request):
+    async def run():
+        stream = AsyncStreams(fake_async_redis_client).task_create
+        pool = AsyncTaskPool(fake_async_redis_client, stream, task_ttl=60)
+
+        assert await pool.new_many([]) == []
+        assert await pool.new("t0", "http://host/cb", make_request(2)) == "t0"
+        assert await pool.new_many(
+            [(f"t{i}", "http://host/cb", make_request(1)) for i in range(1, 4)]
+        ) == ["t1", "t2", "t3"]
+
+        task = await fake_async_redis_client.hgetall(RedisKeys.task("t0"))
+        assert task[b"callback"] == b"http://host/cb"
+        assert task[b"remaining"] == b"2"
+        assert await fake_async_redis_client.hlen(RedisKeys.task_objects("t0")) == 2
+        assert 0 < await fake_async_redis_client.ttl(RedisKeys.task("t3")) <= 60
+
+        # Every task is published in order, and readable by consumers.
+        messages = await stream.read_new("c", count=10)
+        assert [m.data["task_id"] for m in messages] == [b"t0", b"t1", b"t2", b"t3"]
+
+    asyncio.run(run())
+
+
+def test_async_task_pool_query_and_follow(fake_async_redis_client, make_request):
+    async def run():
+        r = fake_async_redis_client
+        stream = AsyncStreams(r).task_create
+        pool = AsyncTaskPool(r, stream, task_ttl=60)
+        watcher = TaskWatcher(r)
+
+        assert await pool.query("nope") is None
+        await pool.new("t", "http://host/cb", make_request(2))
+
+        status = await pool.query("t")
+        assert status.state == "pending"
+        assert status.remaining == 2
+        assert [(i.object_id, i.type, i.state) for i in status.inference_list] == [
+            ("obj0", "hat", "pending"),
+            ("obj1", "hat", "pending"),
+        ]
+
+        await r.hset(RedisKeys.task_inference_state("t", "obj0"), "hat", "running")
+        assert (await pool.query("t")).state == "running"
+
+        # Stored states are reported by API names.
+        await r.hset(RedisKeys.task_inference_state("t", "obj1"), "hat", str(InferenceState.complete))
+        status = await pool.query("t")
+        assert [i.state for i in status.inference_list] == ["running", "complete"]
+
+        # Long poll wakes on notify, not timeout.
+        async def finish():
+            await asyncio.sleep(0.05)
+            res = TaskResults(requestId="t", requestList=[])
+            await r.set(RedisKeys.postprocess_result("t"), res.model_dump_json(by_alias=True))
+            watcher.notify("t")
+
+        asyncio.create_task(finish())
+        statuses = [s async for s in pool.follow("t", watcher, timeout_s=10)]
+        assert [s.state for s in statuses] == ["running", "complete"]
+        assert statuses[-1].result.request_id == "t"
+        assert watcher._waiters == {}
+
+        # Task gone ends follow at once.
+        statuses = [s async for s in pool.follow("nope", watcher, timeout_s=0)]
+        assert statuses == [None]
+
+    asyncio.run(run())
+
+
+def test_task_watcher_survives_redis_error(fake_async_redis_client, monkeypatch):
+    async def run():
+        watcher = TaskWatcher(fake_async_redis_client)
+        monkeypatch.setattr(TaskWatcher, "RECONNECT_DELAY_S", 0)
+
+        # First subscription times out, watcher wakes waiters and subscribes again.
+        pubsub = fake_async_redis_client.pubsub
+        calls = []
+
+        def broken_pubsub(**kws):
+            p = pubsub(**kws)
+            if len(calls) == 0:
+                async def timeout(*args, **kws):
+                    raise redis.TimeoutError("timeout")
+                p.get_message = timeout
+            calls.append(p)
+            return p
+
+        fake_async_redis_client.pubsub = broken_pubsub
+        ev = watcher.watch("t1")
+        task = asyncio.create_task(watcher.run())
+        await asyncio.wait_for(ev.wait(), 1)
+        ev.clear()
+
+        while len(calls) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        await fake_async_redis_client.publish(RedisKeys.channel_task_done, "t1")
+        await asyncio.wait_for(ev.wait(), 2)
+
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+
+from gw.backlog import BacklogItem, DispatchBacklog
+from gw.dispatcher import LRUDispatchStrategy, ProcDispatcher
+from gw.redis_keys import RedisKeys
+from gw.tasks import TaskPool
+
+
+@pytest.fixture
+def backlog(fake_redis_client):
+    yield DispatchBacklog(
+        retry_base_ms=1000,
+        retry_max_ms=4000,
+        connection_pool=fake_redis_client.connection_pool,
+    )
+
+
+def test_backlog_order(backlog):
+    backlog.defer(BacklogItem("t1", "o1", "hat"), now=100)
+    backlog.defer(BacklogItem("t2", "o1", "hat"), now=101)
+    backlog.defer(BacklogItem("t3", "o1", "hat", priority=1), now=102)
+    backlog.defer(BacklogItem("t4", "o1", "meter"), now=103)
+
+    # Defer again is no-op, item keeps its place.
+    backlog.defer(BacklogItem("t1", "o1", "hat"), now=104)
+    assert backlog.pending_counts() == {"hat": 3, "meter": 1}
+
+    # Higher priority first, then defer time.
+    assert backlog.head("hat").task_id == "t3"
+    backlog.done(backlog.head("hat"))
+    assert backlog.head("hat").task_id == "t1"
+
+
+def test_backlog_lease_and_backoff(backlog):
+    backlog.defer(BacklogItem("t1", "o1", "hat"), now=100)
+    backlog.defer(BacklogItem("t2", "o1", "meter"), now=100)
+
+    assert sorted(backlog.take_due(now=100)) == ["hat", "meter"]
+    # Leased models are not due for others.
+    assert backlog.take_due(now=101) == []
+
+    assert backlog.backoff("hat", now=101) == 1
+    assert backlog.backoff("hat", now=101) == 2
+    assert backlog.backoff("hat", now=101) == 4
+    assert backlog.backoff("hat", now=101) == 4
+    assert backlog.take_due(now=104) == []
+    assert backlog.take_due(now=105) == ["hat"]
+
+    # Release resets attempts, empty model leaves schedule.
+    backlog.release("hat", now=105)
+    assert backlog.backoff("hat", now=105) == 1
+    backlog.done(backlog.head("meter"))
+    backlog.release("meter", now=105)
+    assert backlog.pending_counts() == {"hat": 1}
+    assert backlog.zscore(RedisKeys.dispatch_backlog, "meter") is None
+
+
+def test_dispatcher_defer_and_retry(fake_redis_client, runner_pool, make_request, backlog):
+    runner_pool.new("hat", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.attach("r1").is_busy = True
+
+    dispatcher = ProcDispatcher(
+        fake_redis_client,
+        runner_pool,
+        max_runner=1,
+        dispatch_strategy=LRUDispatchStrategy(1),
+        backlog=backlog,
+    )
+
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    task = pool.new(task_id="task", callback="callback", raw_request=make_request(2))
+
+    # No runner free, both deferred in order.
+    dispatcher.dispatch(task)
+    assert backlog.pending_counts() == {"hat": 2}
+    assert backlog.head("hat").object_id == "obj0"
+
+    # Runner done, head is dispatched, the next one backs off.
+    runner_pool.attach("r1").is_busy = False
+    dispatcher.rebalance()
+    assert backlog.pending_counts() == {"hat": 1}
+    assert backlog.head("hat").object_id == "obj1"
+    cmds = fake_redis_client.xrange(RedisKeys.runner_stream("r1"))
+    assert cmds[-1][1][b"oid"] == b"obj0"
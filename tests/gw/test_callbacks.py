@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from gw.callbacks import CallbackRetry, DeliveryStats
+from gw.redis_keys import RedisKeys
+
+
+def test_callback_retry_backoff(fake_async_redis_client):
+    async def run():
+        retry = CallbackRetry(
+            fake_async_redis_client, retry_base_ms=1000, retry_max_ms=3000, max_attempts=3
+        )
+
+        assert await retry.retry("t1", now=100) == 1
+        assert await retry.take_due(now=100.5) == []
+        assert await retry.take_due(now=101) == ["t1"]
+
+        # Leased task not due for others.
+        assert await retry.take_due(now=102) == []
+
+        assert await retry.retry("t1", now=101) == 2
+        assert await retry.retry("t1", now=101) == 3
+        assert await retry.retry("t1", now=101) is None
+
+        await retry.dead("t1", "http://host/cb", "attempts exhausted")
+        assert await retry.pending() == 0
+        dead = await fake_async_redis_client.xrange(RedisKeys.stream_callback_dead)
+        assert dead[0][1][b"task_id"] == b"t1"
+
+        # Defer never counts attempt, done clears attempts.
+        await retry.defer("t2", 1, now=100)
+        assert await retry.take_due(now=101) == ["t2"]
+        await retry.retry("t2", now=101)
+        await retry.done("t2")
+        assert await retry.pending() == 0
+        assert await retry.retry("t2", now=101) == 1
+
+    asyncio.run(run())
+
+
+def test_delivery_stats(fake_async_redis_client):
+    async def run():
+        stats = DeliveryStats(window=100)
+        for i in range(100):
+            stats.record(i / 100, ok=i % 10 != 0)
+
+        snapshot = stats.snapshot()
+        assert snapshot["delivered"] == 90
+        assert snapshot["failed"] == 10
+        assert snapshot["p50_s"] == 0.5
+        assert snapshot["p95_s"] == 0.95
+        assert snapshot["max_s"] == 0.99
+
+        await stats.export(fake_async_redis_client, "n1")
+        data = await fake_async_redis_client.hget(RedisKeys.callback_stats, "n1")
+        assert json.loads(data)["delivered"] == 90
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import pytest
+
+from gw.codec import JsonCodec, OrjsonCodec, decode, encode
+from gw.models import ComposedResult, InferenceResult, TaskResults
+
+
+def make_results():
+    res = InferenceResult.model_validate({
+        "type": "hat",
+        "value": "1",
+        "code": "2000",
+        "resImageUrl": "",
+        "pos": [{"areas": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]}],
+        "conf": 0.87,
+        "desc": "未戴安全帽",
+    })
+    return TaskResults(
+        requestId="task", requestList=[ComposedResult(objectId="obj", results=[res])]
+    )
+
+
+@pytest.mark.parametrize("codec", [JsonCodec, OrjsonCodec])
+def test_codec_roundtrip(codec):
+    if codec is OrjsonCodec:
+        pytest.importorskip("orjson")
+    results = make_results()
+
+    data = encode(results, codec())
+    assert data[:3] == b"\x00\x01" + codec.id
+
+    # Nested models are built, not left as dict.
+    decoded = decode(TaskResults, data)
+    assert decoded == results
+    assert decoded.request_list[0].results[0].pos[0].areas[1].y == 4
+    assert decoded.model_dump_json(by_alias=True) == results.model_dump_json(by_alias=True)
+
+
+def test_codec_legacy_json():
+    results = make_results()
+    assert decode(TaskResults, results.model_dump_json(by_alias=True).encode()) == results
+
+    with pytest.raises(ValueError):
+        decode(TaskResults, b"\x00\x09j{}")
@@ -0,0 +1,156 @@
+from datetime import datetime
+
+import pytest
+
+from gw.dispatcher import CostAwareDispatchStrategy, LRUDispatchStrategy
+from gw.redis_keys import RedisKeys
+from gw.runner import RunnerPool
+from gw.stats import ModelStats
+from gw.tasks import TaskPool
+
+
+@pytest.fixture
+def task(fake_redis_client, make_request):
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    yield pool.new(task_id="task", callback="callback", raw_request=make_request(3))
+
+
+def commands(rdb, name):
+    return [m[1] for m in rdb.xrange(RedisKeys.runner_stream(name))]
+
+
+def test_lru_dispatch_spread_objects(runner_pool, task):
+    runner_pool.new("hat", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("hat", name="r2", ctime=datetime(2024, 1, 2))
+
+    strategy = LRUDispatchStrategy(max_runner=2)
+    runners = runner_pool.snapshots()
+    objs = task.object_list
+
+    assert strategy.dispatch(runner_pool, runners, task, objs[0], "hat").ok
+    assert strategy.dispatch(runner_pool, runners, task, objs[1], "hat").ok
+
+    # Each idle runner get one object, no more idle runner then.
+    assert commands(runner_pool, "r1")[0][b"oid"] == b"obj0"
+    assert commands(runner_pool, "r2")[0][b"oid"] == b"obj1"
+
+    res = strategy.dispatch(runner_pool, runners, task, objs[2], "hat")
+    assert not res.ok
+
+
+def test_lru_dispatch_evict_oldest_idle(runner_pool, task):
+    runner_pool.new("intrusion", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("intrusion", name="r2", ctime=datetime(2024, 1, 2))
+
+    strategy = LRUDispatchStrategy(max_runner=2)
+    runners = runner_pool.snapshots()
+
+    assert strategy.dispatch(runner_pool, runners, task, task.object_list[0], "hat").ok
+    assert runner_pool.get("r1") is None
+    assert runner_pool.get("r2") is not None
+    assert runner_pool.count_model("hat") == 1
+    assert len(runners) == 2
+
+
+@pytest.fixture
+def stats(fake_redis_client):
+    yield ModelStats(connection_pool=fake_redis_client.connection_pool)
+
+
+def test_cost_dispatch_evict_cold_model(runner_pool, stats, task):
+    # r1 is older, but its model is expensive to load and hot.
+    runner_pool.new("meter", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("intrusion", name="r2", ctime=datetime(2024, 1, 2))
+    stats.record_load_time("meter", 30)
+    stats.record_load_time("intrusion", 1)
+    stats.record_requests({"meter": 60, "intrusion": 6})
+
+    strategy = CostAwareDispatchStrategy(max_runner=2, stats=stats)
+    runners = runner_pool.snapshots()
+    strategy.prepare(runner_pool, runners, {"hat": 1})
+
+    assert strategy.dispatch(runner_pool, runners, task, task.object_list[0], "hat").ok
+    assert runner_pool.get("r1") is not None
+    assert runner_pool.get("r2") is None
+    assert runner_pool.count_model("hat") == 1
+
+
+def test_cost_dispatch_rate_over_horizon(runner_pool, stats, task):
+    # meter gets a request per second, intrusion only has two in this batch.
+    runner_pool.new("meter", name="r1", ctime=datetime(2024, 1, 2))
+    runner_pool.new("intrusion", name="r2", ctime=datetime(2024, 1, 1))
+    stats.record_load_time("meter", 10)
+    stats.record_load_time("intrusion", 10)
+    stats.record_requests({"meter": 60})
+
+    strategy = CostAwareDispatchStrategy(max_runner=2, stats=stats)
+    runners = runner_pool.snapshots()
+    strategy.prepare(runner_pool, runners, {"hat": 1, "intrusion": 2})
+
+    assert strategy.dispatch(runner_pool, runners, task, task.object_list[0], "hat").ok
+    assert runner_pool.get("r1") is not None
+    assert runner_pool.get("r2") is None
+
+
+def test_cost_dispatch_keep_hot_model_when_busy(runner_pool, stats, task):
+    runner_pool.new("meter", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("hat", name="r2", ctime=datetime(2024, 1, 2))
+    stats.record_load_time("meter", 30)
+    stats.record_load_time("hat", 1)
+
+    strategy = CostAwareDispatchStrategy(max_runner=2, stats=stats)
+    runners = runner_pool.snapshots()
+    strategy.prepare(runner_pool, runners, {"hat": 2, "meter": 1})
+
+    objs = task.object_list
+    assert strategy.dispatch(runner_pool, runners, task, objs[0], "hat").ok
+
+    # hat runner is busy now, wait for it instead of evicting meter.
+    res = strategy.dispatch(runner_pool, runners, task, objs[1], "hat")
+    assert not res.ok
+    assert runner_pool.get("r1") is not None
+
+
+def test_cost_dispatch_prewarm(runner_pool, stats):
+    runner_pool.new("hat", name="r1")
+
+    strategy = CostAwareDispatchStrategy(max_runner=3, stats=stats, prewarm=True)
+    runners = runner_pool.snapshots()
+    strategy.prepare(runner_pool, runners, {"hat": 1, "meter": 3, "fire": 2, "smoke": 1})
+
+    # Only free slots used, most wanted model first.
+    assert runner_pool.count() == 3
+    assert runner_pool.count_model("meter") == 1
+    assert runner_pool.count_model("fire") == 1
+    assert len(runners) == 3
+
+
+def test_lru_dispatch_multi_model(runner_pool, task):
+    runner_pool.new("intrusion", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("intrusion", name="r2", ctime=datetime(2024, 1, 2))
+
+    strategy = LRUDispatchStrategy(max_runner=2, multi_model=True)
+    runners = runner_pool.snapshots()
+
+    # Oldest idle runner loads the model instead of being stopped.
+    assert strategy.dispatch(runner_pool, runners, task, task.object_list[0], "hat").ok
+    assert runner_pool.count() == 2
+    assert commands(runner_pool, "r1")[0][b"model"] == b"hat"
+    assert runners[0].holds("hat") and runners[0].is_busy
+
+
+def test_lru_dispatch_wait_runner_ready(fake_redis_client, record_starter, task):
+    pool = RunnerPool(connection_pool=fake_redis_client.connection_pool,
+                      starter=record_starter, wait_ready=True)
+    strategy = LRUDispatchStrategy(max_runner=2)
+    runners = pool.snapshots()
+    objs = task.object_list
+
+    # Boot one runner, then wait it ready instead of booting more.
+    assert not strategy.dispatch(pool, runners, task, objs[0], "hat").ok
+    assert not strategy.dispatch(pool, runners, task, objs[1], "hat").ok
+    assert pool.count_model("hat") == 1
+
+    pool.attach(runners[0].name).mark_ready()
+    runners = pool.snapshots()
+    assert strategy.dispatch(pool, runners, task, objs[0], "hat").ok
@@ -0,0 +1,112 @@
+import io
+import os
+import time
+from ftplib import error_perm
+
+from gw.imagecache import ImageCache, ImagePrefetcher
+
+
+class FakeFTP:
+    def __init__(self, files):
+        self.files = files
+        self.retrieved = []
+
+    def voidcmd(self, cmd):
+        return "200 ok"
+
+    def size(self, path):
+        if path not in self.files:
+            raise error_perm("550 not found")
+        return len(self.files[path])
+
+    def sendcmd(self, cmd):
+        return "213 20240101000000"
+
+    def retrbinary(self, cmd, callback):
+        path = cmd.split(" ", 1)[1]
+        self.retrieved.append(path)
+        buf = io.BytesIO(self.files[path])
+        while block := buf.read(4):
+            callback(block)
+
+    def close(self):
+        pass
+
+
+def test_put_and_get(tmp_path):
+    cache = ImageCache(str(tmp_path), 1 << 20)
+    assert cache.get("/a.jpg", 5, "1") is None
+
+    assert cache.put("/a.jpg", 5, "1", b"hello")
+    assert cache.contains("/a.jpg", 5, "1")
+    data = cache.get("/a.jpg", 5, "1")
+    assert bytes(data) == b"hello"
+    data.close()
+
+    # Replaced file has another modify time or size.
+    assert cache.get("/a.jpg", 5, "2") is None
+    assert cache.get("/a.jpg", 6, "1") is None
+
+    # Size not match, file changed while fetching.
+    assert not cache.put("/b.jpg", 5, "1", b"hell")
+    assert not cache.contains("/b.jpg", 5, "1")
+
+
+def test_evict_least_recently_read(tmp_path):
+    # Written under a larger cap, so nothing evicted on put.
+    writer = ImageCache(str(tmp_path), 100)
+    for i, name in enumerate(["/a", "/b", "/c"]):
+        writer.put(name, 4, "1", b"0123")
+        t = time.time() - 100 + i
+        os.utime(writer._file(name, 4, "1"), (t, t))
+
+    cache = ImageCache(str(tmp_path), 10)
+
+    # Read makes a recently used.
+    cache.get("/a", 4, "1").close()
+    cache.evict()
+
+    assert cache.contains("/a", 4, "1")
+    assert not cache.contains("/b", 4, "1")
+    assert cache.contains("/c", 4, "1")
+
+
+def test_prefetch(tmp_path):
+    cache = ImageCache(str(tmp_path), 1 << 20)
+    ftp = FakeFTP({"/a.jpg": b"image a", "/b.jpg": b"image b"})
+    prefetcher = ImagePrefetcher(cache, lambda: ftp, workers=1)
+
+    assert prefetcher.prefetch(["/a.jpg", "/missing.jpg"]) == 2
+    prefetcher._executor.shutdown(wait=True)
+
+    data = cache.get("/a.jpg", 7, "20240101000000")
+    assert bytes(data) == b"image a"
+    data.close()
+    assert ftp.retrieved == ["/a.jpg"]
+
+    # Cached image is not fetched again.
+    prefetcher = ImagePrefetcher(cache, lambda: ftp, workers=1)
+    assert prefetcher.prefetch(["/a.jpg", "/b.jpg"]) == 2
+    prefetcher._executor.shutdown(wait=True)
+    assert ftp.retrieved == ["/a.jpg", "/b.jpg"]
+
+
+def test_prefetch_cache_write_failed(tmp_path):
+    class FullCache(ImageCache):
+        def put(self, path, size, mtime, data):
+            raise OSError(28, "No space left on device")
+
+    ftp = FakeFTP({"/a.jpg": b"image a", "/b.jpg": b"image b"})
+    connects = []
+
+    def connect():
+        connects.append(1)
+        return ftp
+
+    prefetcher = ImagePrefetcher(FullCache(str(tmp_path), 1 << 20), connect, workers=1)
+    prefetcher.prefetch(["/a.jpg", "/b.jpg"])
+    prefetcher._executor.shutdown(wait=True)
+
+    # Connection kept, both images fetched.
+    assert ftp.retrieved == ["/a.jpg", "/b.jpg"]
+    assert len(connects) == 1
@@ -0,0 +1,52 @@
+from gw.modelcache import ModelCache
+
+
+class FakeMemory:
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.rss = 0
+        self.released = []
+
+    def load(self, model_id):
+        self.rss += self.sizes[model_id]
+        return model_id
+
+    def release(self, model_id, model):
+        self.rss -= self.sizes[model_id]
+        self.released.append(model_id)
+
+
+def test_model_cache_budget():
+    mem = FakeMemory({"hat": 40, "meter": 50, "fire": 30})
+    cache = ModelCache(mem.load, budget_bytes=100, release=mem.release, rss=lambda: mem.rss)
+
+    cache.get("hat")
+    cache.get("meter")
+    assert cache.models() == ["meter", "hat"]
+    assert cache.used_bytes == 90
+
+    # Use hat, then meter is the least recently used one.
+    cache.get("hat")
+    cache.get("fire")
+    assert mem.released == ["meter"]
+    assert cache.models() == ["fire", "hat"]
+
+    # Known size makes room before load.
+    cache.get("meter")
+    assert mem.released == ["meter", "hat"]
+    assert "hat" not in cache
+    assert mem.rss <= 100
+
+
+def test_model_cache_max_models():
+    mem = FakeMemory({"hat": 1, "meter": 1})
+    cache = ModelCache(
+        mem.load, budget_bytes=100, max_models=1, release=mem.release, rss=lambda: mem.rss
+    )
+    cache.get("hat")
+    cache.get("meter")
+    assert cache.models() == ["meter"]
+
+    cache.clear()
+    assert len(cache) == 0
+    assert mem.released == ["hat", "meter"]
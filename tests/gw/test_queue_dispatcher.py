@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+from gw.dispatcher import QueueDispatcher
+from gw.redis_keys import RedisKeys
+from gw.streams import Streams
+from gw.tasks import TaskPool
+
+
+@pytest.fixture
+def make_task(fake_redis_client, make_request):
+    def make(tid, types):
+        pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+        req = make_request(request_id=tid, object_types=types)
+        return pool.new(task_id=tid, callback="callback", raw_request=req)
+    return make
+
+
+def test_queue_dispatch(fake_redis_client, runner_pool, make_task):
+    dispatcher = QueueDispatcher(fake_redis_client, runner_pool, max_runner=3)
+    # Repeated model of an object is queued once.
+    dispatcher.dispatch(make_task("t1", [["hat", "meter", "hat"], ["hat"]]))
+    assert dispatcher.queue_depths() == {"hat": 2, "meter": 1}
+
+    # One runner per model first, then the longer queue gets spare slot.
+    dispatcher.rebalance()
+    assert runner_pool.count_model("hat") == 2
+    assert runner_pool.count_model("meter") == 1
+
+    # Any runner of the model pulls, message is deleted when done.
+    queue = Streams(rdb=fake_redis_client).model_queue("hat")
+    messages = queue.pull("r1", count=1)
+    assert messages[0].data["oid"] == b"obj0"
+    messages[0].ack()
+    assert queue.pull("r2", count=1)[0].data["oid"] == b"obj1"
+    assert dispatcher.queue_depths()["hat"] == 1
+
+
+def test_queue_dispatch_empty_task(fake_redis_client, runner_pool, make_task):
+    dispatcher = QueueDispatcher(fake_redis_client, runner_pool, max_runner=3)
+
+    # No object, nothing queued and no error, so the message is acked.
+    dispatcher.dispatch(make_task("t1", []))
+    assert dispatcher.queue_depths() == {}
+
+
+def test_queue_rebalance_evict_idle(fake_redis_client, runner_pool, make_task):
+    runner_pool.new("intrusion", name="r1", ctime=datetime(2024, 1, 1))
+    runner_pool.new("fire", name="r2", ctime=datetime(2024, 1, 2))
+
+    dispatcher = QueueDispatcher(fake_redis_client, runner_pool, max_runner=2)
+    dispatcher.dispatch(make_task("t1", [["hat"]]))
+    dispatcher.dispatch(make_task("t2", [["fire"]]))
+    dispatcher.rebalance()
+
+    # fire has queued work, so intrusion runner is the one stopped.
+    assert runner_pool.get("r1") is None
+    assert runner_pool.get("r2") is not None
+    assert runner_pool.count_model("hat") == 1
+
+    # No idle runner to stop, queued work waits.
+    runner_pool.attach("r2").is_busy = True
+    dispatcher.dispatch(make_task("t3", [["meter"]]))
+    dispatcher.rebalance()
+    assert runner_pool.count_model("meter") == 0
+    assert fake_redis_client.xlen(RedisKeys.model_stream("meter")) == 1
@@ -0,0 +1,56 @@
+from gw.models import InferenceResult
+from gw.redis_keys import RedisKeys
+from gw.resultcache import ResultCache
+
+
+def make_result(value):
+    return InferenceResult(
+        type="meter", value=value, code="2000", resImageUrl="", pos=[], conf=0.9, desc="ok"
+    )
+
+
+def test_result_cache_hit_by_content_and_path(fake_redis_client):
+    cache = ResultCache(connection_pool=fake_redis_client.connection_pool)
+    params = {"pos": [], "imageNormalUrlPath": ""}
+
+    content = ResultCache.content_key("meter", [b"image"], params)
+    assert content == ResultCache.content_key("meter", [b"image"], dict(reversed(params.items())))
+    assert content != ResultCache.content_key("meter", [b"image"], {"pos": [1]})
+    assert content != ResultCache.content_key("hat", [b"image"], params)
+
+    path_a = ResultCache.path_key("meter", ["a.jpg"], params)
+    path_b = ResultCache.path_key("meter", ["b.jpg"], params)
+    assert cache.get_by_path(path_a) is None
+    assert cache.get(content, path_a) is None
+    cache.put(content, make_result("20A"), path_a)
+
+    assert cache.get_by_path(path_a).value == "20A"
+
+    # Same bytes under other path hits by content, then links the path.
+    assert cache.get_by_path(path_b) is None
+    assert cache.get(content, path_b).value == "20A"
+    assert cache.get_by_path(path_b).value == "20A"
+
+    assert cache.stats() == {
+        "path_hits": 2,
+        "path_misses": 2,
+        "content_hits": 1,
+        "content_misses": 1,
+    }
+
+
+def test_result_cache_evict_lru(fake_redis_client):
+    cache = ResultCache(max_entries=2, connection_pool=fake_redis_client.connection_pool)
+    keys = [ResultCache.content_key("meter", [str(i)], {}) for i in range(3)]
+
+    cache.put(keys[0], make_result("0"))
+    cache.put(keys[1], make_result("1"))
+    assert cache.get(keys[0]) is not None
+
+    # Least recently used one evicted.
+    cache.put(keys[2], make_result("2"))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]).value == "0"
+    assert cache.get(keys[2]).value == "2"
+    assert fake_redis_client.zcard(RedisKeys.result_cache_index) == 2
+    assert 0 < fake_redis_client.ttl(RedisKeys.result_cache(keys[0])) <= 3600
@@ -178,3 +178,181 @@ def test_update_and_clean_heartbeat(fake_runner_pool):
 
     r.clean_heartbeat()
     assert r.heartbeat == None
+
+
+def test_runner_registry_index(fake_runner_pool):
+    fake_runner_pool.new("abc", name="r1", ctime=datetime(2024, 1, 1))
+    fake_runner_pool.new("abc", name="r2", ctime=datetime(2024, 1, 2))
+    fake_runner_pool.new("def", name="r3", ctime=datetime(2024, 1, 3))
+
+    assert fake_runner_pool.count() == 3
+    assert fake_runner_pool.count_model("abc") == 2
+    assert fake_runner_pool.idle_runner("abc").name == "r1"
+    assert fake_runner_pool.idle_runner("xyz") is None
+    assert fake_runner_pool.oldest_idle_runner().name == "r1"
+
+    # Busy runner leave idle index, and come back when idle.
+    r1 = fake_runner_pool.get("r1")
+    r1.is_busy = True
+    assert fake_runner_pool.idle_runner("abc").name == "r2"
+    assert fake_runner_pool.oldest_idle_runner().name == "r2"
+
+    r1.utime = datetime(2024, 1, 4)
+    r1.is_busy = False
+    assert fake_runner_pool.idle_runner("abc").name == "r2"
+    assert fake_runner_pool.oldest_idle_runner().name == "r2"
+
+    fake_runner_pool.delete("r2")
+    assert fake_runner_pool.count_model("abc") == 1
+    assert fake_runner_pool.idle_runner("abc").name == "r1"
+    assert fake_runner_pool.oldest_idle_runner().name == "r3"
+
+    # Late update of a deleted runner never bring it back.
+    r2 = Runner(rdb=fake_runner_pool, name="r2", model_id="abc")
+    r2.is_busy = False
+    assert fake_runner_pool.count() == 2
+    assert fake_runner_pool.idle_runner("abc").name == "r1"
+
+
+def test_rebuild_runner_registry(fake_runner_pool):
+    fake_runner_pool.new("abc", name="r1")
+    fake_runner_pool.new("abc", name="r2")
+    fake_runner_pool.get("r2").is_busy = True
+
+    for k in [RedisKeys.runner_registry, RedisKeys.runner_idle,
+              RedisKeys.runner_model_idle("abc")]:
+        fake_runner_pool.zremrangebyrank(k, 0, -1)
+    assert fake_runner_pool.count() == 0
+
+    fake_runner_pool.rebuild_registry()
+    assert fake_runner_pool.count() == 2
+    assert fake_runner_pool.idle_runner("abc").name == "r1"
+    assert fake_runner_pool.oldest_idle_runner().name == "r1"
+
+
+def test_runner_snapshots(fake_runner_pool):
+    ctime = datetime(2024, 1, 1)
+    fake_runner_pool.new("abc", name="r1", ctime=ctime)
+    fake_runner_pool.new("def", name="r2", ctime=datetime(2024, 1, 2))
+    fake_runner_pool.get("r2").is_busy = True
+    fake_runner_pool.get("r2").task = "t1"
+
+    snapshots = {s.name: s for s in fake_runner_pool.snapshots()}
+    assert sorted(snapshots.keys()) == ["r1", "r2"]
+
+    s1 = snapshots["r1"]
+    assert s1.model_id == "abc"
+    assert s1.ctime == ctime
+    assert s1.utime == ctime
+    assert s1.is_busy == False
+    assert s1.is_alive == True
+    assert s1.task is None
+    assert s1.heartbeat is not None
+
+    s2 = snapshots["r2"]
+    assert s2.is_busy == True
+    assert s2.task == "t1"
+
+    assert fake_runner_pool.get("r2").snapshot() == s2
+
+
+def test_claim_idle_runner(fake_runner_pool):
+    fake_runner_pool.new("abc", name="r1", ctime=datetime(2024, 1, 1))
+    fake_runner_pool.new("abc", name="r2", ctime=datetime(2024, 1, 2))
+
+    assert fake_runner_pool.claim("abc", "t1", "o1") == "r1"
+    assert fake_runner_pool.claim("abc", "t2", "o2") == "r2"
+    assert fake_runner_pool.claim("abc", "t3", "o3") is None
+    assert fake_runner_pool.claim("def", "t3", "o3") is None
+
+    r1 = fake_runner_pool.get("r1")
+    assert r1.is_busy == True
+    assert fake_runner_pool.oldest_idle_runner() is None
+
+    resp = fake_runner_pool.xrange(RedisKeys.runner_stream("r1"))
+    assert len(resp) == 1
+    assert resp[0][1] == {
+        b"cmd": Command.task.encode(),
+        b"tid": b"t1",
+        b"oid": b"o1",
+        b"model": b"abc",
+    }
+
+    # Runner give back itself after task done.
+    r1.is_busy = False
+    assert fake_runner_pool.claim("abc", "t3", "o3") == "r1"
+
+
+def test_claim_oldest_idle_runner(fake_runner_pool):
+    fake_runner_pool.new("abc", name="r1", ctime=datetime(2024, 1, 2))
+    fake_runner_pool.new("def", name="r2", ctime=datetime(2024, 1, 1))
+
+    assert fake_runner_pool.claim_oldest_idle() == "r2"
+    assert fake_runner_pool.get("r2").is_busy == True
+    assert fake_runner_pool.claim("def", "t1", "o1") is None
+
+    assert fake_runner_pool.claim_oldest_idle() == "r1"
+    assert fake_runner_pool.claim_oldest_idle() is None
+
+
+def test_multi_model_runner(fake_runner_pool: RunnerPool):
+    fake_runner_pool.new("hat", name="r1", ctime=datetime(2024, 1, 1))
+    r1 = fake_runner_pool.get("r1")
+
+    # Runner loads more models, it's indexed under every one.
+    r1.models = ["meter", "hat"]
+    assert r1.models == ["meter", "hat"]
+    assert fake_runner_pool.count_model("meter") == 1
+    assert fake_runner_pool.idle_runner("meter").name == "r1"
+
+    # Claim for one model takes it off every model.
+    assert fake_runner_pool.claim("meter", "t1", "o1") == "r1"
+    assert fake_runner_pool.idle_runner("hat") is None
+
+    # Idle again, and drops hat, which it booted with.
+    r1.is_busy = False
+    r1.models = ["fire", "meter"]
+    assert not r1.snapshot().holds("hat")
+    assert r1.snapshot().holds("fire")
+    assert fake_runner_pool.idle_runner("hat") is None
+    assert fake_runner_pool.count_model("hat") == 0
+    assert fake_runner_pool.idle_runner("fire").name == "r1"
+
+    # Any idle runner can be claimed for a model it not holds.
+    assert fake_runner_pool.claim_any("wandering", "t2", "o1") == "r1"
+    resp = fake_runner_pool.xrange(RedisKeys.runner_stream("r1"))
+    assert resp[-1][1][b"model"] == b"wandering"
+
+    fake_runner_pool.delete("r1")
+    assert fake_runner_pool.count_model("fire") == 0
+    assert fake_runner_pool.count_model("meter") == 0
+
+
+def test_runner_wait_ready(fake_redis_client):
+    class Starter(WorkerStarter):
+        def start_runner(self, name, model_id):
+            pass
+
+    pool = RunnerPool(
+        connection_pool=fake_redis_client.connection_pool, starter=Starter(), wait_ready=True
+    )
+    r1 = pool.new("hat", name="r1")
+
+    # Not ready runner is registered, but never claimed.
+    assert pool.count_model("hat") == 1
+    assert not r1.is_ready
+    assert pool.claim("hat", "t1", "o1") is None
+    r1.is_busy = False
+    assert pool.idle_runner("hat") is None
+    assert not pool.snapshots()[0].is_ready
+
+    # Starting runner has no heartbeat, but it's not dead in start timeout.
+    pool.clean_dead_runners(start_timeout_s=60)
+    assert pool.get("r1") is not None
+
+    r1.mark_ready()
+    assert r1.is_ready
+    assert pool.claim("hat", "t1", "o1") == "r1"
+
+    pool.clean_dead_runners(start_timeout_s=60)
+    assert pool.get("r1") is None
@@ -0,0 +1,36 @@
+import pytest
+
+from gw.stats import ModelStats
+
+
+@pytest.fixture
+def stats(fake_redis_client):
+    yield ModelStats(connection_pool=fake_redis_client.connection_pool)
+
+
+def test_record_load_time(stats):
+    assert stats.load_times(["hat"]) == {"hat": None}
+
+    stats.record_load_time("hat", 10)
+    assert stats.load_times(["hat"])["hat"] == pytest.approx(10)
+
+    # Moving average, new sample weight ALPHA.
+    stats.record_load_time("hat", 20)
+    assert stats.load_times(["hat"])["hat"] == pytest.approx(13)
+    assert stats.service_times(["hat"]) == {"hat": None}
+
+
+def test_request_rates(stats):
+    now = 1000.0
+    stats.record_requests({"hat": 30, "meter": 6}, now=now)
+    stats.record_requests({"hat": 30}, now=now + stats.BUCKET_S)
+
+    rates = stats.request_rates(["hat", "meter", "fire"], now=now + stats.BUCKET_S)
+    window = stats.BUCKET_S * stats.BUCKET_NUM
+    assert rates["hat"] == pytest.approx(60 / window)
+    assert rates["meter"] == pytest.approx(6 / window)
+    assert rates["fire"] == 0
+
+    # Old buckets drop out of window.
+    later = now + stats.BUCKET_S * (stats.BUCKET_NUM + 1)
+    assert stats.request_rates(["hat"], now=later)["hat"] == 0
@@ -1,5 +1,7 @@
 from threading import Event
 
+import pytest
+
 from gw.streams import RedisStream, StreamMessage
 
 
@@ -70,3 +72,67 @@ def test_subscribe(fake_redis_client):
     assert answer == "test"
 
     stopper.set()
+
+
+def test_pull_batch_message(fake_redis_client):
+    stream = RedisStream("batch", "batch-reader", rdb=fake_redis_client)
+
+    for i in range(5):
+        stream.publish({"message": i})
+
+    messages = stream.pull_batch("consumer", count=10)
+    assert [int(m.data["message"]) for m in messages] == [0, 1, 2, 3, 4]
+    assert stream.ack_many([m.id for m in messages]) == 5
+
+    assert len(stream.pull_batch("consumer", count=10, block=1)) == 0
+    assert stream.ack_many([]) == 0
+
+    stream.publish({"message": "a"})
+    stream.publish({"message": "b"})
+    messages = stream.pull_batch("consumer", count=1)
+    assert len(messages) == 1
+    assert messages[0].data["message"] == "a".encode()
+
+
+def reads_pending(rdb):
+    # Some fakeredis versions serve new messages for id 0 instead of pending ones.
+    rdb.xgroup_create("probe", "probe-reader", mkstream=True)
+    rdb.xadd("probe", {"message": 0})
+    rdb.xreadgroup("probe-reader", "consumer", {"probe": ">"})
+    rdb.xadd("probe", {"message": 1})
+    resp = rdb.xreadgroup("probe-reader", "consumer", {"probe": "0"})
+    return [m[1][b"message"] for m in resp[0][1]] == [b"0"]
+
+
+def test_pull_batch_new_only_when_room(fake_redis_client):
+    if not reads_pending(fake_redis_client):
+        pytest.skip("redis does not read pending messages by id 0")
+    stream = RedisStream("room", "room-reader", rdb=fake_redis_client)
+
+    for i in range(3):
+        stream.publish({"message": i})
+    first = stream.pull_batch("consumer", count=2)
+    assert [int(m.data["message"]) for m in first] == [0, 1]
+
+    # Batch filled by pending messages, new message left for other consumers.
+    again = stream.pull_batch("consumer", count=2)
+    assert [m.id for m in again] == [m.id for m in first]
+    assert fake_redis_client.xpending("room", "room-reader")["pending"] == 2
+
+    # Pending first, then new messages up to count.
+    stream.ack_many([first[0].id])
+    messages = stream.pull_batch("consumer", count=2)
+    assert [int(m.data["message"]) for m in messages] == [1, 2]
+
+
+def test_pull_batch_claim_interval(fake_redis_client):
+    stream = RedisStream("claim", "claim-reader", rdb=fake_redis_client,
+                         claim_interval_ms=60 * 1000)
+
+    assert stream._claim_due()
+    assert not stream._claim_due()
+
+    stream.publish({"message": "ok"})
+    messages = stream.pull_batch("consumer", count=1)
+    assert len(messages) == 1
+    assert messages[0].data["message"] == "ok".encode()
@@ -1,4 +1,6 @@
-from gw.tasks import TaskPool
+from gw.models import InferenceResult
+from gw.redis_keys import RedisKeys
+from gw.tasks import InferenceState, TaskPool
 
 
 def test_new_task(fake_redis_client):
@@ -46,4 +48,88 @@ def test_task_inference_result(fake_redis_client):
     assert task.inference_result is None
     
     task.inference_result = "result"
-    assert task.inference_result  == "result"
\ No newline at end of file
+    assert task.inference_result  == "result"
+
+
+def test_task_get_object(fake_redis_client, make_request):
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    pool.new(task_id="task", callback="callback", raw_request=make_request(3))
+
+    # Single object is read alone, request not parsed.
+    task = pool.get("task")
+    assert task.get_object("obj1").image_url_list == ["1.jpg"]
+    assert task.get_object("nope") is None
+    assert task._request is None
+
+    # Request parsed once, objects come from it then.
+    assert [o.object_id for o in task.object_list] == ["obj0", "obj1", "obj2"]
+    assert task.raw_request is task.raw_request
+    assert task.get_object("obj2") is task.object_list[2]
+    assert task.callback == "callback"
+
+    pool.delete("task")
+    assert fake_redis_client.exists(RedisKeys.task_objects("task")) == 0
+
+
+def test_task_get_object_without_object_hash(fake_redis_client, make_request):
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    pool.new(task_id="task", callback="callback", raw_request=make_request(2))
+    fake_redis_client.delete(RedisKeys.task_objects("task"))
+
+    assert pool.get("task").get_object("obj1").object_id == "obj1"
+
+
+def test_task_record_inference(fake_redis_client, make_request):
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    task = pool.new(task_id="task", callback="callback", raw_request=make_request(2))
+    assert task.remaining_inferences == 2
+
+    res = InferenceResult(type="hat", value="", code="2000", resImageUrl="", pos=[],
+                          conf=0.9, desc="ok")
+    obj0, obj1 = task.object_list
+
+    # State only, no count down, expires with task.
+    assert task.record_inference(obj0, "hat", InferenceState.running) == 2
+    assert task.get_inference_state(obj0, "hat") == InferenceState.running
+    assert task.get_inference_result(obj0, "hat") is None
+    state_key = RedisKeys.task_inference_state("task", "obj0")
+    assert fake_redis_client.expiretime(state_key) == task.deadline
+    assert fake_redis_client.expiretime(RedisKeys.task("task")) == task.deadline
+
+    assert task.record_inference(obj0, "hat", InferenceState.complete, res) == 1
+
+    # Redelivered completion counts only once, and is not reported as remaining.
+    assert task.record_inference(obj0, "hat", InferenceState.complete, res) is None
+    assert task.remaining_inferences == 1
+    assert task.get_inference_state(obj0, "hat") == InferenceState.complete
+
+    assert task.record_inference(obj1, "hat", InferenceState.complete, res) == 0
+    results = task.get_inference_results()
+    assert results["obj1"]["hat"].conf == res.conf
+    assert task.remaining_inferences == 0
+
+    pool.delete("task")
+    assert task.record_inference(obj1, "hat", InferenceState.complete, res) is None
+
+
+def test_task_record_inference_repeated_model(fake_redis_client, make_request):
+    pool = TaskPool(connection_pool=fake_redis_client.connection_pool)
+    task = pool.new(task_id="task", callback="callback",
+                    raw_request=make_request(1, types=("hat", "hat", "intrusion")))
+    assert task.remaining_inferences == 2
+
+    res = InferenceResult(type="hat", value="", code="2000", resImageUrl="", pos=[],
+                          conf=0.9, desc="ok")
+    (obj,) = task.object_list
+
+    # Repeated model has one state field, completes once.
+    assert task.record_inference(obj, "hat", InferenceState.running) == 2
+    assert task.record_inference(obj, "hat", InferenceState.complete, res) == 1
+
+    # Second run can not turn complete back to running, nor count down again.
+    assert task.record_inference(obj, "hat", InferenceState.running) is None
+    assert task.get_inference_state(obj, "hat") == InferenceState.complete
+    assert task.record_inference(obj, "hat", InferenceState.complete, res) is None
+    assert task.remaining_inferences == 1
+
+    assert task.record_inference(obj, "intrusion", InferenceState.complete, res) == 0
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# gwproc modules import each other as top level packages, like gwproc.py does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "gwproc"))
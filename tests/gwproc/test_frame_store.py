@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from utils.frame_store import FrameStore
+
+
+def test_put_and_get(tmp_path):
+    store = FrameStore(str(tmp_path), max_bytes=1 << 20)
+    assert store.get("frame") is None
+
+    frame = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+    shared = store.put("frame", frame)
+    assert np.array_equal(shared, frame)
+    assert not shared.flags.writeable
+
+    # Another runner attaches the same segment.
+    other = FrameStore(str(tmp_path), max_bytes=1 << 20)
+    got = other.get("frame")
+    assert got.dtype == np.uint8 and got.shape == (2, 4, 3)
+    assert np.array_equal(got, frame)
+
+    # Segment exists, array itself returned.
+    again = np.zeros((2, 2), dtype=np.float32)
+    assert other.put("frame", again) is again
+
+    # Too large for cap, not shared.
+    big = np.zeros(1 << 20, dtype=np.uint8)
+    assert store.put("big", big) is big
+    assert not os.path.exists(tmp_path / "big")
+
+
+def test_load(tmp_path):
+    store = FrameStore(str(tmp_path), max_bytes=1 << 20)
+    calls = []
+
+    def make():
+        calls.append(1)
+        return np.ones((3, 3), dtype=np.float32)
+
+    assert np.array_equal(store.load("t", make), np.ones((3, 3)))
+    assert np.array_equal(store.load("t", make), np.ones((3, 3)))
+    assert len(calls) == 1
+
+
+def test_release_and_sweep(tmp_path):
+    store = FrameStore(str(tmp_path), max_bytes=1 << 20, linger_s=10)
+    reader = FrameStore(str(tmp_path), max_bytes=1 << 20, linger_s=10)
+    store.put("a", np.zeros(8, dtype=np.uint8))
+    reader.get("a")
+    now = time.time()
+
+    # Still referenced by reader, kept.
+    store.release()
+    store.sweep(now + 20)
+    assert os.path.exists(tmp_path / "a")
+
+    # Released by all, kept within linger, removed after.
+    reader.release()
+    store.sweep(now + 5)
+    assert os.path.exists(tmp_path / "a")
+    store.sweep(now + 20)
+    assert not os.path.exists(tmp_path / "a")
+
+
+def test_sweep_over_cap_and_stale(tmp_path):
+    store = FrameStore(str(tmp_path), max_bytes=400, linger_s=10, max_age_s=100)
+    for name in ["a", "b", "c"]:
+        store.put(name, np.zeros(64, dtype=np.uint8))
+        store.release()
+        time.sleep(0.01)
+
+    # Each segment takes 192 bytes, oldest released removed first.
+    store.sweep()
+    assert not os.path.exists(tmp_path / "a")
+    assert os.path.exists(tmp_path / "b")
+    assert os.path.exists(tmp_path / "c")
+
+    # Leaked reference never pins segment past max age.
+    store.get("b")
+    store.sweep(time.time() + 200)
+    assert not os.path.exists(tmp_path / "b")
+
+    # Segment left half written by a dead runner is removed after linger.
+    (tmp_path / "d").write_bytes(b"\0" * 16)
+    store.sweep(time.time() + 20)
+    assert not os.path.exists(tmp_path / "d")
+
+
+def test_default_cap_from_shm(tmp_path):
+    store = FrameStore(str(tmp_path))
+    st = os.statvfs(tmp_path)
+    assert store._max_bytes == int(st.f_frsize * st.f_blocks * FrameStore.DEFAULT_SHM_SHARE)
@@ -0,0 +1,190 @@
+import io
+import threading
+import time
+from ftplib import error_perm
+
+import pytest
+
+from utils import ftp_pool
+from utils.ftp_pool import FTPPool
+
+
+class FakeFTP:
+    files = {}
+    instances = []
+
+    def __init__(self, timeout=None):
+        self.closed = False
+        self.retrieved = []
+        self.broken = False
+        self.delay = 0
+        self.on_noop = None
+        FakeFTP.instances.append(self)
+
+    def connect(self, host, port):
+        pass
+
+    def login(self, user, passwd):
+        # Socket only used to set keepalive.
+        self.sock = type("Sock", (), {"setsockopt": lambda *args: None})()
+
+    def voidcmd(self, cmd):
+        if self.broken:
+            raise EOFError("connection closed")
+        if cmd == "NOOP" and self.on_noop is not None:
+            self.on_noop()
+        return "200 ok"
+
+    def size(self, path):
+        if path not in self.files:
+            raise error_perm("550 not found")
+        return len(self.files[path])
+
+    def sendcmd(self, cmd):
+        return "213 20240101000000"
+
+    def retrbinary(self, cmd, callback):
+        if self.broken:
+            raise EOFError("connection closed")
+        path = cmd.split(" ", 1)[1]
+        if path not in self.files:
+            raise error_perm("550 not found")
+        self.retrieved.append(path)
+        time.sleep(self.delay)
+        buf = io.BytesIO(self.files[path])
+        while block := buf.read(4):
+            callback(block)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_ftp(monkeypatch):
+    FakeFTP.files = {"/a.jpg": b"image a", "/b.jpg": b"image b"}
+    FakeFTP.instances = []
+    monkeypatch.setattr(ftp_pool, "FTP", FakeFTP)
+    return FakeFTP
+
+
+def test_cache_write_failed(fake_ftp):
+    class FullCache:
+        def get(self, path, size, mtime):
+            return None
+
+        def put(self, path, size, mtime, data):
+            raise OSError(28, "No space left on device")
+
+    pool = FTPPool("host", 21, "user", "password", size=1, keepalive=3600, cache=FullCache())
+
+    # Image still returned, connection kept.
+    assert pool.fetch_many(["/a.jpg", "/b.jpg"]) == [(True, b"image a"), (True, b"image b")]
+    assert len(fake_ftp.instances) == 1
+    assert not fake_ftp.instances[0].closed
+    pool.close()
+
+
+def test_reuse_connection(fake_ftp):
+    pool = FTPPool("host", 21, "user", "password", size=2, keepalive=3600)
+
+    assert pool.fetch("/a.jpg") == b"image a"
+    assert pool.fetch("/b.jpg") == b"image b"
+    assert len(fake_ftp.instances) == 1
+    assert fake_ftp.instances[0].retrieved == ["/a.jpg", "/b.jpg"]
+
+    # Missing file does not break connection.
+    assert pool.fetch_many(["/missing.jpg"]) == [(False, "File not found on FTP server: /missing.jpg")]
+    assert len(fake_ftp.instances) == 1
+    pool.close()
+
+
+def test_reconnect_once(fake_ftp):
+    pool = FTPPool("host", 21, "user", "password", size=1, keepalive=3600)
+    pool.fetch("/a.jpg")
+
+    # Broken idle connection dropped, retried on a fresh one.
+    fake_ftp.instances[0].broken = True
+    assert pool.fetch("/b.jpg") == b"image b"
+    assert len(fake_ftp.instances) == 2
+    assert fake_ftp.instances[0].closed
+
+    # Broken again on retry, error raised, no third attempt.
+    fake_ftp.instances[1].broken = True
+    original = fake_ftp.__init__
+
+    def broken_init(self, timeout=None):
+        original(self, timeout)
+        self.broken = True
+
+    fake_ftp.__init__ = broken_init
+    try:
+        with pytest.raises(EOFError):
+            pool.fetch("/a.jpg")
+    finally:
+        fake_ftp.__init__ = original
+    assert len(fake_ftp.instances) == 3
+    pool.close()
+
+
+def test_byte_budget(fake_ftp):
+    pool = FTPPool("host", 21, "user", "password", size=2, keepalive=3600, max_bytes=10)
+
+    # Budget shared by images of one request.
+    results = pool.fetch_many(["/a.jpg", "/b.jpg"])
+    assert sorted(ok for ok, _ in results) == [False, True]
+    assert "over budget" in next(msg for ok, msg in results if not ok)
+
+    # Connection interrupted by budget is not reused, next request has a new budget.
+    assert pool.fetch_many(["/a.jpg"]) == [(True, b"image a")]
+    assert sum(ftp.closed for ftp in fake_ftp.instances) == 1
+    pool.close()
+
+
+def test_timeout(fake_ftp):
+    pool = FTPPool("host", 21, "user", "password", size=1, timeout=0.1, keepalive=3600)
+    pool.fetch("/a.jpg")
+    fake_ftp.instances[0].delay = 0.3
+
+    # Slow image reported, second one can not get connection in time.
+    results = pool.fetch_many(["/a.jpg", "/b.jpg"], timeout=0.05)
+    assert results == [(False, "Download timeout: /a.jpg"), (False, "Download timeout: /b.jpg")]
+    with pytest.raises(TimeoutError):
+        pool.fetch("/b.jpg")
+    pool.close()
+
+
+def test_keepalive_holds_connection(fake_ftp):
+    pool = FTPPool("host", 21, "user", "password", size=1, timeout=2, keepalive=0.05)
+    pool.fetch("/a.jpg")
+
+    entered, done = threading.Event(), threading.Event()
+
+    def noop():
+        entered.set()
+        done.wait(2)
+
+    fake_ftp.instances[0].on_noop = noop
+    assert entered.wait(2)
+
+    # Request waits for connection under NOOP, instead of opening another one.
+    threading.Timer(0.1, done.set).start()
+    assert pool.fetch("/b.jpg") == b"image b"
+    assert len(fake_ftp.instances) == 1
+    pool.close()
+
+
+def test_cache_hit_shared_with_prefetch(fake_ftp, tmp_path):
+    from gw.imagecache import ImageCache, ftp_stat
+
+    # Image put by dispatcher prefetch, under the key of ftp_stat.
+    cache = ImageCache(str(tmp_path), 1 << 20)
+    size, mtime = ftp_stat(fake_ftp(), "/a.jpg")
+    cache.put("/a.jpg", size, mtime, b"image a")
+
+    pool = FTPPool("host", 21, "user", "password", size=1, keepalive=3600, cache=cache)
+    assert bytes(pool.fetch("/a.jpg")) == b"image a"
+    assert all(ftp.retrieved == [] for ftp in fake_ftp.instances)
+    pool.close()
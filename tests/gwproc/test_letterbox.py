@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+
+from utils.letterbox import Letterbox
+
+
+def reference(image, new_shape, swapRB):
+    # Former ImageHandler.prepare_input.
+    h, w = image.shape[:2]
+    r = min(new_shape[0] / h, new_shape[1] / w, 1)
+    new_unpad = int(round(h * r)), int(round(w * r))
+    dh, dw = (new_shape[0] - new_unpad[0]) / 2, (new_shape[1] - new_unpad[1]) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+
+    image = cv2.resize(image, (new_unpad[1], new_unpad[0]))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    if swapRB:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image = image / 255.0
+    image = image.transpose(2, 0, 1)[::-1]
+    return image[np.newaxis, :, :, :].astype(np.float32)
+
+
+def make_image(h, w, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+# Odd padding on either axis, downscale, exact fit.
+SIZES = [(300, 401), (401, 300), (1080, 1920), (1001, 777), (640, 640)]
+
+
+@pytest.mark.parametrize("swapRB", [True, False])
+@pytest.mark.parametrize("size", SIZES)
+def test_match_reference(size, swapRB):
+    image = make_image(*size)
+    engine = Letterbox((640, 640))
+
+    tensor, params = engine(image, swapRB=swapRB)
+    assert tensor.dtype == np.float32
+    np.testing.assert_array_equal(tensor, reference(image, (640, 640), swapRB))
+    assert (params.src_h, params.src_w) == size
+
+
+@pytest.mark.parametrize("swapRB", [True, False])
+def test_batch(swapRB):
+    images = [make_image(h, w, seed=i) for i, (h, w) in enumerate(SIZES[:3])]
+    engine = Letterbox((320, 320))
+
+    # Slots past images are zero, even if buffer held an earlier frame there.
+    engine.batch(images, swapRB=swapRB)
+    buf, params = engine.batch(images[:2], swapRB=swapRB, n=4)
+    assert buf.shape == (4, 3, 320, 320)
+    assert len(params) == 2
+    for i, image in enumerate(images[:2]):
+        np.testing.assert_array_equal(buf[i:i + 1], reference(image, (320, 320), swapRB))
+    assert not buf[2:].any()
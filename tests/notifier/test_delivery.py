@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import httpx
+
+from gw.callbacks import CallbackRetry, DeliveryStats
+from gw.redis_keys import RedisKeys
+from notifier.delivery import CoalescingDeliverer
+
+CALLBACK = "http://client/cb"
+
+
+class FakeTaskPool:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, tid):
+        self.deleted.append(tid)
+
+
+class Deliverer(CoalescingDeliverer):
+    # Results come from test, not task pool.
+    def _read_task(self, tid):
+        return (CALLBACK, {"id": tid})
+
+
+def make_deliverer(rdb, handler, **kws):
+    taskpool = FakeTaskPool()
+    d = Deliverer(taskpool, CallbackRetry(rdb), DeliveryStats(), **kws)
+    d._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return d, taskpool
+
+
+def payload(req):
+    return json.loads(req.content)
+
+
+def test_deliver_in_order(fake_async_redis_client):
+    async def run():
+        requests = []
+
+        def handler(req):
+            requests.append(payload(req))
+            return httpx.Response(200)
+
+        d, taskpool = make_deliverer(fake_async_redis_client, handler, window_ms=20, max_batch=8)
+        await asyncio.gather(*[d.deliver(f"t{i}") for i in range(4)])
+
+        # Client without batch url gets results one by one, in order.
+        assert requests == [{"id": f"t{i}"} for i in range(4)]
+        assert taskpool.deleted == ["t0", "t1", "t2", "t3"]
+
+        # Worker exits after an idle window.
+        await asyncio.sleep(0.1)
+        assert d._workers == set() and d._queues == {}
+
+    asyncio.run(run())
+
+
+def test_batch_url_discovered(fake_async_redis_client):
+    async def run():
+        requests = []
+
+        def handler(req):
+            requests.append((req.url.path, payload(req)))
+            return httpx.Response(200, headers={CoalescingDeliverer.BATCH_URL_HEADER: "/batch"})
+
+        d, taskpool = make_deliverer(fake_async_redis_client, handler, window_ms=20, max_batch=2)
+        await d.deliver("t0")
+        assert requests == [("/cb", {"id": "t0"})]
+
+        # Batches up to max batch go to batch url, single one to callback.
+        await asyncio.gather(*[d.deliver(f"t{i}") for i in range(1, 4)])
+        assert requests[1:] == [
+            ("/batch", [{"id": "t1"}, {"id": "t2"}]),
+            ("/cb", {"id": "t3"}),
+        ]
+        assert taskpool.deleted == ["t0", "t1", "t2", "t3"]
+
+    asyncio.run(run())
+
+
+def test_partial_failure_retried_in_order(fake_async_redis_client):
+    async def run():
+        def handler(req):
+            return httpx.Response(200 if payload(req)["id"] == "t0" else 503)
+
+        d, taskpool = make_deliverer(fake_async_redis_client, handler, window_ms=20, max_batch=8)
+        await asyncio.gather(*[d.deliver(f"t{i}") for i in range(4)])
+
+        # Rest of batch retried after first failure, in order of batch.
+        assert taskpool.deleted == ["t0"]
+        due = await fake_async_redis_client.zrange(RedisKeys.callback_retry, 0, -1)
+        assert due == [b"t1", b"t2", b"t3"]
+
+    asyncio.run(run())
+
+
+def test_send_error_reschedules_batch(fake_async_redis_client):
+    async def run():
+        d, taskpool = make_deliverer(
+            fake_async_redis_client, lambda req: httpx.Response(200), window_ms=20
+        )
+
+        async def broken(url, payload):
+            raise RuntimeError("boom")
+
+        d._post = broken
+        await asyncio.gather(d.deliver("t0"), d.deliver("t1"))
+        due = await fake_async_redis_client.zrange(RedisKeys.callback_retry, 0, -1)
+        assert due == [b"t0", b"t1"]
+
+        # Retry not scheduled either, delivery fails so message stays pending.
+        async def retry_broken(tid, now=None):
+            raise ConnectionError("redis gone")
+
+        d._retry.retry = retry_broken
+        results = await asyncio.gather(d.deliver("t2"), return_exceptions=True)
+        assert isinstance(results[0], ConnectionError)
+
+    asyncio.run(run())
@@ -1,12 +1,14 @@
+import asyncio
 from contextlib import asynccontextmanager
 
-import redis
+import redis.asyncio as aioredis
 from fastapi import FastAPI
 from loguru import logger
 
+from gw.admission import AdmissionControl
+from gw.aiostreams import AsyncStreams
+from gw.aiotasks import AsyncTaskPool, TaskWatcher
 from gw.settings import get_app_settings
-from gw.streams import Streams
-from gw.tasks import TaskPool
 
 from . import endpoints
 
@@ -17,22 +19,48 @@ async def lifespan(app: FastAPI):
     logger.info(f"load app settings: {conf.model_dump()}")
     app.state.app_settings = conf
 
-    rdb = redis.Redis(host=conf.redis_host,
-                      port=conf.redis_port,
-                      db=conf.redis_db)
+    # All requests share one pool, so ingest never waits a new connection.
+    pool = aioredis.ConnectionPool(
+        host=conf.redis_host,
+        port=conf.redis_port,
+        db=conf.redis_db,
+        max_connections=conf.webapp_redis_max_connections,
+    )
+    rdb = aioredis.Redis(connection_pool=pool)
     logger.info("connect redis")
     app.state.redis_connection = rdb
 
-    taskpool = TaskPool(connection_pool=rdb.connection_pool,
-                        task_ttl=conf.task_lifetime_s)
+    stream = AsyncStreams(rdb).task_create
+    await stream.ensure_group()
+    app.state.stream = stream
+
+    taskpool = AsyncTaskPool(rdb, stream, task_ttl=conf.task_lifetime_s)
     app.state.taskpool = taskpool
 
-    stream = Streams(connection_pool=rdb.connection_pool).task_create
-    app.state.stream = stream
+    admission = AdmissionControl(
+        rdb,
+        max_runner=conf.runner_slot_num,
+        max_pending=conf.webapp_admit_max_pending,
+        max_wait_s=conf.webapp_admit_max_wait_s,
+        busy_ratio=conf.webapp_admit_busy_ratio,
+        refresh_ms=conf.webapp_admit_refresh_ms,
+    )
+    app.state.admission = admission
+
+    # Wake requests waiting for task results.
+    watcher = TaskWatcher(rdb)
+    app.state.watcher = watcher
+    watching = asyncio.create_task(watcher.run())
 
     yield
 
-    rdb.close()
+    watching.cancel()
+    try:
+        await watching
+    except asyncio.CancelledError:
+        pass
+    await rdb.aclose()
+    await pool.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
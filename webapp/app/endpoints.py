@@ -1,12 +1,16 @@
+from typing import List, Optional
+
 import redis
 from fastapi import APIRouter, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from loguru import logger
 
 from gw import models
+from gw.admission import AdmissionControl
+from gw.aiostreams import AsyncRedisStream
+from gw.aiotasks import AsyncTaskPool, TaskWatcher
+from gw.redis_keys import RedisKeys
 from gw.settings import AppSettings
-from gw.streams import RedisStream
-from gw.tasks import TaskPool
 
 router = APIRouter()
 
@@ -15,31 +19,69 @@ def get_global_config(req: Request) -> AppSettings:
     return req.app.state.app_settings
 
 
-def get_task_pool(req: Request) -> TaskPool:
+def get_task_pool(req: Request) -> AsyncTaskPool:
     return req.app.state.taskpool
 
 
-def get_task_create_stream(req: Request) -> RedisStream:
+def get_task_create_stream(req: Request) -> AsyncRedisStream:
     return req.app.state.stream
 
 
+def get_task_watcher(req: Request) -> TaskWatcher:
+    return req.app.state.watcher
+
+
+def get_admission(req: Request) -> AdmissionControl:
+    return req.app.state.admission
+
+
+async def admit(
+    req: Request, tasks: List[models.CreateInferenceTaskRequest]
+) -> Optional[Response]:
+    # Return response refusing tasks if overloaded, None if admitted.
+    if not get_global_config(req).webapp_admission:
+        return None
+
+    model_ids = [m for t in tasks for obj in t.object_list for m in obj.type_list]
+    try:
+        retry_after = await get_admission(req).check(model_ids)
+    except redis.ConnectionError as e:
+        logger.error(f"read load status error, {str(e)}")
+        return Response(content="redis disconnected", status_code=500)
+
+    if retry_after is None:
+        return None
+    logger.warning(f"overloaded, refuse {len(tasks)} task(s), retry after {retry_after}s")
+    return Response(
+        content="overloaded", status_code=503, headers={"Retry-After": str(retry_after)}
+    )
+
+
+def make_callback(task: models.CreateInferenceTaskRequest) -> str:
+    # Make callback url, it has a static form/.
+    return "http://{}:{}/picAnalyseRetNotify".format(
+        task.request_host_ip, task.request_host_port
+    )
+
+
 @router.post("/picAnalyse")
 async def create_task(task: models.CreateInferenceTaskRequest, req: Request):
 
     logger.info("receive inference request.")
     logger.debug(f"request body: {task.model_dump()}")
 
-    # Make callback url, it has a static form/.
-    callback = "http://{}:{}/picAnalyseRetNotify".format(
-        task.request_host_ip, task.request_host_port
-    )
+    refused = await admit(req, [task])
+    if refused is not None:
+        return refused
+
+    callback = make_callback(task)
     logger.info(f"callback path: {callback}")
 
+    # Task and its dispatch message are written in one round trip.
     try:
-        t = get_task_pool(req).new(
+        await get_task_pool(req).new(
             task_id=task.request_id, callback=callback, raw_request=task
         )
-        get_task_create_stream(req).publish({"task_id": t.task_id})
         logger.info(f"push new inference task to queue. request id: {task.request_id}")
 
     except redis.ConnectionError as e:
@@ -49,6 +91,84 @@ async def create_task(task: models.CreateInferenceTaskRequest, req: Request):
     return Response(status_code=200)
 
 
+@router.post("/picAnalyse/bulk")
+async def create_tasks(tasks: List[models.CreateInferenceTaskRequest], req: Request):
+
+    logger.info(f"receive {len(tasks)} inference request(s).")
+
+    limit = get_global_config(req).webapp_bulk_max_tasks
+    if len(tasks) > limit:
+        return Response(content=f"at most {limit} tasks a request", status_code=413)
+
+    refused = await admit(req, tasks)
+    if refused is not None:
+        return refused
+
+    # All tasks are created or none, client can resubmit whole batch on error.
+    try:
+        await get_task_pool(req).new_many(
+            [(t.request_id, make_callback(t), t) for t in tasks]
+        )
+        logger.info(f"push {len(tasks)} new inference task(s) to queue.")
+
+    except redis.ConnectionError as e:
+        logger.error(f"create new tasks error, {str(e)}")
+        return Response(content="redis disconnected", status_code=500)
+
+    return Response(status_code=200)
+
+
+@router.get("/tasks/{task_id}")
+async def query_task(task_id: str, req: Request, wait: float = 0):
+    # Wait result for at most wait seconds, then return status whatever.
+    # Task is gone after its result delivered by callback.
+    timeout = min(max(wait, 0), get_global_config(req).webapp_longpoll_max_s)
+    status = None
+    async for status in get_task_pool(req).follow(task_id, get_task_watcher(req), timeout):
+        pass
+
+    if status is None:
+        return Response(content="task not found or result delivered", status_code=404)
+    return Response(
+        content=status.model_dump_json(by_alias=True), media_type="application/json"
+    )
+
+
+@router.get("/tasks/{task_id}/events")
+async def task_events(task_id: str, req: Request):
+    # Server sent events, status event on start, on finish and every interval,
+    # close after complete or gone.
+    conf = get_global_config(req)
+    statuses = get_task_pool(req).follow(
+        task_id,
+        get_task_watcher(req),
+        conf.webapp_events_max_s,
+        interval_s=conf.webapp_events_interval_s,
+    )
+
+    async def events():
+        async for status in statuses:
+            if status is None:
+                yield "event: gone\ndata: {}\n\n"
+                return
+            yield f"event: status\ndata: {status.model_dump_json(by_alias=True)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get("/status")
+async def load_status(req: Request):
+    # Same numbers admission uses, for upstream to pace itself.
+    status = await get_admission(req).status()
+    resp = status.to_dict(AdmissionControl.DEFAULT_SERVICE_S)
+
+    # Hits and misses of result cache shared by runners.
+    rdb = req.app.state.redis_connection
+    counters = await rdb.hgetall(RedisKeys.result_cache_stats)
+    resp["result_cache"] = {k.decode(): int(v) for k, v in counters.items()}
+    return resp
+
+
 @router.post("/picAnalyseRetNotify")
 async def debug_callback(req: models.TaskResults):
     logger.debug(req.model_dump_json(by_alias=True))